@@ -1,10 +1,12 @@
 import modal
 import subprocess
-import toml
 import logging
 import os
 from pathlib import Path
 
+from image_lock import LOCK_FILE, SD_SCRIPTS_URL, TORCH_INDEX, WHEEL_PATH, clone_commands, install_locked, load_lock
+from settings import resources, validated_config
+
 # setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,6 +42,9 @@ base_image = (
 
 ##=============================##
 
+# image.lock ada (python deploy.py lock) -> wheel dari volume, repo di-pin ke sha
+IMAGE_LOCK = load_lock()
+wheel_vol = modal.Volume.from_name("kohya-wheelhouse", create_if_missing=True)
 
 kohya_image = (
     base_image
@@ -104,33 +109,134 @@ kohya_image = (
     ], gpu="any")
 )
 
+if IMAGE_LOCK:
+    kohya_image = (
+        base_image
+        .env({
+            "KOHYA_VERSION_DATE": "2025-01-15",
+            "LD_PRELOAD": "/usr/lib/x86_64-linux-gnu/libtcmalloc.so.4",
+        })
+        # wheels first: a new kohya/sd-scripts pin doesn't reinstall torch
+        .add_local_python_source("image_lock", copy=True)
+        .run_function(
+            install_locked,
+            volumes={WHEEL_PATH: wheel_vol},
+            kwargs={"requirements": IMAGE_LOCK["wheels"]["requirements"], "fallback_index": TORCH_INDEX},
+        )
+        .run_commands([
+            *clone_commands(KOHYA_REPO_URL, IMAGE_LOCK["repos"]["kohya_ss"], "/kohya_ss"),
+            *clone_commands(SD_SCRIPTS_URL, IMAGE_LOCK["repos"]["sd_scripts"], "/kohya_ss/sd-scripts"),
+            "accelerate config default",
+            "python -c 'import torch; print(f\"torch: {torch.__version__}\")'",
+            "python -c 'import xformers; print(f\"xformers: {xformers.__version__}\")'",
+            "rm -rf /tmp/pip-cache && mkdir -p /kohya_ss/models /kohya_ss/dataset /kohya_ss/outputs /kohya_ss/configs",
+        ])
+        .workdir("/kohya_ss")
+    )
+
+kohya_image = (
+    kohya_image
+      ##==========precompile + warm imports==========##
+      # pyc for site-packages + kohya trees, import profile at /kohya_ss/.build
+    .add_local_file(
+        Path(__file__).parent / "warmup_imports.py", "/opt/warmup_imports.py", copy=True
+    )
+    .run_commands([
+        "python /opt/warmup_imports.py --out /kohya_ss/.build",
+    ])
+)
+
 
 
 
 CONFIG_FILE = Path(__file__).parent / "config.toml"
 
-try:
-    if CONFIG_FILE.exists():
-        config = toml.load(CONFIG_FILE)
-    else:
-        config = {}
-        
-    modal_settings = config.get('modal_settings', {})
-    kohya_settings = config.get('kohya_settings', {})
-    ALLOW_CONCURRENT_INPUTS = modal_settings.get('allow_concurrent_inputs', 10)
-    scaledown_window = modal_settings.get('scaledown_window', 600)
-    TIMEOUT = modal_settings.get('timeout', 3600)
-    GPU_CONFIG = modal_settings.get('gpu', "A10G")
-    PORT = kohya_settings.get('port', 8000)
-    
-except Exception as e:
-    ALLOW_CONCURRENT_INPUTS = 5
-    scaledown_window = 300 #depreciations fix
-    TIMEOUT = 1800
-    GPU_CONFIG = "A10G"
-    PORT = 8000
+# validated + defaults filled in, a bad value fails the deploy (config_schema.py)
+config = validated_config(CONFIG_FILE)
+modal_settings = config['modal_settings']
+kohya_settings = config['kohya_settings']
+ALLOW_CONCURRENT_INPUTS = modal_settings['allow_concurrent_inputs']
+scaledown_window = modal_settings['scaledown_window']
+GPU_CONFIG = modal_settings['gpu']
+PORT = kohya_settings['port']
+LAUNCH_MODE = kohya_settings['launch_mode']
+ENABLE_BUCKET_MANAGER = kohya_settings['enable_bucket_manager']
+ENABLE_MODEL_CONVERTER = kohya_settings['enable_model_converter']
+MAX_MODELS = kohya_settings['max_models']
+MAX_MODELS_GB = kohya_settings['max_models_gb']
+CACHE_MODELS = config['optimization']['cache_models']
+PREFETCH_MODELS = config['optimization']['prefetch_models']
+STAGE_DATASETS = kohya_settings['stage_datasets']
+TRAIN_WORKERS = kohya_settings['train_workers']
+PREEMPT_MARGIN = kohya_settings['preempt_margin']
+MAX_RESUMES = kohya_settings['max_resumes']
+retention_settings = config['retention']
+RETENTION_MAX_AGE_DAYS = retention_settings['max_age_days']
+RETENTION_KEEP_LAST = retention_settings['keep_last_checkpoints']
+RETENTION_QUOTA_GB = retention_settings['quota_gb']
+telemetry_settings = config['telemetry']
+TELEMETRY_ENABLED = telemetry_settings['enabled']
+TELEMETRY_PORT = telemetry_settings['port']
+TELEMETRY_INTERVAL = telemetry_settings['interval']
+TELEMETRY_HISTORY = telemetry_settings['history']
+TELEMETRY_BACKEND = telemetry_settings['backend']
+WARM_POOL = config['warm_pool']
+
+# resource profiles per function group, see [profiles.*] in config.toml
+PROFILES = config['profiles']
+GUI_RESOURCES = resources("gui", config)
+TRAIN_RESOURCES = resources("train", config)
+CAPTION_RESOURCES = resources("caption", config)
+DATA_RESOURCES = resources("data", config)
+DOWNLOAD_RESOURCES = resources("download", config)
+CONVERT_RESOURCES = resources("convert", config)
+EXTRACT_RESOURCES = resources("extract", config)
+CLEANUP_RESOURCES = resources("cleanup", config)
+EXPORT_RESOURCES = resources("export", config)
+# queue fan-out ngikut cap container-nya train profile
+TRAIN_WORKERS = TRAIN_RESOURCES.get('max_containers', TRAIN_WORKERS)
+# deadline preempt harus pake timeout asli train_job, bukan modal_settings
+TRAIN_TIMEOUT = TRAIN_RESOURCES['timeout']
+
+# local helper modules go in last, editing them doesn't rebuild kohya_image
+app_image = (
+    kohya_image
+    .pip_install("zstandard")  # export chunks
+    .add_local_file(CONFIG_FILE, "/root/config.toml")
+    .add_local_python_source(
+        "blobstore",
+        "bucket_manager",
+        "captioner",
+        "config_schema",
+        "dataset_sync",
+        "downloader",
+        "exporter",
+        "gui_launcher",
+        "health",
+        "image_lock",
+        "latent_cache",
+        "lazy_loader",
+        "model_converter",
+        "model_registry",
+        "preempt",
+        "preprocess",
+        "retention",
+        "safetensors_io",
+        "settings",
+        "shards",
+        "staging",
+        "sweep",
+        "telemetry",
+        "train_queue",
+        "uploader",
+        "warm_pool",
+    )
+)
+# container juga baca lock yang sama, definisi image-nya harus identik
+if LOCK_FILE.exists():
+    app_image = app_image.add_local_file(LOCK_FILE, "/root/image.lock")
 
-app = modal.App(name="kohya-ss-gui", image=kohya_image)
+app = modal.App(name="kohya-ss-gui", image=app_image)
 
 ##============PATH=============##
 
@@ -140,37 +246,37 @@ MODELS_PATH = "/kohya_ss/models"
 DATASET_PATH = "/kohya_ss/dataset"
 OUTPUTS_PATH = "/kohya_ss/outputs"
 CONFIGS_PATH = "/kohya_ss/configs"
+LATENT_CACHE_PATH = "/kohya_ss/latent_cache"
+DATASET_MOUNT = "/mnt/kohya-dataset"
+QUEUE_PATH = "/kohya_ss/configs/.queue"
 ##################VOLUME####################
 cache_vol = modal.Volume.from_name("hf-cache", create_if_missing=True)
 models_vol = modal.Volume.from_name("kohya-models", create_if_missing=True)
 dataset_vol = modal.Volume.from_name("kohya-dataset", create_if_missing=True)
 outputs_vol = modal.Volume.from_name("kohya-outputs", create_if_missing=True)
 configs_vol = modal.Volume.from_name("kohya-configs", create_if_missing=True)
+latent_cache_vol = modal.Volume.from_name("kohya-latent-cache", create_if_missing=True)
+# url tunnel telemetry container gui yang lagi jalan
+telemetry_dict = modal.Dict.from_name("kohya-telemetry", create_if_missing=True)
+TELEMETRY = {}
 
 @app.function(
-    gpu=GPU_CONFIG,
-    timeout=TIMEOUT,
-    scaledown_window=scaledown_window,
+    **GUI_RESOURCES,
     volumes={
         CACHE_PATH: cache_vol,
         MODELS_PATH: models_vol,
-        "/mnt/kohya-dataset": dataset_vol,  # mount langsung
+        DATASET_MOUNT: dataset_vol,  # mount langsung
         OUTPUTS_PATH: outputs_vol,
         CONFIGS_PATH: configs_vol,
+        LATENT_CACHE_PATH: latent_cache_vol,
     },
-    memory=8192,
-    cpu=4,
-    max_containers=1,
 )
 @modal.web_server(PORT, startup_timeout=300)
-@modal.concurrent(max_inputs=ALLOW_CONCURRENT_INPUTS)
+@modal.concurrent(max_inputs=PROFILES['gui']['concurrency'])
 def run_kohya_gui():
-    import torch, os, subprocess
-
-    print(f"pytorch version: {torch.__version__}")
-    print(f"cuda available: {torch.cuda.is_available()}")
-    if torch.cuda.is_available():
-        print(f"gpu name: {torch.cuda.get_device_name(0)}")
+    import os
+    from gui_launcher import launch
+    from staging import stage_in_background
 
     os.environ["HF_HOME"] = CACHE_PATH
     os.environ["TRANSFORMERS_CACHE"] = CACHE_PATH
@@ -178,64 +284,738 @@ def run_kohya_gui():
     for path in [MODELS_PATH, DATASET_PATH, OUTPUTS_PATH, CONFIGS_PATH]:
         os.makedirs(path, exist_ok=True)
 
-    cmd = (
-        f"cd {KOHYA_BASE} && "
-        f"accelerate launch --num_cpu_threads_per_process=4 kohya_gui.py "
-        f"--listen 0.0.0.0 --server_port {PORT} --share --headless --noverify"
-    )
-    print(f"starting kohya with: {cmd}")
+    # volume -> disk lokal di background, port gui kebuka sambil nunggu.
+    # shard di-expand + latent cache dipasang setelah staging selesai
+    def after_staging():
+        expand_dataset_shards(DATASET_MOUNT, DATASET_PATH, STAGE_DATASETS or None)
+        install_latent_caches(DATASET_PATH)
+
+    stage_in_background(DATASET_MOUNT, DATASET_PATH, STAGE_DATASETS or None, after=after_staging)
 
     try:
-        process = subprocess.Popen(cmd, shell=True)
-        process.wait()
+        start_status_server()
+    except Exception as e:
+        print(f"telemetry/health server disabled: {e}")
+
+    try:
+        launch(
+            KOHYA_BASE,
+            PORT,
+            ["--share", "--headless", "--noverify"],
+            mode=LAUNCH_MODE,
+            timeout=290,  # stay under web_server startup_timeout
+            history=f"{OUTPUTS_PATH}/.startup/history.jsonl",
+        )
     except Exception as e:
         print(f"error starting kohya: {e}")
         raise
 
+def gui_health_checks(sampler):
+    """checks behind /healthz, all cheap reads of state this process already has."""
+    import sys
+    from gui_launcher import last_report
+    from health import mount_status, port_open
+    from staging import get_status
+    from train_queue import JobQueue
+
+    def gui():
+        startup = last_report()
+        return {"ok": port_open(PORT), "port": PORT, "startup_s": startup.get("total"), "mode": startup.get("mode")}
+
+    def gpu():
+        latest = sampler.latest()
+        if latest and latest["gpus"]:
+            gpus = [{k: g[k] for k in ("name", "util", "mem_used_mb", "mem_total_mb")} for g in latest["gpus"]]
+            return {"ok": True, "source": sampler.backend.name, "gpus": gpus}
+        # sampler off: gui_launcher udah import torch + init cuda
+        torch = sys.modules.get("torch")
+        count = torch.cuda.device_count() if torch is not None and torch.cuda.is_available() else 0
+        return {"ok": count > 0, "source": "torch", "gpus": count}
+
+    def training():
+        state = sampler.parser.snapshot()
+        return {k: state[k] for k in ("active", "step", "total", "it_per_s", "loss", "epoch", "epochs")}
+
+    def queue():
+        jobs = JobQueue(QUEUE_PATH)
+        running = [job["id"] for job in jobs.list() if job["status"] == "running"]
+        return {"counts": jobs.counts(), "running": running}
+
+    def staging():
+        status = get_status()
+        return {"ok": status.get("state") != "failed", "state": status.get("state")}
+
+    return {
+        "gui": gui,
+        "gpu": gpu,
+        "training": training,
+        "queue": queue,
+        "staging": staging,
+        "volumes": lambda: mount_status([MODELS_PATH, DATASET_MOUNT, OUTPUTS_PATH, CONFIGS_PATH, LATENT_CACHE_PATH]),
+    }
+
+
+def start_status_server():
+    """telemetry + /healthz server in this container, public via a tunnel.
+
+    sebelum launch, biar output trainer yang di-start gui ikut ke-tee.
+    with [telemetry] enabled = false only /healthz is served.
+    """
+    import json
+    import time
+    from health import Health
+    from telemetry import LogParser, NullBackend, Sampler, capture_output, gpu_backend, serve
+
+    parser = LogParser()
+    if TELEMETRY_ENABLED:
+        capture_output("/tmp/kohya_gui.log", parser.feed)
+        sampler = Sampler(gpu_backend(TELEMETRY_BACKEND), parser, TELEMETRY_INTERVAL, TELEMETRY_HISTORY).start()
+    else:
+        sampler = Sampler(NullBackend(), parser)
+    health = Health(gui_health_checks(sampler), required=("gui", "gpu", "volumes")).start()
+
+    def healthz(query):
+        report = health.report()
+        return (200 if report["ready"] else 503), "application/json", json.dumps(report)
+
+    TELEMETRY.update(sampler=sampler, health=health)
+    TELEMETRY["server"] = serve(sampler, TELEMETRY_PORT, routes={"/healthz": healthz})
+    # port kedua ga lewat web_server, tunnel dibiarin kebuka selama container hidup
+    tunnel = modal.forward(TELEMETRY_PORT).__enter__()
+    TELEMETRY["tunnel"] = tunnel
+    telemetry_dict["gui"] = {"url": tunnel.url, "started": time.time(), "backend": sampler.backend.name}
+    print(f"telemetry: {tunnel.url}/metrics, {tunnel.url}/healthz ({sampler.backend.name})")
+    return sampler
+
+
+def expand_dataset_shards(mount_root, local_root, names=None):
+    """expand <mount>/.shards/<name> into local_root/<name>, only where staging can't.
+
+    pack_dataset keeps the loose files, so a dataset still loose on the
+    volume was already staged; only shard-only datasets get expanded, and
+    only once per pack (marker holds the index's created stamp).
+    """
+    import json
+    from shards import INDEX_NAME, expand
+
+    shards_root = os.path.join(mount_root, ".shards")
+    if not os.path.isdir(shards_root):
+        return
+    for name in names or sorted(os.listdir(shards_root)):
+        shard_dir = os.path.join(shards_root, name)
+        if not os.path.exists(os.path.join(shard_dir, INDEX_NAME)):
+            continue
+        if os.path.isdir(os.path.join(mount_root, name)):
+            continue  # loose copy ada di volume, udah di-stage
+        marker = os.path.join(local_root, name, ".shards_expanded.json")
+        try:
+            with open(os.path.join(shard_dir, INDEX_NAME)) as f:
+                created = json.load(f).get("created")
+            with open(marker) as f:
+                if json.load(f).get("created") == created:
+                    continue
+        except (OSError, ValueError):
+            pass
+        try:
+            report = expand(shard_dir, os.path.join(local_root, name))
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, "w") as f:
+                json.dump({"created": created, **report}, f)
+            print(f"expanded shards for {name}: {report}")
+        except Exception as e:
+            print(f"shard expand failed for {name}: {e}")
+
+
+def install_latent_caches(dataset_root):
+    from latent_cache import install_latest
+
+    if not os.path.isdir(dataset_root):
+        return
+    for name in sorted(os.listdir(dataset_root)):
+        dataset_dir = os.path.join(dataset_root, name)
+        if name.startswith(".") or not os.path.isdir(dataset_dir):
+            continue
+        try:
+            installed = install_latest(LATENT_CACHE_PATH, name, dataset_dir)
+            if installed:
+                print(f"latent cache for {name}: {installed}")
+        except Exception as e:
+            print(f"latent cache install failed for {name}: {e}")
+
+
+def training_model(config_path):
+    """the config's base model if it lives on the models volume, else None."""
+    import toml
+
+    try:
+        model = toml.load(config_path).get("pretrained_model_name_or_path")
+    except (OSError, ValueError):
+        return None
+    if not model or not os.path.abspath(model).startswith(MODELS_PATH + os.sep):
+        return None
+    return model
+
+
+def touch_training_model(config_path):
+    """mark the config's base model as used, so lru eviction keeps it."""
+    from model_registry import ModelRegistry
+
+    model = training_model(config_path)
+    if model is None:
+        return None
+    registry = ModelRegistry(MODELS_PATH)
+    name = registry.touch(path=model)
+    if name:
+        registry.save()
+        models_vol.commit()
+    return name
+
+
+def register_model(name, paths, **info):
+    """record a model in the registry, then evict lru models past max_models."""
+    from blobstore import BlobStore
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(MODELS_PATH)
+    registry.register(name, paths, **info)
+    store = BlobStore(MODELS_PATH)
+    evicted = registry.enforce(MAX_MODELS, int(MAX_MODELS_GB * 1024 ** 3), keep={name}, store=store)
+    store.save()
+    registry.save()
+    return evicted
+
+
+##============HEADLESS TRAINING============##
+# gui cuma 1 container, job headless antri di configs volume terus
+# fan out ke max TRAIN_WORKERS gpu container, 1 job per container
+@app.function(
+    **TRAIN_RESOURCES,
+    volumes={
+        CACHE_PATH: cache_vol,
+        MODELS_PATH: models_vol,
+        DATASET_MOUNT: dataset_vol,
+        OUTPUTS_PATH: outputs_vol,
+        CONFIGS_PATH: configs_vol,
+        LATENT_CACHE_PATH: latent_cache_vol,
+    },
+)
+def train_job(job: dict, shared: dict = None):
+    """run one queued job: stage the dataset, then sd-scripts with its toml.
+
+    shared (from sweep.shared_inputs) names the dataset and latent caches
+    up front, so sweep trials only stage that dataset and install those
+    caches instead of rescanning everything.
+    """
+    import os
+    import time
+    from preempt import state_dir_for
+    from staging import stage
+    from train_queue import run_trainer, train_command
+
+    started = time.time()
+    os.environ["HF_HOME"] = CACHE_PATH
+    configs_vol.reload()  # toml bisa baru aja diupload
+    # state disimpan sebelum timeout, run berikutnya lanjut dari situ
+    state_dir = state_dir_for(f"{OUTPUTS_PATH}/.resume", job["config"])
+    command = train_command(
+        job, KOHYA_BASE, CONFIGS_PATH, state_dir=state_dir, deadline=started + TRAIN_TIMEOUT - PREEMPT_MARGIN
+    )
+    config = command[command.index("--config_file") + 1]
+    if not os.path.exists(config):
+        return {"returncode": 2, "error": f"config not found: {config}"}
+    touch_training_model(config)
+
+    # base model ke page cache sambil dataset di-stage & accelerate start
+    model = training_model(config)
+    if PREFETCH_MODELS and model and model.endswith(".safetensors") and os.path.isfile(model):
+        from lazy_loader import warm_in_background
+
+        warm_in_background(model, include=None if PREFETCH_MODELS is True else PREFETCH_MODELS)
+
+    if shared and shared.get("dataset"):
+        from latent_cache import CacheDir, install
+
+        dataset = shared["dataset"]
+        # staging incremental, container yang dipake ulang ga copy lagi
+        stage(DATASET_MOUNT, DATASET_PATH, [dataset])
+        expand_dataset_shards(DATASET_MOUNT, DATASET_PATH, [dataset])
+        for params in shared["caches"].values():
+            install(CacheDir(LATENT_CACHE_PATH, dataset, params), os.path.join(DATASET_PATH, dataset))
+    else:
+        stage(DATASET_MOUNT, DATASET_PATH, STAGE_DATASETS or None)
+        expand_dataset_shards(DATASET_MOUNT, DATASET_PATH, STAGE_DATASETS or None)
+        install_latent_caches(DATASET_PATH)
+
+    result = run_trainer(
+        command,
+        f"{OUTPUTS_PATH}/.train_logs/{job['id']}.log",
+        cwd=KOHYA_BASE,
+        timeout=max(60, started + TRAIN_TIMEOUT - 60 - time.time()),  # sisain waktu buat commit
+        state_dir=state_dir,
+    )
+    outputs_vol.commit()
+    return result
+
+
+# scheduler cuma satu, cuma dia yang ubah status job
+@app.function(volumes={CONFIGS_PATH: configs_vol}, timeout=86400, max_containers=1)
+def run_training_queue(workers: int = None, wait_for_jobs: bool = False):
+    """drain the queue through train_job, highest priority first.
+
+    wait_for_jobs keeps polling for new submissions until the timeout.
+    """
+    from train_queue import JobQueue, run_queue
+
+    configs_vol.reload()
+    queue = JobQueue(QUEUE_PATH)
+    stale = queue.requeue_stale()
+    if stale:
+        print(f"queue: {stale} jobs from a previous scheduler back to pending")
+    configs_vol.commit()
+
+    def refresh():
+        try:
+            configs_vol.reload()
+        except Exception as e:
+            print(f"queue: reload skipped: {e}")
+
+    summary = run_queue(
+        queue,
+        train_job.remote,
+        workers=workers or TRAIN_WORKERS,
+        on_change=lambda job: configs_vol.commit(),
+        refresh=refresh,
+        poll=30 if wait_for_jobs else 0,
+        stop_when_empty=not wait_for_jobs,
+    )
+    return {"status": "ok", **summary}
+
+
+@app.function(
+    volumes={
+        MODELS_PATH: models_vol,
+        DATASET_PATH: dataset_vol,
+        OUTPUTS_PATH: outputs_vol,
+        CONFIGS_PATH: configs_vol,
+        LATENT_CACHE_PATH: latent_cache_vol,
+    },
+    timeout=86400,
+)
+def run_sweep(base_config: str, spec: str, sweep_id: str = None, script: str = "train_network.py"):
+    """expand a grid/random spec over a kohya toml and train every trial.
+
+    base_config is relative to the kohya-configs volume, spec is json (or a
+    dict when called from python). trials run as
+    parallel train_job calls (max train_workers containers) and the
+    results table lands in kohya-outputs/sweeps/<sweep_id>/.
+    """
+    import json
+    from blobstore import BlobStore
+    from sweep import collect, shared_inputs, write_table, write_trials
+
+    if isinstance(spec, str):
+        spec = json.loads(spec)
+    base_path = os.path.join(CONFIGS_PATH, base_config)
+    if not os.path.exists(base_path):
+        return {"status": "error", "message": f"config not found: {base_config}"}
+    try:
+        sweep = write_trials(base_path, spec, CONFIGS_PATH, OUTPUTS_PATH, sweep_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    configs_vol.commit()
+
+    # model + cache dicari sekali di sini, bukan di tiap trial
+    shared = shared_inputs(base_path, DATASET_PATH, LATENT_CACHE_PATH, BlobStore(MODELS_PATH))
+    print(f"sweep {sweep['id']}: {len(sweep['trials'])} trials, shared inputs {shared}")
+
+    jobs = [{"id": t["id"], "config": t["config"], "script": script, "args": []} for t in sweep["trials"]]
+    results = list(train_job.map(jobs, kwargs={"shared": shared}, return_exceptions=True))
+    # trial yang kena preempt/timeout lanjut dari state terakhir
+    for _ in range(MAX_RESUMES):
+        again = [i for i, r in enumerate(results) if isinstance(r, dict) and r.get("preempted")]
+        if not again:
+            break
+        print(f"sweep {sweep['id']}: resuming {len(again)} preempted trials")
+        resumed = train_job.map([jobs[i] for i in again], kwargs={"shared": shared}, return_exceptions=True)
+        for i, result in zip(again, resumed):
+            results[i] = result
+
+    outputs_vol.reload()
+    rows = collect(sweep, results)
+    table = write_table(rows, os.path.join(OUTPUTS_PATH, "sweeps", sweep["id"]))
+    outputs_vol.commit()
+    return {"status": "ok", "sweep_id": sweep["id"], "table": table, "results": rows}
+
+
+@app.function(volumes={CONFIGS_PATH: configs_vol})
+def submit_training_job(
+    config: str,
+    priority: int = 0,
+    max_retries: int = 1,
+    script: str = "train_network.py",
+    args: list = None,
+    start: bool = True,
+):
+    """queue a kohya toml from the kohya-configs volume (path relative to it).
+
+    start spawns the scheduler; if one is already running it just picks
+    the job up on its next pass.
+    """
+    from train_queue import JobQueue
+
+    configs_vol.reload()
+    if not os.path.exists(os.path.join(CONFIGS_PATH, config)):
+        return {"status": "error", "message": f"config not found: {config}"}
+    job = JobQueue(QUEUE_PATH).submit(config, priority, max_retries, script, args)
+    configs_vol.commit()
+    if start:
+        run_training_queue.spawn()
+    return {"status": "ok", "job": job}
+
+
+@app.function(volumes={CONFIGS_PATH: configs_vol})
+def training_queue_status(job_id: str = None, cancel: bool = False):
+    """all jobs (or one), cancel=True cancels job_id."""
+    from train_queue import JobQueue
+
+    configs_vol.reload()
+    queue = JobQueue(QUEUE_PATH)
+    if job_id:
+        if queue.get(job_id) is None:
+            return {"status": "error", "message": f"unknown job: {job_id}"}
+        if cancel:
+            queue.cancel(job_id)
+            configs_vol.commit()
+        return {"status": "ok", "job": queue.get(job_id)}
+    return {"status": "ok", "counts": queue.counts(), "jobs": queue.list()}
+
+
+@app.function(
+    **TRAIN_RESOURCES,
+    volumes={
+        MODELS_PATH: models_vol,
+        DATASET_PATH: dataset_vol,
+        LATENT_CACHE_PATH: latent_cache_vol,
+    },
+)
+def precompute_latent_cache(
+    dataset: str,
+    model: str,
+    resolution: int = 1024,
+    enable_bucket: bool = True,
+    min_bucket_reso: int = 256,
+    max_bucket_reso: int = 1024,
+    bucket_reso_steps: int = 64,
+    bucket_no_upscale: bool = False,
+    flip_aug: bool = False,
+    text_encoder: bool = False,
+    batch_size: int = 8,
+    vae_dtype: str = "float32",
+):
+    """encode vae latents (and sdxl te outputs) for DATASET_PATH/<dataset> once.
+
+    training launched from the gui picks the newest valid cache up at
+    container start, so the gpu run skips the encoding pass. vae_dtype
+    float16 only with an fp16-fix vae, the stock sdxl one gives NaNs.
+    """
+    import time
+    import latent_cache as lc
+    from blobstore import BlobStore
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    model_path = os.path.join(MODELS_PATH, model)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+    if not os.path.exists(model_path):
+        return {"status": "error", "message": f"model not found: {model_path}"}
+
+    fingerprint = lc.model_fingerprint(model_path, BlobStore(MODELS_PATH))
+    last_commit = [time.monotonic()]
+
+    def commit(done, total):
+        # commit sesekali biar bisa lanjut kalau container mati
+        if time.monotonic() - last_commit[0] > 60:
+            latent_cache_vol.commit()
+            last_commit[0] = time.monotonic()
+
+    params = lc.latent_params(
+        fingerprint, resolution, enable_bucket, min_bucket_reso,
+        max_bucket_reso, bucket_reso_steps, bucket_no_upscale, flip_aug, vae_dtype,
+    )
+    cache = lc.CacheDir(LATENT_CACHE_PATH, dataset, params)
+    results = [lc.precompute(dataset_dir, cache, lc.VaeEncoder(model_path, dtype=vae_dtype), batch_size, commit)]
+
+    if text_encoder:
+        cache = lc.CacheDir(LATENT_CACHE_PATH, dataset, lc.te_params(fingerprint))
+        results.append(lc.precompute(dataset_dir, cache, lc.SdxlTextEncoder(model_path), batch_size, commit))
+
+    latent_cache_vol.commit()
+    return {"status": "ok", "model_fingerprint": fingerprint, "results": results}
+
+
+@app.function(
+    **CAPTION_RESOURCES,
+    volumes={DATASET_PATH: dataset_vol, CACHE_PATH: cache_vol},
+)
+def caption_dataset(
+    dataset: str,
+    model: str = "wd14",
+    batch_size: int = 64,
+    threshold: float = 0.35,
+    prefix: str = "",
+    overwrite: bool = False,
+    workers: int = None,
+):
+    """.txt captions for every image in DATASET_PATH/<dataset> that has none.
+
+    model: wd14 (tags), blip (sentences) or dummy. cpu workers decode,
+    the gpu tags in batches; rerun to resume after an interruption.
+    """
+    import time
+    import captioner
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+    options = {"threshold": threshold} if model == "wd14" else {}
+    if model != "dummy":
+        options["cache_dir"] = os.path.join(CACHE_PATH, "captioners")
+    try:
+        tagger = captioner.make_model(model, **options)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    cache_vol.commit()
+
+    last_commit = [time.monotonic()]
+
+    def commit(done, total):
+        # commit sesekali biar caption yang udah jadi ga ilang kalau container mati
+        if time.monotonic() - last_commit[0] > 60:
+            dataset_vol.commit()
+            last_commit[0] = time.monotonic()
+
+    report = captioner.caption_dataset(
+        dataset_dir, tagger, batch_size, workers or int(PROFILES["caption"]["cpu"]),
+        overwrite=overwrite, prefix=prefix, on_progress=commit,
+    )
+    dataset_vol.commit()
+    return {"status": "ok", **report}
+
+
+# bucket planning di cpu, trainer ga perlu buka 100k gambar di gpu container
+@app.function(volumes={DATASET_PATH: dataset_vol}, **DATA_RESOURCES)
+def plan_dataset_buckets(
+    dataset: str,
+    resolution: int = 1024,
+    enable_bucket: bool = True,
+    min_bucket_reso: int = 256,
+    max_bucket_reso: int = 1024,
+    bucket_reso_steps: int = 64,
+    bucket_no_upscale: bool = False,
+    write_metadata: str = None,
+):
+    """header-only bucket index at DATASET_PATH/<dataset>/.bucket_index.json.
+
+    write_metadata: optional json name inside the dataset folder, gets
+    train_resolution per image for sd-scripts --in_json.
+    """
+    from bucket_manager import bucket_params, load_index, plan_buckets, write_kohya_metadata
+
+    if not ENABLE_BUCKET_MANAGER:
+        return {"status": "disabled", "message": "kohya_settings.enable_bucket_manager is false"}
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+
+    params = bucket_params(
+        resolution, enable_bucket, min_bucket_reso,
+        max_bucket_reso, bucket_reso_steps, bucket_no_upscale,
+    )
+    report = plan_buckets(dataset_dir, params)
+    if write_metadata:
+        meta_path = os.path.join(dataset_dir, write_metadata)
+        report["metadata"] = write_kohya_metadata(dataset_dir, load_index(dataset_dir), meta_path)
+    dataset_vol.commit()
+    return {"status": "ok", **report}
+
+
+@app.function(volumes={DATASET_PATH: dataset_vol}, **DATA_RESOURCES)
+def preprocess_dataset(
+    dataset: str,
+    resolution: int = 1024,
+    image_format: str = None,
+    quality: int = 95,
+    enable_bucket: bool = True,
+    min_bucket_reso: int = 256,
+    max_bucket_reso: int = 1024,
+    bucket_reso_steps: int = 64,
+    bucket_no_upscale: bool = False,
+):
+    """downscale/re-encode/validate DATASET_PATH/<dataset> on all cores.
+
+    image_format: png/jpg/webp, None keeps each file's format. corrupt
+    files land in <dataset>/.quarantine, reruns skip unchanged files.
+    """
+    import time
+    from preprocess import preprocess_dataset as run, preprocess_params
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+
+    params = preprocess_params(
+        resolution, image_format, quality, enable_bucket,
+        min_bucket_reso, max_bucket_reso, bucket_reso_steps, bucket_no_upscale,
+    )
+    last_commit = [time.monotonic()]
+
+    def progress(done, total):
+        print(f"preprocess: {done}/{total}")
+        if time.monotonic() - last_commit[0] > 60:
+            dataset_vol.commit()
+            last_commit[0] = time.monotonic()
+
+    report = run(dataset_dir, params, on_progress=progress)
+    dataset_vol.commit()
+    return {"status": "ok", **report}
+
+
+# dataset jadi beberapa tar shard + index, kurangin metadata ops di volume
+@app.function(volumes={DATASET_PATH: dataset_vol}, **DATA_RESOURCES)
+def pack_dataset(dataset: str, shard_size_mb: int = 1024):
+    """pack DATASET_PATH/<dataset> into DATASET_PATH/.shards/<dataset>.
+
+    the gui container expands these onto local disk at startup.
+    """
+    from shards import pack
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+    out_dir = os.path.join(DATASET_PATH, ".shards", dataset)
+    index = pack(dataset_dir, out_dir, shard_size_mb * 1024 * 1024)
+    dataset_vol.commit()
+    return {
+        "status": "ok",
+        "path": out_dir,
+        "samples": len(index["samples"]),
+        "shards": index["shards"],
+    }
+
+
+@app.function(volumes={DATASET_PATH: dataset_vol}, **DATA_RESOURCES)
+def benchmark_dataset_shards(dataset: str, shard_size_mb: int = 256):
+    """loose files vs mmapped shards on the dataset volume, work dir in /tmp."""
+    import tempfile
+    from shards import benchmark_roundtrip
+
+    dataset_dir = os.path.join(DATASET_PATH, dataset)
+    if not os.path.isdir(dataset_dir):
+        return {"status": "error", "message": f"dataset not found: {dataset_dir}"}
+    with tempfile.TemporaryDirectory() as work_dir:
+        report = benchmark_roundtrip(dataset_dir, work_dir, shard_size_mb * 1024 * 1024)
+    return {"status": "ok", **report}
+
+
 #dataset downlaod
 
 @app.function(
     secrets=[modal.Secret.from_name("huggingface-secret")],
     volumes={DATASET_PATH: dataset_vol},
+    **DOWNLOAD_RESOURCES,
 )
-def download_hf_dataset(repo_id: str, allow_patterns: str = "*", repo_type: str = "dataset"):
-    from huggingface_hub import snapshot_download, login
-    import os
+def download_hf_dataset(repo_id: str, allow_patterns: str = "*", repo_type: str = "dataset", revision: str = "main"):
+    """incremental sync of a hub repo into the dataset volume (see dataset_sync.py).
+
+    only files added/changed since the last synced revision are fetched,
+    files removed upstream are deleted. allow_patterns: comma separated.
+    """
+    from blobstore import BlobStore
+    from dataset_sync import store_hooks, sync
+    from settings import sync_workers
 
-    # login otomatis pake token dari secret
-    hf_token = os.environ["HF_TOKEN"]
-    login(token=hf_token)
-
-    local_dir = snapshot_download(
-        repo_id=repo_id,
-        repo_type=repo_type,
-        local_dir=DATASET_PATH,
-        allow_patterns=allow_patterns,
-        resume_download=True,   # lanjutin download kalau putus
-        max_workers=2           # batasi worker biar ga 429
+    start_workers, max_workers = sync_workers()
+    patterns = [p.strip() for p in allow_patterns.split(",")] if isinstance(allow_patterns, str) else list(allow_patterns)
+    # isi yang udah pernah ada di volume di-link, ga didownload lagi
+    store = BlobStore(DATASET_PATH)
+    report = sync(
+        repo_id, DATASET_PATH, revision, patterns, repo_type,
+        start_workers=start_workers, max_workers=max_workers, token=os.environ.get("HF_TOKEN"),
+        **store_hooks(store, f"hf:{repo_id}", commit=dataset_vol.commit),
     )
-    return {"status": "ok", "path": local_dir}
+    store.save()
+    dataset_vol.commit()
+    return {"path": DATASET_PATH, **report}
 
 
 
 #FLux download
 
-@app.function(secrets=[modal.Secret.from_name("huggingface-secret")], volumes={MODELS_PATH: models_vol})
+@app.function(
+    secrets=[modal.Secret.from_name("huggingface-secret")],
+    volumes={MODELS_PATH: models_vol, CACHE_PATH: cache_vol},
+    **DOWNLOAD_RESOURCES,
+)
 def download_flux_model(repo_id: str = "black-forest-labs/FLUX.1-dev", subfolder: str = None):
     from huggingface_hub import snapshot_download
+    from blobstore import BlobStore, hf_remote_files, plan_sync
+    from model_registry import ModelRegistry
+    import os
 
-    local_dir = snapshot_download(
-        repo_id=repo_id,
-        repo_type="model",
-        local_dir=MODELS_PATH,
-        local_dir_use_symlinks=False,
-        allow_patterns="*"
+    # udah lengkap di registry -> ga perlu nanya hub sama sekali
+    scope = subfolder.rstrip("/") + "/" if subfolder else "*"
+    registry = ModelRegistry(MODELS_PATH)
+    cached = registry.lookup(repo_id=repo_id, scope=scope) if CACHE_MODELS else None
+    if cached:
+        registry.touch(repo_id)
+        registry.save()
+        models_vol.commit()
+        return {"status": "ok", "path": MODELS_PATH, "cached": len(cached), "linked": 0, "downloaded": 0}
+
+    remote = hf_remote_files(repo_id, repo_type="model")
+    names = list(remote)
+    if subfolder:
+        names = [n for n in names if n.startswith(subfolder.rstrip("/") + "/")]
+
+    # cek blob store dulu, terus hf-cache volume, baru network
+    store = BlobStore(MODELS_PATH)
+    present, linked, missing = plan_sync(
+        store, remote, MODELS_PATH, names, cache_root=CACHE_PATH, repo_id=repo_id
+    )
+    store.save()
+
+    local_dir = MODELS_PATH
+    if missing:
+        local_dir = snapshot_download(
+            repo_id=repo_id,
+            repo_type="model",
+            local_dir=MODELS_PATH,
+            local_dir_use_symlinks=False,
+            allow_patterns=missing
+        )
+        for name in missing:
+            path = os.path.join(MODELS_PATH, name)
+            if os.path.exists(path):
+                store.ingest(path, etag=remote[name][0], source=f"hf:{repo_id}")
+        store.save()
+
+    evicted = register_model(
+        repo_id, names, repo_id=repo_id, revision="main", source=f"hf:{repo_id}", scope=scope
     )
-    return {"status": "ok", "path": local_dir}
+    models_vol.commit()
+    return {
+        "status": "ok",
+        "path": local_dir,
+        "cached": len(present),
+        "linked": len(linked),
+        "downloaded": len(missing),
+        "evicted": evicted,
+    }
 
   ########## START KOHYA ###########
+# upload jalan di cpu, ga perlu bakar gpu buat nulis file
 @app.function(
-    gpu=GPU_CONFIG,
     timeout=600,
     volumes={
         MODELS_PATH: models_vol,
@@ -243,56 +1023,349 @@ def download_flux_model(repo_id: str = "black-forest-labs/FLUX.1-dev", subfolder
     }
 )
 def upload_model(model_data: bytes, model_name: str):
+    """small files only, big checkpoints go through upload_model_chunk."""
     import os
+    import hashlib
+    from blobstore import BlobStore
     
     model_path = os.path.join(MODELS_PATH, model_name)
     
     try:
-        with open(model_path, 'wb') as f:
-            f.write(model_data)
-        return {"status": "success", "path": model_path}
+        store = BlobStore(MODELS_PATH)
+        digest = hashlib.sha256(model_data).hexdigest()
+        if store.has(digest):
+            # isi sama udah ada, cukup link
+            store.materialize(digest, model_path)
+        else:
+            # tmp + replace: model_path bisa hardlink ke blob lain, jangan ditulis in place
+            with open(model_path + ".tmp", 'wb') as f:
+                f.write(model_data)
+            os.replace(model_path + ".tmp", model_path)
+            store.ingest(model_path, source="upload", digest=digest)
+        store.save()
+        register_model(model_name, [model_name], source="upload", sha256=digest)
+        return {"status": "success", "path": model_path, "sha256": digest}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-# cleanup function
+# streaming upload: begin -> chunk... -> finish, client side in uploader.stream_upload
+@app.function(volumes={MODELS_PATH: models_vol}, timeout=600, max_containers=1)
+def upload_model_begin(model_name: str, keep: int = None):
+    """keep = recorded chunks to keep (None all, 0 fresh); client checks the list against its file."""
+    from uploader import ChunkedUpload
+
+    models_vol.reload()
+    upload = ChunkedUpload(MODELS_PATH, model_name)
+    offset = upload.begin(keep)
+    models_vol.commit()
+    return {"offset": offset, "chunks": upload.chunks}
+
+
+@app.function(volumes={MODELS_PATH: models_vol}, timeout=600, max_containers=1)
+def upload_model_chunk(model_name: str, offset: int, data: bytes, sha256: str):
+    from uploader import ChunkedUpload
+
+    # container chunk/finish bisa masih warm, liat partial dari begin / chunk sebelumnya
+    models_vol.reload()
+    new_offset = ChunkedUpload(MODELS_PATH, model_name).write(offset, data, sha256)
+    # commit tiap chunk biar resume tetep jalan kalau container mati
+    models_vol.commit()
+    return {"offset": new_offset}
+
+
+@app.function(volumes={MODELS_PATH: models_vol}, timeout=1800, max_containers=1)
+def upload_model_finish(model_name: str, size: int, sha256: str):
+    import os
+    from blobstore import BlobStore
+    from uploader import ChunkedUpload
+
+    models_vol.reload()
+    upload = ChunkedUpload(MODELS_PATH, model_name)
+    try:
+        digest = upload.finish(size=size, sha256=sha256)
+    finally:
+        # finish buang partial kalau checksum salah, itu juga harus ke-commit
+        models_vol.commit()
+    store = BlobStore(MODELS_PATH)
+    store.ingest(upload.path, source="upload", digest=digest)
+    store.save()
+    register_model(model_name, [model_name], source="upload", sha256=digest)
+    models_vol.commit()
+    return {"status": "success", "path": upload.path, "sha256": digest, "size": os.path.getsize(upload.path)}
+
+##============MODEL CONVERTER============##
+# konversi di cpu, tensor di-stream lewat mmap jadi ram tetep kecil
+@app.function(volumes={MODELS_PATH: models_vol}, **CONVERT_RESOURCES)
+def convert_models(files: str, dtype: str = "fp16", workers: int = 2):
+    """convert files in kohya-models to safetensors, casting floats to dtype.
+
+    files: comma separated paths relative to MODELS_PATH (.safetensors,
+    .ckpt, .pt, .bin). dtype fp16/bf16/fp32, or "" to keep it. outputs go
+    next to the source as <stem>-<dtype>.safetensors and into the blob store.
+    """
+    from blobstore import BlobStore
+    from model_converter import convert_many
+
+    if not ENABLE_MODEL_CONVERTER:
+        return {"status": "disabled", "message": "kohya_settings.enable_model_converter is false"}
+
+    names = [f.strip() for f in files.split(",")] if isinstance(files, str) else list(files)
+    paths = [os.path.join(MODELS_PATH, n) for n in names if n]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        return {"status": "error", "message": f"not found: {missing}"}
+
+    report = convert_many(paths, dtype or None, workers=workers)
+    store = BlobStore(MODELS_PATH)
+    for result in report["results"]:
+        if "sha256" in result:
+            store.ingest(result["dest"], source=f"convert:{os.path.basename(result['src'])}", digest=result["sha256"])
+    store.save()
+    for result in report["results"]:
+        if "sha256" in result:
+            dest = os.path.relpath(result["dest"], MODELS_PATH)
+            register_model(dest, [dest], source=f"convert:{os.path.relpath(result['src'], MODELS_PATH)}", sha256=result["sha256"])
+    models_vol.commit()
+    return {"status": "ok", **report}
+
+
+@app.function(volumes={MODELS_PATH: models_vol}, **EXTRACT_RESOURCES)
+def extract_lora_model(
+    model_org: str,
+    model_tuned: str,
+    save_to: str,
+    dim: int = 32,
+    conv_dim: int = None,
+    sdxl: bool = False,
+    v2: bool = False,
+    save_precision: str = "fp16",
+):
+    """LoRA = difference between a fine-tune and its base (sd-scripts extractor).
+
+    paths are relative to MODELS_PATH.
+    """
+    from blobstore import BlobStore, sha256_file
+    from model_converter import extract_lora
+
+    if not ENABLE_MODEL_CONVERTER:
+        return {"status": "disabled", "message": "kohya_settings.enable_model_converter is false"}
+
+    org, tuned, out = (os.path.join(MODELS_PATH, p) for p in (model_org, model_tuned, save_to))
+    for path in (org, tuned):
+        if not os.path.exists(path):
+            return {"status": "error", "message": f"not found: {path}"}
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    returncode, tail = extract_lora(KOHYA_BASE, org, tuned, out, dim, conv_dim, sdxl, v2, save_precision)
+    if returncode != 0 or not os.path.exists(out):
+        return {"status": "error", "returncode": returncode, "output": tail}
+
+    digest = sha256_file(out)
+    store = BlobStore(MODELS_PATH)
+    store.ingest(out, source="extract_lora", digest=digest)
+    store.save()
+    register_model(save_to, [save_to], source=f"extract_lora:{model_tuned}", sha256=digest)
+    models_vol.commit()
+    return {"status": "ok", "path": out, "sha256": digest, "bytes": os.path.getsize(out)}
+
+
+@app.function(**CONVERT_RESOURCES)
+def benchmark_model_converter(size_gb: float = 4.0):
+    """fp32 -> fp16/bf16 on a synthetic file in /tmp, with peak rss per case."""
+    import tempfile
+    from model_converter import benchmark
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        return benchmark(work_dir, size_gb)
+
+
+@app.function(volumes={MODELS_PATH: models_vol}, **CONVERT_RESOURCES)
+def benchmark_lazy_loader(file: str = None, include: str = "unet", size_gb: float = 4.0, workers: int = 8):
+    """time to first step, full read vs lazy load of include.
+
+    file is relative to the models volume (a cold read from the network
+    volume); without it a synthetic sdxl-like file in /tmp is used.
+    """
+    import tempfile
+    from lazy_loader import time_to_first_step, write_synthetic
+
+    if file:
+        path = os.path.join(MODELS_PATH, file)
+        if not os.path.isfile(path):
+            return {"status": "error", "message": f"not found: {path}"}
+        return time_to_first_step(path, include, workers=workers)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = write_synthetic(os.path.join(work_dir, "synthetic.safetensors"), size_gb)
+        return time_to_first_step(path, include, workers=workers)
+
+
+@app.function(volumes={MODELS_PATH: models_vol})
+def lookup_model(name: str = None, repo_id: str = None, files: str = None):
+    """local paths of a registered model, no hub call. files: comma separated."""
+    from model_registry import ModelRegistry
+
+    wanted = [f.strip() for f in files.split(",")] if files else None
+    paths = ModelRegistry(MODELS_PATH).lookup(name=name, repo_id=repo_id, files=wanted)
+    if paths is None:
+        return {"status": "missing", "name": name, "repo_id": repo_id}
+    return {"status": "ok", "paths": paths}
+
+
+@app.function(volumes={MODELS_PATH: models_vol})
+def list_models(enforce: bool = False):
+    """registry listing; files nobody registered (e.g. from the gui) get adopted."""
+    from blobstore import BlobStore
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(MODELS_PATH)
+    dropped = registry.prune_missing()
+    adopted = registry.adopt_untracked()
+    evicted = []
+    if enforce:
+        store = BlobStore(MODELS_PATH)
+        evicted = registry.enforce(MAX_MODELS, int(MAX_MODELS_GB * 1024 ** 3), store=store)
+        store.save()
+    registry.save()
+    models_vol.commit()
+    return {
+        "status": "ok",
+        "models": registry.listing(),
+        "total_bytes": registry.total_bytes(),
+        "max_models": MAX_MODELS,
+        "dropped": dropped,
+        "adopted": adopted,
+        "evicted": evicted,
+    }
+
+
+@app.function(volumes={OUTPUTS_PATH: outputs_vol}, **EXPORT_RESOURCES)
+def export_outputs_plan(runs: list = None, patterns: list = None, latest: int = None, chunk_mb: int = 16):
+    """archive layout for the selected kohya-outputs files (see exporter.py).
+
+    runs: run dirs or globs, patterns: globs on the path, latest: newest N
+    checkpoints per run. nothing is copied, export_outputs_chunks reads
+    the files directly.
+    """
+    from exporter import plan, select
+
+    outputs_vol.reload()
+    files = select(OUTPUTS_PATH, runs, patterns, latest)
+    if not files:
+        return {"status": "empty", "message": "no files match the selection"}
+    return {"status": "ok", "plan": plan(files, chunk_mb * 1024 * 1024)}
+
+
+@app.function(volumes={OUTPUTS_PATH: outputs_vol}, **EXPORT_RESOURCES)
+def export_outputs_chunks(plan: dict, indices: list, compression: str = "zstd", level: int = 3):
+    """generator, one compressed + checksummed archive chunk per index."""
+    from exporter import iter_chunks
+
+    outputs_vol.reload()
+    yield from iter_chunks(OUTPUTS_PATH, plan, indices, compression, level)
+
+
+# cleanup pake index di volume, cuma dir yang berubah yang di-scan ulang
 @app.function(
     volumes={
         OUTPUTS_PATH: outputs_vol,
-    }
+    },
+    **CLEANUP_RESOURCES,
 )
-def cleanup_old_files(days_old: int = 7):
-    import os
-    import time
-    
-    current_time = time.time()
-    cutoff = current_time - (days_old * 24 * 60 * 60)
-    cleaned_count = 0
-    
-    if os.path.exists(OUTPUTS_PATH):
-        for root, dirs, files in os.walk(OUTPUTS_PATH):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    if os.path.getmtime(file_path) < cutoff:
-                        os.remove(file_path)
-                        cleaned_count += 1
-                except:
-                    # ignore errors
-                    pass
-    
-    return {"files_cleaned": cleaned_count}
+def cleanup_old_files(
+    days_old: int = None,
+    quota_gb: float = None,
+    keep_last: int = None,
+    dry_run: bool = False,
+    full_scan: bool = False,
+):
+    """apply the retention policies to OUTPUTS_PATH, defaults from [retention].
+
+    dry_run only reports what would go. the volume is committed once per
+    delete batch.
+    """
+    from retention import cleanup
+
+    outputs_vol.reload()
+    report = cleanup(
+        OUTPUTS_PATH,
+        max_age_days=RETENTION_MAX_AGE_DAYS if days_old is None else days_old,
+        keep_last=RETENTION_KEEP_LAST if keep_last is None else keep_last,
+        quota_gb=RETENTION_QUOTA_GB if quota_gb is None else quota_gb,
+        dry_run=dry_run,
+        full_scan=full_scan,
+        on_batch=lambda done, total: outputs_vol.commit(),
+    )
+    outputs_vol.commit()  # index juga disimpan pas dry run
+    report["files_cleaned"] = report.get("deleted", 0)
+    return report
+
+@app.function()
+def import_profile():
+    """import-time profile baked into the image by warmup_imports.py."""
+    import json
 
-@app.function()  
-def health_check():
-    import torch
+    with open(f"{KOHYA_BASE}/.build/import_profile.json") as f:
+        return json.load(f)
+
+@app.function()
+def health_check(timeout: float = 5.0):
+    """/healthz of the running gui container (not this one), via its tunnel."""
+    import json
     import time
-    
-    return {
-        "status": "healthy",
-        "torch_version": torch.__version__,
-        "cuda_available": torch.cuda.is_available(),
-        "timestamp": time.time()
-    }
+    import urllib.error
+    import urllib.request
+
+    info = telemetry_dict.get("gui")
+    if not info:
+        return {"status": "down", "error": "no gui container has published its url"}
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(f"{info['url']}/healthz", timeout=timeout) as resp:
+            report = json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        report = json.loads(e.read() or b"{}")  # 503 still carries the report
+    except Exception as e:
+        return {"status": "down", "url": info["url"], "error": str(e)}
+    report["latency_ms"] = round((time.monotonic() - start) * 1000, 1)
+    return report
+
+
+# max_containers caps min_containers, gui cuma boleh 1 container
+WARM_POOL_CAPS = {
+    "run_kohya_gui": GUI_RESOURCES.get("max_containers"),
+    "train_job": TRAIN_RESOURCES.get("max_containers"),
+}
+
+
+@app.function(
+    schedule=modal.Period(minutes=WARM_POOL['interval_minutes']) if WARM_POOL['enabled'] else None,
+    timeout=300,
+)
+def apply_warm_pool(dry_run: bool = False):
+    """set min_containers from [[warm_pool.windows]] for the current local time."""
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    from warm_pool import desired
+
+    if not WARM_POOL["enabled"]:
+        return {"status": "disabled", "message": "warm_pool.enabled is false"}
+    now = datetime.now(ZoneInfo(WARM_POOL["timezone"]))
+    targets = desired(WARM_POOL["windows"], now)
+    applied, errors = {}, {}
+    for name, n in targets.items():
+        cap = WARM_POOL_CAPS.get(name)
+        n = min(n, cap) if cap else n
+        applied[name] = n
+        if dry_run:
+            continue
+        try:
+            modal.Function.from_name(app.name, name).update_autoscaler(min_containers=n)
+        except Exception as e:
+            errors[name] = str(e)
+    if applied and not dry_run:
+        print(f"warm pool {now:%a %H:%M}: {applied}")
+    return {"status": "error" if errors else "ok", "now": now.isoformat(), "min_containers": applied,
+            "errors": errors, "dry_run": dry_run}
+
 
 @app.local_entrypoint()
 def main():
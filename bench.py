@@ -0,0 +1,376 @@
+"""end-to-end benchmarks, runnable locally without modal or a gpu
+
+every suite builds its inputs in a temp dir and runs the same code the
+modal functions run, with local stand-ins for what only exists in the
+cloud: downloader's RangeServer for the hub cdn, dataset_sync's
+FakeHub for the hub api, plain directories for the volumes and a no-op
+cuda init plus a stub kohya_gui.py for the gui.
+
+  download_model    downloader.download_files, chunked ranges (download_model.py)
+  download_dataset  dataset_sync.sync against FakeHub (download_dataset.py)
+  enumerate         staging.scan over a dataset tree
+  staging           staging.stage, cold then restage with nothing changed
+  cleanup           retention.cleanup on a synthetic 100k file outputs tree
+  config            settings.validated_config (done at every app import)
+  gui_startup       gui_launcher.launch phases with stub backends
+  build             `modal build app.py` wall time (opt-in, needs the modal cli)
+
+each run appends one json line (commit, scale, metrics) to
+bench_history.jsonl and is compared with the last run at the same scale:
+*_per_s metrics should go up, *_s metrics down, >20% the wrong way is
+flagged.
+
+    python bench.py                  # everything but build
+    python bench.py cleanup config   # some suites
+    python bench.py --quick          # ~10x smaller inputs
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HISTORY_FILE = "bench_history.jsonl"
+REGRESSION = 0.2
+# differences below this are timer noise, never a regression
+NOISE_FLOOR = {"_ms": 1.0, "_s": 0.05}
+
+SCALES = {
+    "full": {"model_files": 4, "model_mb": 64, "dataset_files": 500, "tree_files": 20000,
+             "cleanup_files": 100000, "config_loads": 200},
+    "quick": {"model_files": 2, "model_mb": 16, "dataset_files": 100, "tree_files": 2000,
+              "cleanup_files": 10000, "config_loads": 50},
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_random(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(rng.randbytes(size))
+
+
+def make_tree(root, files, sizes=(1024, 8192), per_dir=500, seed=0):
+    """dataset-like tree: <root>/set_<n>/img_<i>.jpg + caption, ~per_dir files per folder."""
+    rng = random.Random(seed)
+    for i in range(files // 2):
+        folder = os.path.join(root, f"set_{i * 2 // per_dir:03d}")
+        _write_random(os.path.join(folder, f"img_{i:06d}.jpg"), rng.randint(*sizes), rng)
+        with open(os.path.join(folder, f"img_{i:06d}.txt"), "w") as f:
+            f.write(f"caption {i}")
+
+
+# ---------- suites ----------
+
+def bench_download_model(work, scale):
+    from downloader import DownloadTask, RangeServer, download_files
+    from settings import parallel_download_workers
+
+    rng = random.Random(1)
+    size = scale["model_mb"] * 1024 * 1024
+    for i in range(scale["model_files"]):
+        _write_random(os.path.join(work, "hub", f"model-{i}.safetensors"), size, rng)
+    server = RangeServer(os.path.join(work, "hub")).start()
+    workers = parallel_download_workers()
+    try:
+        tasks = [DownloadTask(f"{server.url}/model-{i}.safetensors", os.path.join(work, "models", f"model-{i}.safetensors"))
+                 for i in range(scale["model_files"])]
+        os.makedirs(os.path.join(work, "models"))
+        results, summary = download_files(tasks, workers=workers, chunk_size=8 * 1024 * 1024)
+    finally:
+        server.stop()
+    failed = [r for r in results if r["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"download failed: {failed[0]}")
+    return {"mb_per_s": summary["mb_per_s"], "total_s": summary["seconds"], "workers": workers,
+            "bytes": summary["bytes"]}
+
+
+def bench_download_dataset(work, scale):
+    from dataset_sync import FakeHub, sync
+    from settings import sync_workers
+
+    rng = random.Random(2)
+    repo = os.path.join(work, "hub", "bench", "images")
+    for i in range(scale["dataset_files"]):
+        _write_random(os.path.join(repo, f"img_{i:05d}.jpg"), rng.randint(4096, 65536), rng)
+    hub = FakeHub(os.path.join(work, "hub"), latency=0.005).start()
+    old = os.environ.get("HF_ENDPOINT")
+    os.environ["HF_ENDPOINT"] = hub.url
+    start_workers, max_workers = sync_workers()
+    try:
+        first = sync("bench/images", os.path.join(work, "dataset"), start_workers=start_workers,
+                     max_workers=max_workers)
+        again = sync("bench/images", os.path.join(work, "dataset"))
+    finally:
+        hub.stop()
+        if old is None:
+            os.environ.pop("HF_ENDPOINT", None)
+        else:
+            os.environ["HF_ENDPOINT"] = old
+    return {"files_per_s": round(scale["dataset_files"] / max(first["seconds"], 1e-6), 1),
+            "mb_per_s": first["mb_per_s"], "total_s": first["seconds"],
+            "noop_resync_s": again["seconds"], "peak_workers": first["workers"]["peak"]}
+
+
+def bench_enumerate(work, scale):
+    from staging import scan
+
+    make_tree(os.path.join(work, "dataset"), scale["tree_files"])
+    start = time.perf_counter()
+    found = scan(os.path.join(work, "dataset"))
+    seconds = time.perf_counter() - start
+    return {"files": len(found), "scan_s": round(seconds, 3), "files_per_s": round(len(found) / seconds)}
+
+
+def bench_staging(work, scale):
+    from staging import stage
+
+    src = os.path.join(work, "volume")
+    make_tree(src, scale["tree_files"], sizes=(4096, 65536))
+    cold = stage(src, os.path.join(work, "local"))
+    warm = stage(src, os.path.join(work, "local"))
+    return {"cold_s": cold["seconds_to_ready"], "cold_mb_per_s": cold["mb_per_s"],
+            "restage_s": warm["seconds_to_ready"], "files": cold["files"]}
+
+
+def make_outputs(root, files, seed=0):
+    """kohya-outputs-like tree: runs with checkpoints, samples and logs, mixed ages."""
+    rng = random.Random(seed)
+    now = time.time()
+    per_run = 200
+    for i in range(files):
+        run = os.path.join(root, f"run_{i // per_run:04d}")
+        kind = i % per_run
+        if kind < 10:
+            rel = f"model-{kind:06d}.safetensors"
+        elif kind < 20:
+            rel = os.path.join(f"model-{kind:06d}-state", "optimizer.bin")
+        elif kind < 120:
+            rel = os.path.join("sample", f"{kind:05d}.png")
+        else:
+            rel = os.path.join("logs", f"events.{kind:05d}")
+        path = os.path.join(run, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * rng.randint(16, 256))
+        age = rng.uniform(0, 30) * 86400
+        os.utime(path, (now - age, now - age))
+
+
+def bench_cleanup(work, scale):
+    from retention import cleanup
+
+    root = os.path.join(work, "outputs")
+    make_outputs(root, scale["cleanup_files"])
+    cold = cleanup(root, max_age_days=14, dry_run=True, full_scan=True)
+    warm = cleanup(root, max_age_days=14, dry_run=True)
+    applied = cleanup(root, max_age_days=14, keep_last=3)
+    return {"files": cold["files"], "cold_scan_s": cold["seconds"], "indexed_scan_s": warm["seconds"],
+            "apply_s": applied["seconds"], "deleted": applied["deleted"],
+            "dirs_reused": warm["scan"]["dirs_reused"]}
+
+
+def _median_ms(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return round(sorted(times)[len(times) // 2] * 1000, 3)
+
+
+def bench_config(work, scale):
+    from settings import CONFIG_FILE, load_config, validated_config
+
+    parse = _median_ms(lambda: load_config(CONFIG_FILE), scale["config_loads"])
+    validated = _median_ms(lambda: validated_config(CONFIG_FILE), scale["config_loads"])
+    return {"parse_ms": parse, "validated_ms": validated,
+            "validate_overhead_ms": round(validated - parse, 3)}
+
+
+# blocks like the real gui; runs in launch()'s daemon thread, gone at exit
+STUB_GUI = """
+import sys
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+port = int(sys.argv[sys.argv.index("--server_port") + 1])
+HTTPServer(("127.0.0.1", port), SimpleHTTPRequestHandler).serve_forever()
+"""
+
+
+def bench_gui_startup(work, scale):
+    import gui_launcher
+
+    base = os.path.join(work, "kohya_ss")
+    os.makedirs(base)
+    with open(os.path.join(base, "kohya_gui.py"), "w") as f:
+        f.write(STUB_GUI)
+    cwd, startup_file = os.getcwd(), gui_launcher.STARTUP_FILE
+    gui_launcher.STARTUP_FILE = os.path.join(work, "startup.json")
+    try:
+        report = gui_launcher.launch(base, _free_port(), [], mode="inprocess", timeout=60,
+                                     init=lambda: {"torch": None, "cuda": False})
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(base)
+        gui_launcher.STARTUP_FILE = startup_file
+    phases = report["phases"]
+    return {"launcher_s": round(report["total"] - phases["image_import"], 3),
+            "gui_import_s": phases["gui_import"], "port_bind_s": phases["port_bind"]}
+
+
+def bench_build(work, scale):
+    if shutil.which("modal") is None:
+        raise RuntimeError("modal cli not installed")
+    start = time.perf_counter()
+    result = subprocess.run(["modal", "build", "app.py"], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "modal build failed")
+    return {"build_s": round(time.perf_counter() - start, 1)}
+
+
+SUITES = {
+    "download_model": bench_download_model,
+    "download_dataset": bench_download_dataset,
+    "enumerate": bench_enumerate,
+    "staging": bench_staging,
+    "cleanup": bench_cleanup,
+    "config": bench_config,
+    "gui_startup": bench_gui_startup,
+    "build": bench_build,
+}
+DEFAULT_SUITES = [name for name in SUITES if name != "build"]
+
+
+# ---------- history ----------
+
+def _git(*args):
+    try:
+        out = subprocess.run(["git", *args], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() if out.returncode == 0 else None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def run(suites=None, scale="full", history=HISTORY_FILE):
+    """run suites (default: all but build), append to history, return the entry."""
+    suites = suites or DEFAULT_SUITES
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        raise ValueError(f"unknown suite: {', '.join(unknown)} (have {', '.join(SUITES)})")
+    results = {}
+    for name in suites:
+        print(f"== {name}")
+        work = tempfile.mkdtemp(prefix=f"bench-{name}-")
+        try:
+            results[name] = SUITES[name](work, SCALES[scale])
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    entry = {
+        "timestamp": time.time(),
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "scale": scale,
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    previous = last_run(history, scale)
+    if history:
+        with open(history, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    entry["regressions"] = compare(previous, entry)
+    return entry, previous
+
+
+def last_run(history, scale):
+    if not history or not os.path.exists(history):
+        return None
+    with open(history) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    runs = [r for r in runs if r.get("scale") == scale]
+    return runs[-1] if runs else None
+
+
+def _direction(metric):
+    if metric.endswith("per_s"):
+        return 1
+    if metric.endswith(("_s", "_ms")):
+        return -1
+    return 0
+
+
+def change(metric, before, after):
+    """relative change, positive = better. None when not comparable."""
+    direction = _direction(metric)
+    if not direction or not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or not before:
+        return None
+    floor = next((v for suffix, v in NOISE_FLOOR.items() if metric.endswith(suffix)), 0)
+    if direction < 0 and abs(after - before) < floor:
+        return 0.0
+    return direction * (after - before) / before
+
+
+def compare(previous, current):
+    """[(suite, metric, before, after, change)] for >REGRESSION changes the wrong way."""
+    if not previous:
+        return []
+    regressions = []
+    for suite, metrics in current["results"].items():
+        before = previous["results"].get(suite, {})
+        for metric, value in metrics.items():
+            delta = change(metric, before.get(metric), value)
+            if delta is not None and delta < -REGRESSION:
+                regressions.append((suite, metric, before[metric], value, round(delta, 3)))
+    return regressions
+
+
+def print_report(entry, previous, out=print):
+    before_all = (previous or {}).get("results", {})
+    for suite, metrics in entry["results"].items():
+        out(f"{suite}")
+        if "error" in metrics:
+            out(f"  skipped: {metrics['error']}")
+            continue
+        for metric, value in metrics.items():
+            line = f"  {metric:<22} {value}"
+            delta = change(metric, before_all.get(suite, {}).get(metric), value)
+            if delta is not None:
+                line += f"  ({delta:+.0%})"
+                if delta < -REGRESSION:
+                    line += "  <- regression"
+            out(line)
+    if previous:
+        out(f"compared with {previous.get('commit')} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(previous['timestamp']))})")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="local end-to-end benchmarks")
+    parser.add_argument("suites", nargs="*", help=f"any of {', '.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="~10x smaller inputs")
+    parser.add_argument("--history", default=HISTORY_FILE, help="jsonl file, '' to not record")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    entry, previous = run(args.suites, "quick" if args.quick else "full", args.history)
+    print_report(entry, previous)
+    if args.fail_on_regression and entry["regressions"]:
+        sys.exit(1)
+    return entry
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""content addressed blob store for the model/dataset volumes
+
+blobs live in `<volume>/.blobs/sha256/<ab>/<digest>` and the named files
+(the ones kohya sees) are hardlinks to them. `.blobs/index.json` maps
+named paths and remote etags to digests, so an artifact we already have is
+linked in place instead of downloaded again.
+
+hardlinks only work inside one volume, so each volume gets its own store.
+when the filesystem refuses a hardlink the first named file is not copied
+into `.blobs`, it stays where it is and the index points at it (`at`);
+only materializing the content under a second name makes a copy, which
+still saves the network fetch.
+
+a hardlinked path shares its inode with the blob, so anything writing it
+in place (kohya's caption editor opens with "w") would rewrite every copy.
+only files that are replaced as a whole (weights, images, archives) are
+deduped; captions, configs and other text (MUTABLE_EXTS) stay plain files.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+HASH_BLOCK = 8 * 1024 * 1024
+STORE_DIR = ".blobs"
+MUTABLE_EXTS = (".txt", ".caption", ".json", ".jsonl", ".toml", ".yaml", ".yml", ".csv", ".md", ".py")
+
+
+def is_mutable(path):
+    return path.lower().endswith(MUTABLE_EXTS)
+
+
+def sha256_file(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def try_link(src, dest):
+    """hardlink src to dest (replacing dest), False if the volume doesn't do hardlinks."""
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    tmp = dest + ".linking"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        return False
+    os.replace(tmp, dest)
+    return True
+
+
+def link_or_copy(src, dest):
+    """hardlink src to dest, copy if the volume doesn't do hardlinks."""
+    if try_link(src, dest):
+        return True
+    tmp = dest + ".linking"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+    return False
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dir = os.path.join(self.root, STORE_DIR)
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.index = self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("blobs", {})
+        index.setdefault("etags", {})
+        index.setdefault("paths", {})
+        return index
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def _rel(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def blob_path(self, digest):
+        return os.path.join(self.dir, "sha256", digest[:2], digest)
+
+    def location(self, digest):
+        """where the content lives: the blob, or the named file it stayed in."""
+        at = self.index["blobs"].get(digest, {}).get("at")
+        return os.path.join(self.root, at) if at else self.blob_path(digest)
+
+    def has(self, digest):
+        blob = self.index["blobs"].get(digest)
+        if blob is None:
+            return False
+        try:
+            # an `at` file is a normal named path, check it wasn't replaced since
+            return os.path.getsize(self.location(digest)) == blob["size"]
+        except OSError:
+            return False
+
+    def find(self, etag=None, sha256=None):
+        """digest for a remote etag or a known sha256, None if not stored."""
+        digest = sha256 or self.index["etags"].get(etag)
+        if digest and self.has(digest):
+            return digest
+        return None
+
+    def is_current(self, path, digest):
+        """named path already holds this digest (cheap size check, no rehash)."""
+        if self.index["paths"].get(self._rel(path)) != digest:
+            return False
+        blob = self.index["blobs"].get(digest)
+        try:
+            return blob is not None and os.path.getsize(path) == blob["size"]
+        except OSError:
+            return False
+
+    def ingest(self, path, etag=None, source=None, digest=None):
+        """add a freshly written file to the store, linked in place.
+
+        if the same content is already stored the new copy is replaced by a
+        link to it (kept as is when hardlinks don't work). mutable files are
+        only hashed, never shared.
+        """
+        if digest is None:
+            digest = sha256_file(path)
+        if is_mutable(path):
+            self.forget(path)
+            return digest
+        if self.has(digest):
+            try_link(self.location(digest), path)
+        else:
+            blob = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            entry = {"size": os.path.getsize(path), "source": source, "added": time.time()}
+            if not try_link(path, blob):
+                # no hardlinks here: the named file is the only copy
+                entry["at"] = self._rel(path)
+            self.index["blobs"][digest] = entry
+        if etag:
+            self.index["etags"][etag] = digest
+        self.index["paths"][self._rel(path)] = digest
+        return digest
+
+    def materialize(self, digest, dest):
+        """put a stored blob at dest. returns True for a hardlink."""
+        linked = link_or_copy(self.location(digest), dest)
+        self.index["paths"][self._rel(dest)] = digest
+        return linked
+
+    def forget(self, path):
+        self.index["paths"].pop(self._rel(path), None)
+
+    def gc(self):
+        """drop blobs no named path points at any more. returns bytes freed."""
+        self.unshare_mutable()
+        live = {
+            digest
+            for rel, digest in self.index["paths"].items()
+            if os.path.exists(os.path.join(self.root, rel))
+        }
+        self.index["paths"] = {
+            rel: d for rel, d in self.index["paths"].items()
+            if os.path.exists(os.path.join(self.root, rel))
+        }
+        freed = 0
+        for digest in list(self.index["blobs"]):
+            entry = self.index["blobs"][digest]
+            if entry.get("at") and not self.has(digest):
+                # the named file holding it is gone or changed, move to another copy
+                others = [rel for rel, d in self.index["paths"].items()
+                          if d == digest and os.path.getsize(os.path.join(self.root, rel)) == entry["size"]]
+                if others:
+                    entry["at"] = others[0]
+                else:
+                    del self.index["blobs"][digest]
+                continue
+            if digest in live:
+                continue
+            if not entry.get("at"):
+                blob = self.blob_path(digest)
+                if os.path.exists(blob):
+                    freed += os.path.getsize(blob)
+                    os.remove(blob)
+            del self.index["blobs"][digest]
+        self.index["etags"] = {
+            e: d for e, d in self.index["etags"].items() if d in self.index["blobs"]
+        }
+        return freed
+
+    def unshare_mutable(self):
+        """give text files linked by older versions of the store their own inode.
+
+        returns how many were split off. run once, before anything edits them.
+        """
+        split = 0
+        for rel in [r for r in self.index["paths"] if is_mutable(r)]:
+            path = os.path.join(self.root, rel)
+            try:
+                if os.stat(path).st_nlink > 1:
+                    tmp = path + ".unshare"
+                    shutil.copyfile(path, tmp)
+                    os.replace(tmp, path)
+                    split += 1
+            except OSError:
+                pass
+            self.index["paths"].pop(rel)
+        return split
+
+
+def hf_remote_files(repo_id, repo_type="model", revision=None):
+    """{path: (etag, sha256 or None, size)} for every file in a hub repo.
+
+    one list call instead of a HEAD per file. lfs files carry their sha256,
+    small files only have the git blob id, which we use as etag.
+    """
+    from huggingface_hub import HfApi
+
+    remote = {}
+    for entry in HfApi().list_repo_tree(
+        repo_id, repo_type=repo_type, revision=revision, recursive=True
+    ):
+        if not hasattr(entry, "blob_id"):
+            continue  # folder
+        lfs = getattr(entry, "lfs", None)
+        sha = lfs.sha256 if lfs is not None else None
+        remote[entry.path] = (sha or entry.blob_id, sha, entry.size)
+    return remote
+
+
+def hf_cache_blob(cache_root, repo_id, etag, repo_type="model"):
+    """path of a blob in an HF_HOME cache (hub/<type>s--org--name/blobs/<etag>)."""
+    folder = f"{repo_type}s--" + repo_id.replace("/", "--")
+    path = os.path.join(cache_root, "hub", folder, "blobs", etag)
+    return path if os.path.exists(path) else None
+
+
+def plan_sync(store, remote, dest_root, names, cache_root=None, repo_id=None, repo_type="model"):
+    """split wanted files into already present / linked from store / to fetch.
+
+    files found in the store (or in the hf cache volume) are linked in place
+    right away; only the rest has to come over the network.
+    """
+    present, linked, missing = [], [], []
+    for name in names:
+        dest = os.path.join(dest_root, name)
+        etag, sha, _ = remote.get(name, (None, None, None))
+        digest = store.find(etag=etag, sha256=sha) if etag else None
+        if digest and store.is_current(dest, digest):
+            present.append(name)
+            continue
+        if digest:
+            store.materialize(digest, dest)
+            linked.append(name)
+            continue
+        cached = hf_cache_blob(cache_root, repo_id, etag, repo_type) if cache_root and etag else None
+        if cached:
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            shutil.copyfile(cached, dest + ".copying")
+            os.replace(dest + ".copying", dest)
+            store.ingest(dest, etag=etag, source=f"hf-cache:{repo_id}", digest=sha)
+            linked.append(name)
+            continue
+        missing.append(name)
+    return present, linked, missing
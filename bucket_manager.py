@@ -0,0 +1,329 @@
+"""aspect ratio bucket planning on cpu
+
+reads only the image headers (png/jpeg/webp/gif/bmp parsed by hand, PIL's
+lazy open as fallback) across a process pool, assigns every image to the
+bucket sd-scripts would pick, and writes a reusable index:
+
+    <dataset_dir>/.bucket_index.json
+
+images whose size/mtime didn't change keep their old entry, so a rerun on
+a 100k image dataset only touches new files. the report has per-bucket
+counts and a histogram of how much of each image gets cropped away.
+
+the bucket math mirrors sd-scripts' BucketManager (make_bucket_resolutions,
+select_bucket), latent_cache uses the same functions.
+"""
+import json
+import math
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif")
+INDEX_NAME = ".bucket_index.json"
+SCAN_BATCH = 512  # paths per pool task, keeps ipc overhead down
+WASTE_BINS = [0.0, 0.01, 0.05, 0.10, 0.20, 0.35, 1.01]
+
+
+# ---------- bucket math, same as sd-scripts BucketManager ----------
+
+def bucket_params(resolution=1024, enable_bucket=True, min_bucket_reso=256,
+                  max_bucket_reso=1024, bucket_reso_steps=64, bucket_no_upscale=False):
+    if isinstance(resolution, int):
+        resolution = (resolution, resolution)
+    return {
+        "resolution": list(resolution),
+        "enable_bucket": bool(enable_bucket),
+        "min_bucket_reso": min_bucket_reso,
+        "max_bucket_reso": max_bucket_reso,
+        "bucket_reso_steps": bucket_reso_steps,
+        "bucket_no_upscale": bool(bucket_no_upscale),
+    }
+
+
+def make_bucket_resolutions(max_reso, min_size=256, max_size=1024, divisible=64):
+    max_width, max_height = max_reso
+    max_area = max_width * max_height
+    resos = set()
+    width = int(math.sqrt(max_area) // divisible) * divisible
+    resos.add((width, width))
+    width = min_size
+    while width <= max_size:
+        height = min(max_size, int((max_area // width) // divisible) * divisible)
+        if height >= min_size:
+            resos.add((width, height))
+            resos.add((height, width))
+        width += divisible
+    return sorted(resos)
+
+
+def target_reso(width, height, params, resos=None):
+    """bucket resolution kohya will train this image at."""
+    resolution = tuple(params["resolution"])
+    if not params["enable_bucket"]:
+        return resolution
+    steps = params["bucket_reso_steps"]
+    if params["bucket_no_upscale"]:
+        def round_to_steps(x):
+            x = int(x + 0.5)
+            return x - x % steps
+
+        max_area = resolution[0] * resolution[1]
+        ar = width / height
+        resized = (width, height)
+        if width * height > max_area:
+            w = math.sqrt(max_area * ar)
+            h = max_area / w
+            bw = round_to_steps(w)
+            ar_w = bw / round_to_steps(bw / ar)
+            bh = round_to_steps(h)
+            ar_h = round_to_steps(bh * ar) / bh
+            if abs(ar_w - ar) < abs(ar_h - ar):
+                resized = (bw, int(bw / ar + 0.5))
+            else:
+                resized = (int(bh * ar + 0.5), bh)
+        return (resized[0] - resized[0] % steps, resized[1] - resized[1] % steps)
+    if resos is None:
+        resos = make_bucket_resolutions(
+            resolution, params["min_bucket_reso"], params["max_bucket_reso"], steps
+        )
+    if (width, height) in resos:
+        return (width, height)
+    ar = width / height
+    return min(resos, key=lambda r: abs(r[0] / r[1] - ar))
+
+
+def crop_waste(width, height, reso):
+    """fraction of the resized image that falls outside the bucket."""
+    scale = max(reso[0] / width, reso[1] / height)
+    resized_area = (width * scale) * (height * scale)
+    return max(0.0, 1.0 - (reso[0] * reso[1]) / resized_area)
+
+
+# ---------- header readers ----------
+
+def _png(f, head):
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    return None
+
+
+def _gif(f, head):
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    return None
+
+
+def _bmp(f, head):
+    if head[:2] == b"BM":
+        w, h = struct.unpack("<ii", head[18:26])
+        return w, abs(h)
+    return None
+
+
+def _webp(f, head):
+    if head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        w, h = struct.unpack("<HH", head[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L":
+        b = head[21:25]
+        w = 1 + (((b[1] & 0x3F) << 8) | b[0])
+        h = 1 + (((b[3] & 0xF) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+        return w, h
+    if chunk == b"VP8X":
+        w = 1 + int.from_bytes(head[24:27], "little")
+        h = 1 + int.from_bytes(head[27:30], "little")
+        return w, h
+    return None
+
+
+def _jpeg(f, head):
+    if head[:2] != b"\xff\xd8":
+        return None
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        # SOF0..SOF15 minus DHT/JPG/DAC carry the frame size
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack(">xHH", f.read(5))
+            return w, h
+        f.seek(length - 2, 1)
+
+
+_READERS = (_png, _jpeg, _webp, _gif, _bmp)
+
+
+def read_image_size(path):
+    """(width, height) from the file header, no pixel decode."""
+    with open(path, "rb") as f:
+        head = f.read(32)
+        for reader in _READERS:
+            try:
+                size = reader(f, head)
+            except (struct.error, IndexError):
+                size = None
+            if size:
+                return size
+    # unusual variant, PIL's open is lazy and stops after the header too
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def _read_batch(paths):
+    out = []
+    for path in paths:
+        try:
+            out.append((path, read_image_size(path), None))
+        except Exception as e:
+            out.append((path, None, str(e)))
+    return out
+
+
+# ---------- planner ----------
+
+def list_images(dataset_dir):
+    """{relpath: (size, mtime_ns)} for every image, dot dirs skipped."""
+    found = {}
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                found[os.path.relpath(path, dataset_dir)] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+def load_index(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, INDEX_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def plan_buckets(dataset_dir, params=None, workers=None):
+    """build or refresh the bucket index for a dataset folder."""
+    start = time.monotonic()
+    params = params or bucket_params()
+    found = list_images(dataset_dir)
+
+    old = load_index(dataset_dir) or {}
+    old_images = old.get("images", {})
+    sizes, todo = {}, []
+    for rel, (size, mtime) in found.items():
+        prev = old_images.get(rel)
+        if prev and prev["file"] == [size, mtime]:
+            sizes[rel] = tuple(prev["size"])
+        else:
+            todo.append(rel)
+
+    errors = {}
+    if todo:
+        batches = [
+            [os.path.join(dataset_dir, rel) for rel in todo[i:i + SCAN_BATCH]]
+            for i in range(0, len(todo), SCAN_BATCH)
+        ]
+        workers = workers or os.cpu_count() or 1
+        if len(batches) > 1 and workers > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+                results = list(pool.map(_read_batch, batches))
+        else:
+            results = [_read_batch(batch) for batch in batches]
+        for batch in results:
+            for path, size, error in batch:
+                rel = os.path.relpath(path, dataset_dir)
+                if error:
+                    errors[rel] = error
+                else:
+                    sizes[rel] = size
+
+    resos = None
+    if params["enable_bucket"] and not params["bucket_no_upscale"]:
+        resos = make_bucket_resolutions(
+            tuple(params["resolution"]), params["min_bucket_reso"],
+            params["max_bucket_reso"], params["bucket_reso_steps"],
+        )
+
+    images, buckets = {}, {}
+    histogram = [0] * (len(WASTE_BINS) - 1)
+    total_waste = 0.0
+    for rel, (w, h) in sorted(sizes.items()):
+        reso = target_reso(w, h, params, resos)
+        waste = crop_waste(w, h, reso)
+        images[rel] = {
+            "file": list(found[rel]),
+            "size": [w, h],
+            "bucket": list(reso),
+            "waste": round(waste, 4),
+        }
+        key = f"{reso[0]}x{reso[1]}"
+        buckets[key] = buckets.get(key, 0) + 1
+        total_waste += waste
+        for i in range(len(histogram)):
+            if WASTE_BINS[i] <= waste < WASTE_BINS[i + 1]:
+                histogram[i] += 1
+                break
+
+    labels = [
+        f"{WASTE_BINS[i]:.0%}-{min(WASTE_BINS[i + 1], 1.0):.0%}"
+        for i in range(len(histogram))
+    ]
+    index = {
+        "params": params,
+        "updated": time.time(),
+        "images": images,
+        "buckets": dict(sorted(buckets.items(), key=lambda kv: -kv[1])),
+        "waste_histogram": dict(zip(labels, histogram)),
+        "mean_waste": round(total_waste / len(images), 4) if images else 0.0,
+        "errors": errors,
+    }
+    tmp = os.path.join(dataset_dir, INDEX_NAME + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(dataset_dir, INDEX_NAME))
+
+    return {
+        "images": len(images),
+        "headers_read": len(todo),
+        "reused": len(found) - len(todo),
+        "buckets": index["buckets"],
+        "waste_histogram": index["waste_histogram"],
+        "mean_waste": index["mean_waste"],
+        "errors": len(errors),
+        "seconds": round(time.monotonic() - start, 2),
+    }
+
+
+def write_kohya_metadata(dataset_dir, index, meta_path):
+    """merge train_resolution per image into a sd-scripts fine-tune metadata json.
+
+    with --in_json the trainer takes bucket sizes from here instead of
+    opening every image.
+    """
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    for rel, info in index["images"].items():
+        key = os.path.splitext(os.path.join(dataset_dir, rel))[0]
+        meta.setdefault(key, {})["train_resolution"] = info["bucket"]
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return len(index["images"])
@@ -0,0 +1,391 @@
+"""headless batch captioning / tagging for a dataset folder
+
+producer/consumer: a process pool decodes and resizes images on the cpu,
+this process collects them into large batches for one model on the gpu,
+and a writer thread puts the `.txt` sidecars next to the images. up to
+`prefetch` batches are decoding while the model runs, so the gpu only
+waits on jpeg decode when the cpus really can't keep up (the report's
+`gpu_busy_share` says which side is the bottleneck).
+
+images that already have a caption sidecar are skipped and sidecars are
+written atomically batch by batch, so a rerun after a crash continues
+where it stopped. with overwrite=True the images done so far are kept
+in `<dataset>/.captioner.json` (per model key) instead.
+
+models: Wd14Tagger (onnx, kohya's default tagger), BlipCaptioner
+(transformers), DummyModel (sleeps per batch, to check the pipeline on
+cpu without weights:  python captioner.py demo).
+"""
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+from bucket_manager import IMAGE_EXTS
+
+CAPTION_EXTS = (".txt", ".caption")
+MANIFEST_NAME = ".captioner.json"
+WD14_REPO = "SmilingWolf/wd-v1-4-moat-tagger-v2"
+BLIP_REPO = "Salesforce/blip-image-captioning-large"
+SAVE_EVERY = 10  # batches between manifest writes (overwrite mode)
+
+
+# ---------- decode (runs in the worker processes) ----------
+
+def load_wd14(path, size):
+    """white-padded square, resized, BGR uint8 (what the wd14 onnx models expect)."""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img = img.convert("RGBA")
+        canvas = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        canvas.alpha_composite(img)
+        img = canvas.convert("RGB")
+    side = max(img.size)
+    square = Image.new("RGB", (side, side), (255, 255, 255))
+    square.paste(img, ((side - img.width) // 2, (side - img.height) // 2))
+    square = square.resize((size, size), Image.BICUBIC)
+    return np.asarray(square, dtype=np.uint8)[:, :, ::-1].copy()
+
+
+def load_rgb(path, size):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB").resize((size, size), Image.BICUBIC), dtype=np.uint8)
+
+
+def load_dummy(path, size, work_s=0.0):
+    """no PIL: the file's bytes as a size x size x 3 array, plus work_s of cpu (fake decode)."""
+    import numpy as np
+
+    with open(path, "rb") as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    end = time.perf_counter() + work_s
+    while time.perf_counter() < end:
+        pass
+    return np.resize(data, (size, size, 3))
+
+
+# ---------- models (run in this process) ----------
+
+class Wd14Tagger:
+    """SmilingWolf's wd14 taggers, the onnx models kohya's tag_images_by_wd14_tagger.py uses."""
+
+    def __init__(self, repo_id=WD14_REPO, threshold=0.35, character_threshold=0.85,
+                 replace_underscore=True, cache_dir=None):
+        import csv
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+
+        model_path = hf_hub_download(repo_id, "model.onnx", cache_dir=cache_dir)
+        with open(hf_hub_download(repo_id, "selected_tags.csv", cache_dir=cache_dir)) as f:
+            rows = list(csv.DictReader(f))
+        self.tags = [r["name"].replace("_", " ") if replace_underscore else r["name"] for r in rows]
+        # 0 general, 4 character, 9 rating (ratings never go into the caption)
+        self.categories = [int(r["category"]) for r in rows]
+        self.threshold = threshold
+        self.character_threshold = character_threshold
+        self.session = ort.InferenceSession(model_path, providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.image_size = inp.shape[1]
+        self.key = f"wd14:{repo_id}:{threshold}:{character_threshold}"
+        self.prepare = partial(load_wd14, size=self.image_size)
+
+    def caption(self, images):
+        import numpy as np
+
+        probs = self.session.run(None, {self.input_name: np.stack(images).astype(np.float32)})[0]
+        captions = []
+        for row in probs:
+            picked = []
+            for category, threshold in ((4, self.character_threshold), (0, self.threshold)):
+                found = [(p, self.tags[i]) for i, p in enumerate(row)
+                         if self.categories[i] == category and p >= threshold]
+                picked += [tag for _, tag in sorted(found, reverse=True)]
+            captions.append(", ".join(picked))
+        return captions
+
+
+class BlipCaptioner:
+    """natural language captions (transformers blip), fp16 on the gpu."""
+
+    def __init__(self, repo_id=BLIP_REPO, max_length=75, num_beams=1, device="cuda", cache_dir=None):
+        import torch
+        from transformers import BlipForConditionalGeneration, BlipProcessor
+
+        self.torch = torch
+        self.device = device
+        self.processor = BlipProcessor.from_pretrained(repo_id, cache_dir=cache_dir)
+        self.model = BlipForConditionalGeneration.from_pretrained(
+            repo_id, torch_dtype=torch.float16, cache_dir=cache_dir
+        ).to(device).eval()
+        self.max_length = max_length
+        self.num_beams = num_beams
+        self.image_size = self.processor.image_processor.size["height"]
+        self.key = f"blip:{repo_id}:{max_length}:{num_beams}"
+        self.prepare = partial(load_rgb, size=self.image_size)
+
+    def caption(self, images):
+        inputs = self.processor(images=list(images), return_tensors="pt").to(self.device, self.torch.float16)
+        with self.torch.no_grad():
+            out = self.model.generate(**inputs, max_length=self.max_length, num_beams=self.num_beams)
+        return [text.strip() for text in self.processor.batch_decode(out, skip_special_tokens=True)]
+
+
+class DummyModel:
+    """stands in for the gpu: fixed cost per batch plus per image, tags from pixel stats."""
+
+    def __init__(self, seconds_per_batch=0.05, seconds_per_image=0.001, image_size=64, decode_s=0.004):
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_image = seconds_per_image
+        self.image_size = image_size
+        self.key = f"dummy:{seconds_per_batch}:{seconds_per_image}"
+        self.prepare = partial(load_dummy, size=image_size, work_s=decode_s)
+
+    def caption(self, images):
+        time.sleep(self.seconds_per_batch + self.seconds_per_image * len(images))
+        return [f"dummy, brightness {int(image.mean())}" for image in images]
+
+
+MODELS = {"wd14": Wd14Tagger, "blip": BlipCaptioner, "dummy": DummyModel}
+
+
+def make_model(name, **kwargs):
+    if name not in MODELS:
+        raise ValueError(f"unknown caption model: {name} (have {', '.join(MODELS)})")
+    return MODELS[name](**kwargs)
+
+
+# ---------- pipeline ----------
+
+def run_pipeline(jobs, load, infer, batch_size=32, workers=None, prefetch=4, on_batch=None):
+    """decode jobs with load() in a process pool, infer() full batches in this process.
+
+    jobs: iterable of (key, arg); load(arg) -> input, infer([inputs]) ->
+    outputs. on_batch([(key, output)]) gets every finished batch. decode
+    errors are collected per key instead of failing the run.
+    """
+    stats = {"batches": 0, "items": 0, "decode_wait_s": 0.0, "infer_s": 0.0}
+    errors = {}
+    jobs = iter(jobs)
+    pending, ready = {}, []
+    limit = batch_size * max(1, prefetch)
+    exhausted = False
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) + len(ready) < limit:
+                try:
+                    key, arg = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(load, arg)] = key
+
+        fill()
+        while pending or ready:
+            if len(ready) < batch_size and pending:
+                # consumer starved: wait for the decoders (this is the number to watch)
+                start = time.monotonic()
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                stats["decode_wait_s"] += time.monotonic() - start
+                for future in done:
+                    key = pending.pop(future)
+                    try:
+                        ready.append((key, future.result()))
+                    except Exception as e:
+                        errors[key] = f"{type(e).__name__}: {e}"
+                fill()
+                continue
+            batch, ready = ready[:batch_size], ready[batch_size:]
+            fill()  # decoders keep going while the model runs
+            start = time.monotonic()
+            outputs = infer([item for _, item in batch])
+            stats["infer_s"] += time.monotonic() - start
+            stats["batches"] += 1
+            stats["items"] += len(batch)
+            if on_batch is not None:
+                on_batch([(key, out) for (key, _), out in zip(batch, outputs)])
+    return stats, errors
+
+
+def has_caption(path):
+    stem = os.path.splitext(path)[0]
+    return any(os.path.exists(stem + ext) for ext in CAPTION_EXTS)
+
+
+def plan(dataset_dir, overwrite=False, done=()):
+    """relpaths of images that still need a caption, sorted."""
+    todo = []
+    for root, dirs, names in os.walk(dataset_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if not name.lower().endswith(IMAGE_EXTS):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dataset_dir)
+            if overwrite and rel in done or not overwrite and has_caption(path):
+                continue
+            todo.append(rel)
+    return sorted(todo)
+
+
+def _write_caption(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _load_manifest(dataset_dir, key):
+    try:
+        with open(os.path.join(dataset_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get("model") == key:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"model": key, "done": []}
+
+
+def _save_manifest(dataset_dir, manifest):
+    path = os.path.join(dataset_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def caption_dataset(dataset_dir, model, batch_size=32, workers=None, prefetch=4, overwrite=False,
+                    prefix="", ext=".txt", limit=None, on_progress=None):
+    """caption every image without a sidecar (or all with overwrite). returns a report.
+
+    prefix goes in front of every caption (e.g. a trigger word), limit
+    stops after that many images (the rest is picked up by the next run).
+    on_progress(done, total) runs after each batch is written.
+    """
+    start = time.monotonic()
+    manifest = _load_manifest(dataset_dir, model.key) if overwrite else None
+    done = set(manifest["done"]) if manifest else set()
+    todo = plan(dataset_dir, overwrite, done)
+    total = len(todo) if limit is None else min(limit, len(todo))
+    print(f"caption {dataset_dir}: {total} images to caption with {model.key}, batch {batch_size}")
+
+    written, writes, batches = [], [], [0]
+
+    def write_batch(results):
+        for rel, text in results:
+            stem = os.path.splitext(os.path.join(dataset_dir, rel))[0]
+            _write_caption(stem + ext, prefix + text)
+        written.extend(rel for rel, _ in results)
+        batches[0] += 1
+        if manifest is not None and batches[0] % SAVE_EVERY == 0:
+            manifest["done"] = sorted(done | set(written))
+            _save_manifest(dataset_dir, manifest)
+        if on_progress is not None:
+            on_progress(len(written), total)
+
+    jobs = ((rel, os.path.join(dataset_dir, rel)) for rel in todo[:total])
+    # one writer thread: sidecars land in order, the model doesn't wait on the volume
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        stats, errors = run_pipeline(
+            jobs, model.prepare, model.caption, batch_size, workers, prefetch,
+            on_batch=lambda results: writes.append(writer.submit(write_batch, results)),
+        )
+    for future in writes:
+        future.result()
+    if manifest is not None:
+        manifest["done"] = sorted(done | set(written))
+        _save_manifest(dataset_dir, manifest)
+
+    seconds = max(time.monotonic() - start, 1e-6)
+    report = {
+        "model": model.key,
+        "todo": len(todo),
+        "captioned": len(written),
+        "remaining": len(todo) - len(written) - len(errors),
+        "errors": errors,
+        "batches": stats["batches"],
+        "batch_size": batch_size,
+        "workers": workers or os.cpu_count() or 1,
+        "seconds": round(seconds, 2),
+        "images_per_s": round(len(written) / seconds, 2),
+        "infer_s": round(stats["infer_s"], 2),
+        "decode_wait_s": round(stats["decode_wait_s"], 2),
+        # ~1.0 = gpu bound (good), low = waiting on decode, add cpus / workers
+        "gpu_busy_share": round(stats["infer_s"] / seconds, 3),
+    }
+    print(
+        f"caption: {report['captioned']} images in {report['seconds']}s, {report['images_per_s']} img/s, "
+        f"gpu busy {report['gpu_busy_share']:.0%}, {len(errors)} errors"
+    )
+    return report
+
+
+# ---------- demo ----------
+
+def demo(images=400, batch_size=32, workers=None, seconds_per_batch=0.05, decode_s=0.004):
+    """fake dataset + DummyModel: interrupted run, resume, noop rerun, and a batch 1 baseline."""
+    import random
+    import shutil
+    import tempfile
+
+    work = tempfile.mkdtemp(prefix="captioner-")
+    try:
+        rng = random.Random(0)
+        for i in range(images):
+            with open(os.path.join(work, f"img_{i:05d}.jpg"), "wb") as f:
+                f.write(rng.randbytes(rng.randint(2048, 16384)))
+        with open(os.path.join(work, "img_00000.txt"), "w") as f:
+            f.write("already captioned")
+
+        model = DummyModel(seconds_per_batch=seconds_per_batch, decode_s=decode_s)
+        reports = {
+            "interrupted": caption_dataset(work, model, batch_size, workers, limit=images // 2),
+            "resumed": caption_dataset(work, model, batch_size, workers),
+            "noop": caption_dataset(work, model, batch_size, workers),
+        }
+        with open(os.path.join(work, "img_00000.txt")) as f:
+            assert f.read() == "already captioned"
+        captions = [n for n in os.listdir(work) if n.endswith(".txt")]
+        assert len(captions) == images, (len(captions), images)
+        # same work through a batch 1, one decoder loop: what the gui utilities do
+        reports["baseline"] = caption_dataset(work, model, 1, 1, overwrite=True, limit=min(images, 100))
+        return reports
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="batch captioning for a dataset folder")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("dataset_dir")
+    p.add_argument("--model", default="wd14", choices=list(MODELS))
+    p.add_argument("--batch-size", type=int, default=32)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--overwrite", action="store_true")
+    p.add_argument("--prefix", default="")
+    p = sub.add_parser("demo")
+    p.add_argument("--images", type=int, default=400)
+    p.add_argument("--batch-size", type=int, default=32)
+    p.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = caption_dataset(args.dataset_dir, make_model(args.model), args.batch_size, args.workers,
+                                 overwrite=args.overwrite, prefix=args.prefix)
+    else:
+        report = demo(args.images, args.batch_size, args.workers)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
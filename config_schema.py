@@ -0,0 +1,264 @@
+"""config.toml schema, defaults and resource profiles
+
+validate() checks every known key (type, range, choices), fills in the
+defaults and raises ConfigError listing everything that is wrong, so a
+typo fails the deploy instead of silently running on other values.
+unknown keys only warn.
+
+resource profiles ([profiles.<name>]) set gpu/cpu/memory/timeout/
+concurrency per group of functions. their defaults come from
+[modal_settings] (gui, train) or from what the functions used to
+hard-code (the rest); a profile section overrides field by field.
+
+  gui       run_kohya_gui (concurrency = @modal.concurrent inputs)
+  train     train_job, precompute_latent_cache
+  caption   caption_dataset (cpu = decode workers)
+  data      bucket planning, preprocessing, shards
+  download  hub downloads (app.py, download_model.py, download_dataset.py)
+  convert   model conversion and loader benchmarks
+  extract   lora extraction
+  cleanup   retention
+  export    export_outputs_* (one container per client stream)
+"""
+import re
+from dataclasses import dataclass
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass
+class Field:
+    kinds: tuple
+    default: object
+    choices: tuple = None
+    minimum: float = None
+
+
+GPU_TYPES = ("T4", "L4", "A10G", "A100", "A100-40GB", "A100-80GB", "L40S", "H100", "H200", "B200", "ANY")
+LAUNCH_MODES = ("inprocess", "subprocess")
+TELEMETRY_BACKENDS = ("auto", "nvml", "nvidia-smi", "fake")
+
+SCHEMA = {
+    "modal_settings": {
+        "gpu": Field(("gpu",), "A10G"),
+        "allow_concurrent_inputs": Field((int,), 10, minimum=1),
+        "scaledown_window": Field((int,), 600, minimum=2),
+        "timeout": Field((int,), 3600, minimum=10),
+        "memory": Field((int,), 8192, minimum=128),
+        "cpu": Field((int, float), 4, minimum=0.125),
+    },
+    "kohya_settings": {
+        "port": Field((int,), 8000, minimum=1),
+        "launch_mode": Field((str,), "inprocess", choices=LAUNCH_MODES),
+        "enable_bucket_manager": Field((bool,), True),
+        "enable_model_converter": Field((bool,), True),
+        "max_models": Field((int,), 5, minimum=0),
+        "max_models_gb": Field((int, float), 0, minimum=0),
+        "stage_datasets": Field((list,), []),
+        "train_workers": Field((int,), 2, minimum=1),
+        "preempt_margin": Field((int,), 300, minimum=0),
+        "max_resumes": Field((int,), 10, minimum=0),
+    },
+    "retention": {
+        "max_age_days": Field((int, float), 7, minimum=0),
+        "keep_last_checkpoints": Field((int,), 0, minimum=0),
+        "quota_gb": Field((int, float), 0, minimum=0),
+    },
+    "telemetry": {
+        "enabled": Field((bool,), True),
+        "port": Field((int,), 8001, minimum=1),
+        "interval": Field((int, float), 2, minimum=0.1),
+        "history": Field((int,), 1800, minimum=1),
+        "backend": Field((str,), "auto", choices=TELEMETRY_BACKENDS),
+    },
+    "optimization": {
+        "use_tcmalloc": Field((bool,), True),
+        "parallel_downloads": Field((bool, int), True),
+        "sync_max_workers": Field((int,), 32, minimum=1),
+        "cache_models": Field((bool,), True),
+        "prefetch_models": Field((bool, str), "unet"),
+    },
+    "warm_pool": {
+        "enabled": Field((bool,), False),
+        "timezone": Field((str,), "UTC"),
+        "interval_minutes": Field((int,), 10, minimum=1),
+        "windows": Field((list,), []),
+    },
+}
+
+# old names still accepted, with a warning
+ALIASES = {("modal_settings", "container_idle_timeout"): "scaledown_window"}
+
+PROFILE_FIELDS = {
+    "gpu": Field(("gpu",), None),
+    "cpu": Field((int, float), None, minimum=0.125),
+    "memory": Field((int,), None, minimum=128),
+    "timeout": Field((int,), None, minimum=10),
+    "scaledown_window": Field((int,), None, minimum=2),
+    "concurrency": Field((int,), None, minimum=1),
+    "max_containers": Field((int,), None, minimum=1),
+}
+
+WINDOW_FIELDS = {
+    "days": Field((str,), "mon-fri"),
+    "start": Field((str,), "08:00"),
+    "end": Field((str,), "19:00"),
+    "min_containers": Field((int,), 1, minimum=0),
+    "functions": Field((list,), ["run_kohya_gui"]),
+}
+
+
+def _type_ok(value, kinds):
+    for kind in kinds:
+        if kind == "gpu":
+            if value is None or (isinstance(value, str) and _gpu_ok(value)):
+                return True
+        elif kind is int:
+            if isinstance(value, int) and not isinstance(value, bool):
+                return True
+        elif kind is float:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return True
+        elif isinstance(value, kind):
+            return True
+    return False
+
+
+def _gpu_ok(value):
+    # "L4", "A100-80GB", "H100:2", "" = no gpu
+    if value == "":
+        return True
+    name, _, count = value.partition(":")
+    return name.upper() in GPU_TYPES and (not count or count.isdigit())
+
+
+def _kind_names(kinds):
+    return " or ".join(k if isinstance(k, str) else k.__name__ for k in kinds)
+
+
+def _check(where, value, field, errors):
+    if not _type_ok(value, field.kinds):
+        errors.append(f"{where}: expected {_kind_names(field.kinds)}, got {value!r}")
+    elif field.choices and value not in field.choices:
+        errors.append(f"{where}: must be one of {', '.join(field.choices)}, got {value!r}")
+    elif field.minimum is not None and isinstance(value, (int, float)) and not isinstance(value, bool) \
+            and value < field.minimum:
+        errors.append(f"{where}: must be >= {field.minimum}, got {value!r}")
+
+
+def _section(name, raw, fields, errors, warnings):
+    if not isinstance(raw, dict):
+        errors.append(f"[{name}]: expected a table, got {raw!r}")
+        raw = {}
+    out = {}
+    for key, value in raw.items():
+        alias = ALIASES.get((name, key))
+        if alias:
+            warnings.append(f"{name}.{key} is deprecated, use {alias}")
+            if alias not in raw:
+                key = alias
+            else:
+                continue
+        field = fields.get(key)
+        if field is None:
+            warnings.append(f"{name}.{key}: unknown key, ignored")
+            continue
+        _check(f"{name}.{key}", value, field, errors)
+        out[key] = value
+    for key, field in fields.items():
+        out.setdefault(key, list(field.default) if isinstance(field.default, list) else field.default)
+    return out
+
+
+def _clock(value):
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", value or "")
+    return bool(match) and int(match[1]) < 24 and int(match[2]) < 60
+
+
+def _days_ok(value):
+    from warm_pool import parse_days
+
+    try:
+        parse_days(value)
+        return True
+    except ValueError:
+        return False
+
+
+# big dataset syncs need it; not tied to modal_settings.timeout, set [profiles.download] to change
+DOWNLOAD_TIMEOUT = 7200
+
+
+def profile_defaults(config):
+    ms = config["modal_settings"]
+    return {
+        "gui": {"gpu": ms["gpu"], "cpu": ms["cpu"], "memory": ms["memory"], "timeout": ms["timeout"],
+                "scaledown_window": ms["scaledown_window"], "concurrency": ms["allow_concurrent_inputs"],
+                "max_containers": 1},
+        "train": {"gpu": ms["gpu"], "cpu": 4, "memory": 16384, "timeout": ms["timeout"],
+                  "max_containers": config["kohya_settings"]["train_workers"]},
+        "caption": {"gpu": ms["gpu"], "cpu": 8, "memory": 16384, "timeout": ms["timeout"]},
+        "data": {"cpu": 8, "memory": 8192, "timeout": ms["timeout"]},
+        "download": {"cpu": 2, "memory": 4096, "timeout": DOWNLOAD_TIMEOUT},
+        "convert": {"cpu": 4, "memory": 8192, "timeout": ms["timeout"]},
+        "extract": {"cpu": 8, "memory": 32768, "timeout": ms["timeout"]},
+        "cleanup": {"cpu": 1, "memory": 1024, "timeout": ms["timeout"]},
+        "export": {"cpu": 2, "memory": 4096, "timeout": ms["timeout"]},
+    }
+
+
+def validate(raw):
+    """(config with defaults, warnings); raises ConfigError with every problem found."""
+    errors, warnings = [], []
+    config = {}
+    for name, fields in SCHEMA.items():
+        config[name] = _section(name, raw.get(name, {}), fields, errors, warnings)
+    for name in raw:
+        if name not in SCHEMA and name != "profiles":
+            warnings.append(f"[{name}]: unknown section, ignored")
+
+    profiles = profile_defaults(config)
+    raw_profiles = raw.get("profiles", {})
+    if not isinstance(raw_profiles, dict):
+        errors.append(f"[profiles]: expected tables, got {raw_profiles!r}")
+        raw_profiles = {}
+    for name, section in raw_profiles.items():
+        values = _section(f"profiles.{name}", section, PROFILE_FIELDS, errors, warnings)
+        merged = dict(profiles.get(name, {}))
+        merged.update({k: v for k, v in values.items() if k in (section if isinstance(section, dict) else {})})
+        profiles[name] = merged
+    config["profiles"] = profiles
+
+    windows = []
+    for i, window in enumerate(config["warm_pool"]["windows"]):
+        where = f"warm_pool.windows[{i}]"
+        values = _section(where, window, WINDOW_FIELDS, errors, warnings)
+        for key in ("start", "end"):
+            if isinstance(values[key], str) and not _clock(values[key]):
+                errors.append(f"{where}.{key}: expected HH:MM, got {values[key]!r}")
+        if isinstance(values["days"], str) and not _days_ok(values["days"]):
+            errors.append(f"{where}.days: expected e.g. mon-fri, sat,sun or *, got {values['days']!r}")
+        windows.append(values)
+    config["warm_pool"]["windows"] = windows
+    if config["warm_pool"]["enabled"]:
+        try:
+            from zoneinfo import ZoneInfo
+
+            ZoneInfo(config["warm_pool"]["timezone"])
+        except Exception:
+            errors.append(f"warm_pool.timezone: unknown timezone {config['warm_pool']['timezone']!r}")
+
+    if errors:
+        raise ConfigError("invalid config.toml:\n  " + "\n  ".join(errors))
+    return config, warnings
+
+
+def modal_resources(profile):
+    """@app.function kwargs for a profile (concurrency goes to @modal.concurrent)."""
+    out = {k: profile[k] for k in ("cpu", "memory", "timeout", "scaledown_window", "max_containers")
+           if profile.get(k) is not None}
+    if profile.get("gpu"):
+        out["gpu"] = profile["gpu"]
+    return out
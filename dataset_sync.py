@@ -0,0 +1,627 @@
+"""revision aware, incremental hub -> volume sync
+
+the last synced commit and every file's etag (lfs sha256, or the git blob
+id for small files) are kept in `<dest>/.sync/<repo>.json`. a sync:
+
+1. resolves the wanted revision to a commit sha; if it matches the
+   manifest and every file is still there, that was the only request
+2. lists the tree at that commit (paginated) and diffs it against the
+   manifest: added/changed files are fetched, files that disappeared
+   upstream are deleted, the rest is left alone
+3. fetches through a pool whose width is set by an AIMD controller:
+   +1 worker after every `limit` clean responses, halved on 429/5xx
+   (honouring Retry-After), so it finds the hub's limit instead of
+   guessing one
+
+talks to the hub over plain http at $HF_ENDPOINT, so FakeHub (a local
+server that injects 429s / 5xx) can stand in for it:
+
+    python dataset_sync.py demo
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from downloader import _open
+
+DEFAULT_ENDPOINT = "https://huggingface.co"
+MANIFEST_DIR = ".sync"
+TREE_PAGE = 1000
+RETRIES = 8
+BLOCK_SIZE = 1024 * 1024
+THROTTLE_CODES = (429, 500, 502, 503, 504)
+
+
+def endpoint():
+    return os.environ.get("HF_ENDPOINT", DEFAULT_ENDPOINT).rstrip("/")
+
+
+def _headers(token=None):
+    token = token or os.environ.get("HF_TOKEN")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def _quote(path):
+    return urllib.parse.quote(path, safe="/")
+
+
+def _api_prefix(repo_type):
+    return {"dataset": "datasets", "model": "models", "space": "spaces"}[repo_type]
+
+
+class Throttled(Exception):
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"http {code}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+# ---------- adaptive concurrency ----------
+
+class AdaptiveLimiter:
+    """AIMD limit on requests in flight.
+
+    success: after `limit` clean responses in a row, limit += 1.
+    throttle: limit halves (not below minimum) and new requests wait out
+    the cooldown (Retry-After if the server sent one).
+    """
+
+    def __init__(self, start=4, minimum=1, maximum=32, cooldown=1.0):
+        self.limit = max(minimum, min(start, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak = self.limit
+        self.throttles = 0
+        self.changes = [(0.0, self.limit)]
+        self._ok = 0
+        self._paused_until = 0.0
+        self._start = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _record(self):
+        self.changes.append((round(time.monotonic() - self._start, 2), self.limit))
+        self.peak = max(self.peak, self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, throttled=False, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self._ok = 0
+                pause = retry_after if retry_after is not None else self.cooldown
+                # one halving per throttle burst, not one per failed request
+                if time.monotonic() >= self._paused_until:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self._record()
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            else:
+                self._ok += 1
+                if self._ok >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._ok = 0
+                    self._record()
+            self._cond.notify_all()
+
+
+@contextmanager
+def _request(url, limiter, headers, method="GET"):
+    """response held inside a limiter slot; 429/5xx -> Throttled."""
+    limiter.acquire()
+    try:
+        resp = _open(url, headers, method=method)
+    except urllib.error.HTTPError as e:
+        if e.code in THROTTLE_CODES:
+            retry = e.headers.get("Retry-After") if e.headers else None
+            try:
+                retry = float(retry) if retry is not None else None
+            except ValueError:
+                retry = None
+            limiter.release(throttled=True, retry_after=retry)
+            raise Throttled(e.code, retry)
+        limiter.release()
+        raise
+    except BaseException:
+        limiter.release()
+        raise
+    try:
+        with resp:
+            yield resp
+    finally:
+        limiter.release()
+
+
+def _with_retries(fn, retries=RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Throttled:
+            if attempt == retries:
+                raise
+        except (urllib.error.URLError, OSError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                raise
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** attempt, 30) * (0.5 + random.random() / 2))
+
+
+# ---------- hub api ----------
+
+def resolve_revision(repo_id, revision="main", repo_type="dataset", limiter=None, token=None):
+    limiter = limiter or AdaptiveLimiter()
+    url = f"{endpoint()}/api/{_api_prefix(repo_type)}/{repo_id}/revision/{_quote(revision)}"
+
+    def call():
+        with _request(url, limiter, _headers(token)) as resp:
+            return json.load(resp)["sha"]
+
+    return _with_retries(call)
+
+
+def _next_link(header):
+    # Link: <https://...&cursor=...>; rel="next"
+    for part in (header or "").split(","):
+        if 'rel="next"' in part:
+            return part[part.index("<") + 1:part.index(">")]
+    return None
+
+
+def list_tree(repo_id, sha, repo_type="dataset", limiter=None, token=None):
+    """{path: {"etag", "size", "lfs"}} for every file at commit sha."""
+    limiter = limiter or AdaptiveLimiter()
+    url = f"{endpoint()}/api/{_api_prefix(repo_type)}/{repo_id}/tree/{sha}?recursive=true&limit={TREE_PAGE}"
+    files = {}
+    while url:
+        def call(url=url):
+            with _request(url, limiter, _headers(token)) as resp:
+                data = json.load(resp)
+                link = resp.headers.get("Link")
+            return data, link
+
+        entries, link = _with_retries(call)
+        for entry in entries:
+            if entry.get("type") != "file":
+                continue
+            lfs = entry.get("lfs") or {}
+            files[entry["path"]] = {
+                "etag": lfs.get("oid") or entry["oid"],
+                "size": entry.get("size"),
+                "lfs": bool(lfs),
+            }
+        url = _next_link(link)
+    return files
+
+
+def file_url(repo_id, sha, path, repo_type="dataset"):
+    prefix = "" if repo_type == "model" else f"{_api_prefix(repo_type)}/"
+    return f"{endpoint()}/{prefix}{repo_id}/resolve/{sha}/{_quote(path)}"
+
+
+# ---------- manifest ----------
+
+def manifest_path(dest_root, repo_id):
+    return os.path.join(dest_root, MANIFEST_DIR, repo_id.replace("/", "--") + ".json")
+
+
+def load_manifest(dest_root, repo_id):
+    try:
+        with open(manifest_path(dest_root, repo_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"repo_id": repo_id, "revision": None, "files": {}}
+
+
+def save_manifest(dest_root, manifest):
+    path = manifest_path(dest_root, manifest["repo_id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def matches(name, patterns):
+    return any(fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def diff(manifest, remote, dest_root, patterns=("*",)):
+    """(fetch, delete, unchanged) names. fetch covers new, changed and locally missing files."""
+    known = manifest["files"]
+    fetch, unchanged = [], []
+    for name, info in remote.items():
+        if not matches(name, patterns):
+            continue
+        old = known.get(name)
+        path = os.path.join(dest_root, name)
+        if old and old["etag"] == info["etag"] and os.path.exists(path) \
+                and (info["size"] is None or os.path.getsize(path) == info["size"]):
+            unchanged.append(name)
+        else:
+            fetch.append(name)
+    delete = [name for name in known if name not in remote and matches(name, patterns)]
+    return fetch, delete, unchanged
+
+
+# ---------- fetch ----------
+
+def _fetch(url, dest, info, limiter, headers):
+    tmp = dest + ".sync"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+
+    def call():
+        sha = hashlib.sha256()
+        size = 0
+        with _request(url, limiter, headers) as resp, open(tmp, "wb") as out:
+            while True:
+                block = resp.read(BLOCK_SIZE)
+                if not block:
+                    break
+                out.write(block)
+                sha.update(block)
+                size += len(block)
+        if info.get("size") is not None and size != info["size"]:
+            raise OSError(f"size {size} != {info['size']}")
+        if info.get("lfs") and sha.hexdigest() != info["etag"]:
+            raise OSError(f"sha256 mismatch: {sha.hexdigest()}")
+        os.replace(tmp, dest)
+        return size
+
+    try:
+        return _with_retries(call)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def sync(repo_id, dest_root, revision="main", patterns=("*",), repo_type="dataset",
+         start_workers=4, max_workers=32, token=None, link=None, on_file=None,
+         on_progress=None, delete=True):
+    """bring dest_root in line with repo_id@revision, returns a report.
+
+    link(name, info, dest) -> bool may put a file in place without
+    downloading it (blob store dedup); on_file(name, info, dest) runs
+    after every fetched file, on_progress(done, total) every 100 files
+    (commit the volume there).
+    """
+    start = time.monotonic()
+    patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+    limiter = AdaptiveLimiter(start=start_workers, maximum=max_workers)
+    manifest = load_manifest(dest_root, repo_id)
+    sha = resolve_revision(repo_id, revision, repo_type, limiter, token)
+    report = {"repo_id": repo_id, "revision": sha, "previous": manifest["revision"]}
+
+    same_commit = manifest["revision"] == sha and manifest.get("patterns") == patterns
+    if same_commit and all(os.path.exists(os.path.join(dest_root, n)) for n in manifest["files"]):
+        report.update(status="up_to_date", fetched=0, deleted=0, unchanged=len(manifest["files"]),
+                      seconds=round(time.monotonic() - start, 2))
+        return report
+
+    remote = list_tree(repo_id, sha, repo_type, limiter, token)
+    fetch, removed, unchanged = diff(manifest, remote, dest_root, patterns)
+    print(f"sync {repo_id}@{sha[:8]}: {len(fetch)} to fetch, {len(removed)} removed, {len(unchanged)} unchanged")
+
+    deleted = 0
+    if delete:
+        for name in removed:
+            path = os.path.join(dest_root, name)
+            if os.path.exists(path):
+                os.remove(path)
+                deleted += 1
+            manifest["files"].pop(name, None)
+
+    headers = _headers(token)
+    errors, linked, fetched_bytes = {}, 0, 0
+    done = [0]
+    lock = threading.Lock()
+
+    def one(name):
+        info = remote[name]
+        dest = os.path.join(dest_root, name)
+        if link is not None and link(name, info, dest):
+            return name, "linked", 0
+        size = _fetch(file_url(repo_id, sha, name, repo_type), dest, info, limiter, headers)
+        if on_file is not None:
+            on_file(name, info, dest)
+        return name, "ok", size
+
+    # pool as wide as the limiter may ever go, the limiter decides how many run
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(one, name): name for name in fetch}
+        for future in futures:
+            name = futures[future]
+            try:
+                _, status, size = future.result()
+                linked += status == "linked"
+                fetched_bytes += size
+                with lock:
+                    manifest["files"][name] = {"etag": remote[name]["etag"], "size": remote[name]["size"]}
+            except Exception as e:
+                errors[name] = str(e)
+            done[0] += 1
+            if on_progress is not None and done[0] % 100 == 0:
+                save_manifest(dest_root, manifest)
+                on_progress(done[0], len(fetch))
+
+    for name in unchanged:
+        manifest["files"].setdefault(name, {"etag": remote[name]["etag"], "size": remote[name]["size"]})
+    # revision only moves forward when everything made it, the next run re-diffs otherwise
+    if not errors:
+        manifest["revision"] = sha
+        manifest["patterns"] = patterns
+    manifest["synced_at"] = time.time()
+    save_manifest(dest_root, manifest)
+
+    seconds = max(time.monotonic() - start, 1e-6)
+    report.update(
+        status="done" if not errors else "partial",
+        fetched=len(fetch) - len(errors) - linked,
+        linked=linked,
+        deleted=deleted,
+        unchanged=len(unchanged),
+        errors=errors,
+        bytes=fetched_bytes,
+        seconds=round(seconds, 2),
+        mb_per_s=round(fetched_bytes / seconds / (1024 ** 2), 2),
+        workers={"peak": limiter.peak, "final": limiter.limit, "throttles": limiter.throttles,
+                 "changes": limiter.changes[-20:]},
+    )
+    return report
+
+
+def store_hooks(store, source, commit=None, commit_every=60):
+    """link/on_file/on_progress for sync() writing through a blobstore.BlobStore.
+
+    content the store already has is linked instead of fetched, fetched
+    files are ingested. every commit_every seconds (checked each 100
+    files) the store index is saved and commit() runs, so a restarted
+    container keeps what was fetched. save once more after sync().
+    """
+    lock = threading.Lock()  # callbacks come from the sync workers
+    last_commit = [time.monotonic()]
+
+    def link(name, info, dest):
+        with lock:
+            digest = store.find(etag=info["etag"], sha256=info["etag"] if info["lfs"] else None)
+            if digest is None:
+                return False
+            store.materialize(digest, dest)
+        return True
+
+    def on_file(name, info, dest):
+        with lock:
+            store.ingest(dest, etag=info["etag"], source=source, digest=info["etag"] if info["lfs"] else None)
+
+    def on_progress(done, total):
+        if time.monotonic() - last_commit[0] < commit_every:
+            return
+        with lock:
+            store.save()
+        if commit is not None:
+            commit()
+        last_commit[0] = time.monotonic()
+
+    return {"link": link, "on_file": on_file, "on_progress": on_progress}
+
+
+# ---------- fake hub ----------
+
+class FakeHub:
+    """local stand-in for the hub api, serving repos from directories.
+
+    root/<repo_id>/ is the repo; its sha changes whenever a file does.
+    max_concurrent: requests beyond that many in flight get 429 with
+    Retry-After; error_rate: share of requests answered with a 503.
+    """
+
+    def __init__(self, root, port=0, max_concurrent=None, error_rate=0.0, retry_after=0.2, latency=0.0):
+        self.root = root
+        self.max_concurrent = max_concurrent
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "peak": 0}
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self.server = self._server(port)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def files(self, repo_id):
+        base = os.path.join(self.root, repo_id)
+        out = {}
+        for root, _, names in os.walk(base):
+            for name in names:
+                path = os.path.join(root, name)
+                out[os.path.relpath(path, base).replace(os.sep, "/")] = path
+        return out
+
+    def tree(self, repo_id):
+        entries = []
+        for rel, path in sorted(self.files(repo_id).items()):
+            with open(path, "rb") as f:
+                data = f.read()
+            entry = {"type": "file", "path": rel, "size": len(data),
+                     "oid": hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()}
+            if len(data) >= 1024:  # "lfs" for anything not tiny
+                entry["lfs"] = {"oid": hashlib.sha256(data).hexdigest(), "size": len(data)}
+            entries.append(entry)
+        return entries
+
+    def sha(self, repo_id):
+        digest = hashlib.sha1()
+        for entry in self.tree(repo_id):
+            digest.update(f"{entry['path']}:{entry['oid']}\n".encode())
+        return digest.hexdigest()
+
+    def _server(self, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, body=b"", kind="application/json", headers=None):
+                self.send_response(code)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                with hub._lock:
+                    hub.stats["requests"] += 1
+                    hub.in_flight += 1
+                    hub.stats["peak"] = max(hub.stats["peak"], hub.in_flight)
+                    over = hub.max_concurrent is not None and hub.in_flight > hub.max_concurrent
+                    fail = hub._rng.random() < hub.error_rate
+                try:
+                    if over:
+                        with hub._lock:
+                            hub.stats["throttled"] += 1
+                        return self._send(429, b'{"error":"rate limited"}',
+                                          headers={"Retry-After": str(hub.retry_after)})
+                    if fail:
+                        with hub._lock:
+                            hub.stats["errors"] += 1
+                        return self._send(503, b'{"error":"unavailable"}')
+                    if hub.latency:
+                        time.sleep(hub.latency)
+                    self.route()
+                finally:
+                    with hub._lock:
+                        hub.in_flight -= 1
+
+            def route(self):
+                url = urllib.parse.urlparse(self.path)
+                parts = urllib.parse.unquote(url.path).strip("/").split("/")
+                if parts[:2] == ["api", "datasets"] and len(parts) >= 6:
+                    repo_id, kind = "/".join(parts[2:4]), parts[4]
+                    if kind == "revision":
+                        return self._send(200, json.dumps({"sha": hub.sha(repo_id)}).encode())
+                    if kind == "tree":
+                        return self.tree_page(repo_id, urllib.parse.parse_qs(url.query))
+                if parts[0] == "datasets" and len(parts) >= 6 and parts[3] == "resolve":
+                    path = hub.files("/".join(parts[1:3])).get("/".join(parts[5:]))
+                    if path:
+                        with open(path, "rb") as f:
+                            return self._send(200, f.read(), "application/octet-stream")
+                self._send(404, b'{"error":"not found"}')
+
+            def tree_page(self, repo_id, query):
+                entries = hub.tree(repo_id)
+                limit = int(query.get("limit", [TREE_PAGE])[0])
+                cursor = int(query.get("cursor", [0])[0])
+                page = entries[cursor:cursor + limit]
+                headers = {}
+                if cursor + limit < len(entries):
+                    nxt = f"{hub.url}{urllib.parse.urlparse(self.path).path}?recursive=true&limit={limit}&cursor={cursor + limit}"
+                    headers["Link"] = f'<{nxt}>; rel="next"'
+                self._send(200, json.dumps(page).encode(), headers=headers)
+
+            do_HEAD = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def demo(files=300, max_concurrent=6, error_rate=0.02):
+    """fake dataset, full sync, edit/add/remove a few files, sync again."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as work:
+        repo = os.path.join(work, "hub", "me", "images")
+        os.makedirs(repo)
+        rng = random.Random(1)
+        for i in range(files):
+            with open(os.path.join(repo, f"img_{i:05d}.jpg"), "wb") as f:
+                f.write(rng.randbytes(rng.randint(2048, 65536)))
+            with open(os.path.join(repo, f"img_{i:05d}.txt"), "w") as f:
+                f.write(f"caption {i}")
+        hub = FakeHub(os.path.join(work, "hub"), max_concurrent=max_concurrent,
+                      error_rate=error_rate, latency=0.01).start()
+        os.environ["HF_ENDPOINT"] = hub.url
+        dest = os.path.join(work, "dataset")
+        reports = {"first": sync("me/images", dest, max_workers=32)}
+        reports["again"] = sync("me/images", dest)
+        for i in range(5):
+            with open(os.path.join(repo, f"img_{i:05d}.txt"), "w") as f:
+                f.write(f"better caption {i}")
+        os.remove(os.path.join(repo, "img_00010.jpg"))
+        with open(os.path.join(repo, "new.txt"), "w") as f:
+            f.write("new")
+        reports["changed"] = sync("me/images", dest)
+        reports["hub"] = hub.stats
+        hub.stop()
+    return reports
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="incremental hub dataset sync")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("sync")
+    p.add_argument("repo_id")
+    p.add_argument("dest")
+    p.add_argument("--revision", default="main")
+    p.add_argument("--pattern", action="append", default=None)
+    p.add_argument("--max-workers", type=int, default=32)
+    p = sub.add_parser("fake-hub", help="serve directories under ROOT as dataset repos")
+    p.add_argument("root")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--max-concurrent", type=int, default=None)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p = sub.add_parser("demo")
+    p.add_argument("--files", type=int, default=300)
+    p.add_argument("--max-concurrent", type=int, default=6)
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        report = sync(args.repo_id, args.dest, args.revision, args.pattern or ["*"], max_workers=args.max_workers)
+    elif args.command == "fake-hub":
+        hub = FakeHub(args.root, args.port, args.max_concurrent, args.error_rate).start()
+        print(f"fake hub at {hub.url}, use HF_ENDPOINT={hub.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+    else:
+        report = demo(args.files, args.max_concurrent)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
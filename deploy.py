@@ -5,6 +5,7 @@ import subprocess
 import sys
 import os
 import json
+import time
 from pathlib import Path
 
 # pastikan stdout pakai UTF-8
@@ -74,10 +75,66 @@ def check_requirements():
         safe_print("app.py not found")
         return False
 
+    if not check_config():
+        return False
+
     safe_print("everything looks good")
     return True
 
 
+def check_config():
+    """validate config.toml the same way app.py does at deploy time."""
+    from settings import ConfigError, load_config
+    from config_schema import validate
+
+    try:
+        _, warnings = validate(load_config())
+    except ConfigError as e:
+        safe_print(str(e))
+        return False
+    for warning in warnings:
+        safe_print(f"config.toml: {warning}")
+    return True
+
+
+def show_profiles():
+    """resource profiles after defaults + [profiles.*] overrides."""
+    from settings import validated_config
+
+    for name, profile in validated_config()["profiles"].items():
+        values = ", ".join(f"{k}={v}" for k, v in profile.items() if v is not None)
+        safe_print(f"{name:9s} {values}")
+    return True
+
+
+def warm_pool(apply=False):
+    """warm pool targets for right now, apply pushes them to the deployed app."""
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    from settings import validated_config
+    from warm_pool import desired
+
+    pool = validated_config()["warm_pool"]
+    now = datetime.now(ZoneInfo(pool["timezone"]))
+    state = "enabled" if pool["enabled"] else "disabled (warm_pool.enabled = false)"
+    safe_print(f"warm pool {state}, {now:%a %H:%M} {pool['timezone']}")
+    for name, n in desired(pool["windows"], now).items():
+        safe_print(f"  {name}: min_containers={n}")
+    if not apply:
+        return True
+    import modal
+
+    try:
+        result = modal.Function.from_name("kohya-ss-gui", "apply_warm_pool").remote()
+    except Exception as e:
+        safe_print(f"could not apply warm pool (is the app deployed?): {e}")
+        return False
+    safe_print(f"applied: {result.get('min_containers', result.get('message'))}")
+    for name, error in result.get("errors", {}).items():
+        safe_print(f"  {name}: {error}")
+    return result["status"] in ("ok", "disabled")
+
+
 def build_image():
     safe_print("building modal image...")
     success = run_cmd("modal build app.py")
@@ -88,6 +145,19 @@ def build_image():
     return success
 
 
+def refresh_lock(kohya_ref="HEAD", sd_scripts_ref="HEAD"):
+    """pin kohya_ss/sd-scripts, resolve wheels into kohya-wheelhouse, write image.lock."""
+    safe_print("resolving locked dependencies on modal...")
+    success = run_cmd(
+        f"modal run wheelhouse.py --kohya-ref {kohya_ref} --sd-scripts-ref {sd_scripts_ref}"
+    )
+    if success:
+        safe_print("image.lock updated, commit it; the next build installs from the wheelhouse")
+    else:
+        safe_print("lock refresh failed, image.lock unchanged")
+    return success
+
+
 def start_dev():
     safe_print("starting dev server...")
     safe_print("ctrl+c to stop")
@@ -104,29 +174,366 @@ def deploy_prod():
     return success
 
 
-def check_health():
+def check_health(probes=3, timeout=5.0):
+    """probe /healthz of the running gui container over http, with latency."""
+    import urllib.error
+    import urllib.request
+
     safe_print("checking service health...")
-    output = run_cmd("modal run app.py::health_check", get_output=True)
-    if output:
+    url = telemetry_url()
+    if url is None:
+        return False
+    latencies, report = [], None
+    for _ in range(probes):
+        start = time.monotonic()
         try:
-            data = json.loads(output)
-            safe_print(f"service status: {data.get('status')}")
-            safe_print(f"pytorch: {data.get('torch_version')}")
-            safe_print(f"cuda: {data.get('cuda_available')}")
+            with urllib.request.urlopen(f"{url}/healthz", timeout=timeout) as resp:
+                report = json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            report = json.loads(e.read() or b"{}")  # 503 = not ready, same body
         except Exception as e:
-            safe_print("service responded but not valid JSON:")
-            safe_print(output)
+            safe_print(f"unreachable after {time.monotonic() - start:.1f}s: {e}")
+            continue
+        latencies.append((time.monotonic() - start) * 1000)
+    if report is None:
+        safe_print(f"health check failed: {url} did not answer")
+        return False
+
+    safe_print(f"status: {report['status']} (checks {report.get('age_s')}s old)")
+    safe_print(f"latency: min {min(latencies):.0f}ms, avg {sum(latencies) / len(latencies):.0f}ms "
+               f"over {len(latencies)}/{probes} probes")
+    checks = report.get("checks", {})
+    gui = checks.get("gui", {})
+    startup = f" (startup {gui['startup_s']}s, {gui.get('mode')})" if gui.get("startup_s") else ""
+    safe_print(f"gui: {'up' if gui.get('ok') else 'down'}{startup}")
+    gpu = checks.get("gpu", {})
+    for g in gpu.get("gpus") if isinstance(gpu.get("gpus"), list) else []:
+        safe_print(f"gpu: {g['name']} util {g['util']}%  vram {g['mem_used_mb']:.0f}/{g['mem_total_mb']:.0f}MB")
+    if not isinstance(gpu.get("gpus"), list):
+        safe_print(f"gpu: {gpu.get('gpus', 0)} visible ({gpu.get('source')})")
+    train = checks.get("training", {})
+    if train.get("active"):
+        safe_print(f"training: step {train['step']}/{train['total']}, {train['it_per_s']} it/s")
     else:
-        safe_print("health check failed")
+        safe_print("training: idle")
+    queue = checks.get("queue", {})
+    if "counts" in queue:
+        safe_print(f"queue: {queue['counts'].get('pending', 0)} pending, running {queue.get('running') or '-'}")
+    for path, mount in checks.get("volumes", {}).get("paths", {}).items():
+        if not mount["ok"]:
+            safe_print(f"volume missing: {path}")
+    for name in report.get("failing", []):
+        safe_print(f"failing: {name} {checks.get(name, {}).get('error', '')}".rstrip())
+    return report["status"] == "ok"
+
+
+def cleanup_files(days=None, dry_run=False):
+    """run the retention policies on kohya-outputs, days overrides max_age_days."""
+    import modal
+
+    label = f"older than {days} days" if days is not None else "per [retention] in config.toml"
+    safe_print(f"{'dry run: ' if dry_run else ''}cleaning up files {label}...")
+    try:
+        cleanup = modal.Function.from_name("kohya-ss-gui", "cleanup_old_files")
+        report = cleanup.remote(days_old=days, dry_run=dry_run)
+    except Exception as e:
+        safe_print(f"cleanup failed: {e}")
+        return False
 
+    gb = 1024 ** 3
+    safe_print(f"indexed {report['files']} files, {report['bytes'] / gb:.2f}GB "
+               f"({report['scan']['dirs_listed']} dirs rescanned, {report['scan']['dirs_reused']} from index)")
+    for reason, info in report["by_reason"].items():
+        safe_print(f"  {reason:<10} {info['files']} files, {info['bytes'] / gb:.2f}GB")
+    if dry_run:
+        for item in report.get("evict", []):
+            safe_print(f"  would delete {item['path']} ({item['reason']})")
+    else:
+        safe_print(f"deleted {report['deleted']} files, freed {report['freed_bytes'] / gb:.2f}GB")
+        for path, error in report["errors"].items():
+            safe_print(f"  failed: {path}: {error}")
+    safe_print("cleanup done")
+    return True
 
-def cleanup_files(days=7):
-    safe_print(f"cleaning up files older than {days} days...")
-    success = run_cmd(f"modal run app.py::cleanup_old_files --days-old {days}")
-    if success:
-        safe_print("cleanup done")
+
+def export_outputs(argv):
+    """pull selected kohya-outputs files as one chunked archive, parallel + resumable."""
+    import argparse
+    import hashlib
+    import modal
+    from exporter import ExportDownload, ExportError, default_compression, fetch
+
+    parser = argparse.ArgumentParser(prog="deploy.py export")
+    parser.add_argument("dest", nargs="?", default="outputs")
+    parser.add_argument("--run", action="append", help="run dir or glob, repeatable")
+    parser.add_argument("--glob", action="append", help="path glob, e.g. '*.safetensors', repeatable")
+    parser.add_argument("--latest", type=int, help="only the newest N checkpoints per run")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--no-compress", action="store_true")
+    parser.add_argument("--fresh", action="store_true", help="re-plan instead of resuming")
+    parser.add_argument("--keep-tar", action="store_true", help="keep the .tar, don't extract")
+    args = parser.parse_args(argv)
+
+    compression = "none" if args.no_compress else default_compression()
+    selection = {"runs": args.run, "patterns": args.glob, "latest": args.latest,
+                 "chunk_mb": args.chunk_mb, "compression": compression}
+    name = hashlib.sha256(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:8]
+    os.makedirs(args.dest, exist_ok=True)
+    tar_path = os.path.join(args.dest, f"kohya-outputs-{name}.tar")
+
+    download = None
+    if not args.fresh:
+        try:
+            download = ExportDownload(tar_path, selection=selection)
+            safe_print(f"resuming {tar_path}: {len(download.done)}/{download.plan['chunks']} chunks already here")
+        except ExportError:
+            pass
+    if download is None:
+        planner = modal.Function.from_name("kohya-ss-gui", "export_outputs_plan")
+        try:
+            result = planner.remote(args.run, args.glob, args.latest, args.chunk_mb)
+        except Exception as e:
+            safe_print(f"could not plan export (is the app deployed?): {e}")
+            return False
+        if result.get("status") != "ok":
+            safe_print(result.get("message"))
+            return False
+        download = ExportDownload(tar_path, result["plan"], selection)
+    plan = download.plan
+    safe_print(f"{len(plan['files'])} files, {plan['size'] / (1024 ** 3):.2f}GB in {plan['chunks']} chunks, "
+               f"{args.streams} streams, {compression}")
+
+    chunks = modal.Function.from_name("kohya-ss-gui", "export_outputs_chunks")
+
+    def progress(done, total, totals):
+        if done % 16 == 0 or done == total:
+            safe_print(f"  {done}/{total} chunks, {totals['raw'] / (1024 ** 2):.0f}MB")
+
+    try:
+        report = fetch(download, lambda indices: chunks.remote_gen(plan, indices, compression),
+                       args.streams, progress)
+    except ExportError as e:
+        safe_print(f"export failed: {e} (--fresh)")
+        return False
+    except Exception as e:
+        safe_print(f"export interrupted ({e}), rerun the same command to resume")
+        return False
+    safe_print(f"fetched {report['raw'] / (1024 ** 3):.2f}GB in {report['seconds']}s ({report['mb_per_s']} MB/s, "
+               f"wire/raw {report['ratio']})")
+    if args.keep_tar:
+        safe_print(f"archive: {tar_path}")
+    else:
+        download.extract(args.dest)
+        safe_print(f"extracted into {args.dest}")
+    return True
+
+
+def upload_model_file(path, name=None, fresh=False):
+    """stream a local checkpoint into kohya-models, chunk by chunk (resumable).
+
+    fresh throws away whatever partial upload the server has under name.
+    """
+    import modal
+    from uploader import iter_file_chunks, stream_upload
+
+    if not Path(path).is_file():
+        safe_print(f"file not found: {path}")
+        return False
+    name = name or Path(path).name
+    size = Path(path).stat().st_size
+    safe_print(f"uploading {path} as {name} ({size / (1024 ** 3):.2f}GB)...")
+
+    begin = modal.Function.from_name("kohya-ss-gui", "upload_model_begin")
+    chunk = modal.Function.from_name("kohya-ss-gui", "upload_model_chunk")
+    finish = modal.Function.from_name("kohya-ss-gui", "upload_model_finish")
+
+    def start(keep):
+        state = begin.remote(name, keep)
+        return state["offset"], state.get("chunks", [])
+
+    def send(offset, data, sha256):
+        new_offset = chunk.remote(name, offset, data, sha256)["offset"]
+        safe_print(f"  {new_offset / size:.0%}")
+        return new_offset
+
+    try:
+        result = stream_upload(
+            iter_file_chunks(path),
+            start,
+            send,
+            lambda total, sha256: finish.remote(name, total, sha256),
+            fresh=fresh,
+        )
+    except Exception as e:
+        safe_print(f"upload failed: {e}")
+        safe_print("run the same command again to resume")
+        return False
+    safe_print(f"uploaded to {result.get('path')} (sha256 {result.get('sha256')})")
+    return True
+
+
+def check_import_profile(history="import_profiles.jsonl"):
+    """fetch the image's import profile and compare with the last one seen."""
+    import modal
+
+    safe_print("fetching import profile from the image...")
+    try:
+        profile = modal.Function.from_name("kohya-ss-gui", "import_profile").remote()
+    except Exception as e:
+        safe_print(f"could not fetch profile (is the app deployed?): {e}")
+        return False
+
+    current = {m["module"]: m["wall_s"] for m in profile.get("modules", [])}
+    last = {}
+    path = Path(history)
+    if path.exists():
+        lines = path.read_text().strip().splitlines()
+        if lines:
+            last = json.loads(lines[-1])
+    previous = last.get("modules", {})
+
+    for module, wall in current.items():
+        line = f"  {module:<32} {wall:6.2f}s"
+        before = previous.get(module)
+        if before:
+            change = (wall - before) / before
+            line += f"  ({change:+.0%})"
+            if change > 0.2:
+                line += "  <- regression"
+        safe_print(line)
+
+    # one line per image build
+    if profile.get("built_at") != last.get("built_at"):
+        with open(path, "a") as f:
+            f.write(json.dumps({"built_at": profile.get("built_at"), "modules": current}) + "\n")
+    return True
+
+
+def submit_training(config, priority=0):
+    """queue a toml from the kohya-configs volume for headless training."""
+    import modal
+
+    submit = modal.Function.from_name("kohya-ss-gui", "submit_training_job")
+    try:
+        result = submit.remote(config, priority=priority)
+    except Exception as e:
+        safe_print(f"submit failed (is the app deployed?): {e}")
+        return False
+    if result.get("status") != "ok":
+        safe_print(result.get("message"))
+        return False
+    safe_print(f"queued {result['job']['id']} (priority {priority})")
+    return True
+
+
+def caption_dataset(dataset, model="wd14"):
+    """caption the images of a kohya-dataset folder that have no .txt yet."""
+    import modal
+
+    safe_print(f"captioning {dataset} with {model}...")
+    caption = modal.Function.from_name("kohya-ss-gui", "caption_dataset")
+    try:
+        result = caption.remote(dataset, model)
+    except Exception as e:
+        safe_print(f"captioning failed (is the app deployed?): {e}")
+        return False
+    if result.get("status") != "ok":
+        safe_print(result.get("message"))
+        return False
+    safe_print(f"{result['captioned']} captioned in {result['seconds']}s ({result['images_per_s']} img/s, "
+               f"gpu busy {result['gpu_busy_share']:.0%}), {len(result['errors'])} unreadable")
+    for path, error in list(result["errors"].items())[:20]:
+        safe_print(f"  {path}: {error}")
+    return True
+
+
+def show_jobs(job_id=None, cancel=False):
+    import modal
+
+    status = modal.Function.from_name("kohya-ss-gui", "training_queue_status")
+    try:
+        result = status.remote(job_id, cancel)
+    except Exception as e:
+        safe_print(f"could not fetch queue (is the app deployed?): {e}")
+        return False
+    if result.get("status") != "ok":
+        safe_print(result.get("message"))
+        return False
+    jobs = [result["job"]] if job_id else result["jobs"]
+    for job in jobs:
+        safe_print(f"{job['id']}  {job['status']:<9} p={job['priority']:<3} "
+                   f"attempts={job['attempts']}  {job['config']}")
+    if job_id:
+        for line in (jobs[0]["history"][-1:] or [{}])[0].get("tail", []):
+            safe_print("    " + line.rstrip())
+    return True
+
+
+def show_models(enforce=False):
+    """model registry of kohya-models, most recently used first."""
+    import modal
+
+    listing = modal.Function.from_name("kohya-ss-gui", "list_models")
+    try:
+        result = listing.remote(enforce)
+    except Exception as e:
+        safe_print(f"could not fetch models (is the app deployed?): {e}")
+        return False
+    for model in result["models"]:
+        used = time.strftime("%Y-%m-%d %H:%M", time.localtime(model.get("last_used", 0)))
+        pin = " pinned" if model.get("pinned") else ""
+        safe_print(f"{model['size'] / (1024 ** 3):7.2f}GB  {used}  {model['name']}{pin}")
+    limit = result.get("max_models") or "-"
+    safe_print(f"{len(result['models'])}/{limit} models, {result['total_bytes'] / (1024 ** 3):.2f}GB")
+    for name in result.get("adopted", []):
+        safe_print(f"adopted untracked: {name}")
+    for entry in result.get("evicted", []):
+        safe_print(f"evicted: {entry['name']}")
+    return True
+
+
+def telemetry_url():
+    """tunnel url the running gui container published, None if there is none."""
+    import modal
+
+    try:
+        info = modal.Dict.from_name("kohya-telemetry").get("gui")
+    except Exception as e:
+        safe_print(f"could not read kohya-telemetry (is the app deployed?): {e}")
+        return None
+    if not info:
+        safe_print("no gui container has published telemetry yet")
+        return None
+    return info["url"]
+
+
+def show_metrics(raw=False):
+    """summary of the gui container's telemetry, or the raw prometheus text."""
+    import urllib.request
+
+    url = telemetry_url()
+    if url is None:
+        return False
+    try:
+        with urllib.request.urlopen(f"{url}/{'metrics' if raw else 'summary'}", timeout=10) as resp:
+            body = resp.read().decode()
+    except Exception as e:
+        safe_print(f"telemetry unreachable at {url} (container gone?): {e}")
+        return False
+    if raw:
+        safe_print(body.rstrip())
+        return True
+    summary = json.loads(body)
+    train = summary.get("train") or {}
+    safe_print(f"telemetry: {url} ({summary.get('backend')}, {summary.get('samples', 0)} samples)")
+    safe_print(f"gpu util avg: {summary.get('gpu_util_avg')}%  cpu avg: {summary.get('cpu_percent_avg')}%")
+    if train.get("active"):
+        safe_print(f"training: step {train['step']}/{train['total']}  {train['it_per_s']} it/s  loss {train['loss']}")
+        safe_print(f"bound: {summary['bound']} (gpu idle {summary['input_stall_ratio']:.0%} of training time)")
     else:
-        safe_print("cleanup failed")
+        safe_print("training: idle")
+    return True
 
 
 def show_logs():
@@ -146,15 +553,35 @@ def print_help():
     safe_print("  dev        start development server")
     safe_print("  prod       deploy to production")
     safe_print("  build      build docker image only")
+    safe_print("  lock       pin repos + resolve wheels into image.lock [kohya_ref] [sd_scripts_ref]")
     safe_print("  health     check if service is running")
     safe_print("  logs       show service logs")
+    safe_print("  metrics    gpu/training telemetry of the running gui (--raw for prometheus)")
+    safe_print("  imports    show image import-time profile vs last build")
     safe_print("  volumes    list modal volumes")
-    safe_print("  cleanup    cleanup old files (default 7 days)")
+    safe_print("  cleanup    apply retention to kohya-outputs ([retention], --dry-run)")
+    safe_print("  upload     upload a model file to kohya-models (resumable)")
+    safe_print("  export     download kohya-outputs [dest] [--run R] [--glob G] [--latest N] [--streams N]")
+    safe_print("  train      queue a kohya toml from kohya-configs for headless training")
+    safe_print("  jobs       list training jobs, or one job / cancel <id>")
+    safe_print("  models     list the model registry (--enforce applies max_models)")
+    safe_print("  caption    caption a kohya-dataset folder on the gpu <dataset> [wd14|blip]")
+    safe_print("  profiles   resource profiles (gpu/cpu/memory/...) per function group")
+    safe_print("  warm       warm pool targets for now (--apply pushes them to the app)")
+    safe_print("  bench      local end-to-end benchmarks, history in bench_history.jsonl [suites] [--quick]")
     safe_print("  check      check requirements")
     safe_print("")
     safe_print("examples:")
     safe_print("  python deploy.py dev")
+    safe_print("  python deploy.py lock")
     safe_print("  python deploy.py cleanup 14")
+    safe_print("  python deploy.py cleanup --dry-run")
+    safe_print("  python deploy.py upload ./my_model.safetensors")
+    safe_print("  python deploy.py export ./sweep --run 'sweeps/lr-*' --latest 1")
+    safe_print("  python deploy.py train my_lora.toml 5")
+    safe_print("  python deploy.py jobs cancel 20250115-120000-abc123")
+    safe_print("  python deploy.py warm --apply")
+    safe_print("  python deploy.py bench --quick")
 
 
 if __name__ == "__main__":
@@ -169,6 +596,16 @@ if __name__ == "__main__":
         check_requirements()
         sys.exit(0)
 
+    # local benchmarks, no modal needed (except the build suite)
+    if command == "bench":
+        from bench import main as bench_main
+
+        bench_main(sys.argv[2:])
+        sys.exit(0)
+
+    if command == "profiles":
+        sys.exit(0 if check_config() and show_profiles() else 1)
+
     if command in ("help", "-h", "--help"):
         print_help()
         sys.exit(0)
@@ -181,24 +618,79 @@ if __name__ == "__main__":
     # run the actual command
     if command == "build":
         build_image()
+    elif command == "lock":
+        refs = sys.argv[2:4] + ["HEAD"] * (2 - len(sys.argv[2:4]))
+        if not refresh_lock(*refs):
+            sys.exit(1)
     elif command == "dev":
         start_dev()
     elif command == "prod":
         deploy_prod()
     elif command == "health":
-        check_health()
+        if not check_health():
+            sys.exit(1)
     elif command == "logs":
         show_logs()
+    elif command == "metrics":
+        if not show_metrics("--raw" in sys.argv[2:]):
+            sys.exit(1)
+    elif command == "imports":
+        check_import_profile()
     elif command == "volumes":
         list_volumes()
     elif command == "cleanup":
-        days = 7
-        if len(sys.argv) > 2:
+        args = sys.argv[2:]
+        dry_run = "--dry-run" in args
+        args = [a for a in args if a != "--dry-run"]
+        days = None
+        if args:
             try:
-                days = int(sys.argv[2])
+                days = int(args[0])
             except ValueError:
-                safe_print(f"invalid number of days: {sys.argv[2]}, using 7")
-        cleanup_files(days)
+                safe_print(f"invalid number of days: {args[0]}, using config")
+        cleanup_files(days, dry_run)
+    elif command == "upload":
+        args = [a for a in sys.argv[2:] if a != "--fresh"]
+        if not args:
+            safe_print("usage: python deploy.py upload <file> [name] [--fresh]")
+            sys.exit(1)
+        name = args[1] if len(args) > 1 else None
+        if not upload_model_file(args[0], name, fresh="--fresh" in sys.argv[2:]):
+            sys.exit(1)
+    elif command == "train":
+        if len(sys.argv) < 3:
+            safe_print("usage: python deploy.py train <config.toml> [priority]")
+            sys.exit(1)
+        priority = 0
+        if len(sys.argv) > 3:
+            try:
+                priority = int(sys.argv[3])
+            except ValueError:
+                safe_print(f"invalid priority: {sys.argv[3]}, using 0")
+        if not submit_training(sys.argv[2], priority):
+            sys.exit(1)
+    elif command == "models":
+        if not show_models("--enforce" in sys.argv[2:]):
+            sys.exit(1)
+    elif command == "export":
+        if not export_outputs(sys.argv[2:]):
+            sys.exit(1)
+    elif command == "caption":
+        if len(sys.argv) < 3:
+            safe_print("usage: python deploy.py caption <dataset> [wd14|blip]")
+            sys.exit(1)
+        if not caption_dataset(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "wd14"):
+            sys.exit(1)
+    elif command == "warm":
+        if not warm_pool("--apply" in sys.argv[2:]):
+            sys.exit(1)
+    elif command == "jobs":
+        if len(sys.argv) > 3 and sys.argv[2] == "cancel":
+            ok = show_jobs(sys.argv[3], cancel=True)
+        else:
+            ok = show_jobs(sys.argv[2] if len(sys.argv) > 2 else None)
+        if not ok:
+            sys.exit(1)
     else:
         safe_print(f"unknown command: {command}")
         safe_print("run 'python deploy.py help' for usage")
@@ -1,69 +1,63 @@
 #GPT
+import glob
+
 import modal
-from huggingface_hub import hf_hub_download, list_repo_files, snapshot_download
-from tqdm import tqdm
+
+from blobstore import BlobStore
+from dataset_sync import store_hooks, sync
+from settings import CONFIG_FILE, resources, sync_workers
 
 DATASET_PATH = "/kohya_ss/dataset"
 dataset_vol = modal.Volume.from_name("kohya-dataset", create_if_missing=True)
 
-app = modal.App(name="download-hf-dataset")
+image = (
+    modal.Image.debian_slim()
+    .pip_install("toml")
+    .add_local_file(CONFIG_FILE, "/root/config.toml")
+    .add_local_python_source("blobstore", "config_schema", "dataset_sync", "downloader", "settings", "warm_pool")
+)
+
+app = modal.App(name="download-hf-dataset", image=image)
 
 @app.function(
-    timeout=7200,
     secrets=[modal.Secret.from_name("huggingface-token")],
     volumes={DATASET_PATH: dataset_vol},
-    memory=4096,
-    cpu=2,
+    **resources("download"),
 )
 def download_dataset(
     repo_id: str,
     files=None,            # bisa string / list / None
-    auto_ext=None          # filter ekstensi, contoh: ["jpg","png","json"]
+    auto_ext=None,         # filter ekstensi, contoh: ["jpg","png","json"]
+    revision="main",
 ):
     """
-    Unduh dataset Hugging Face ke volume /kohya_ss/dataset
+    Sync dataset Hugging Face ke volume /kohya_ss/dataset (incremental)
     - repo_id   : nama repo huggingface, ex: myuser/mydataset
-    - files     : nama file (str) / list file / None untuk full snapshot
+    - files     : nama file (str) / list file / None untuk full repo
     - auto_ext  : filter ekstensi (list), ex: ["jpg","png"]
+    - revision  : branch / tag / commit, default main
+    cuma file yang baru/berubah sejak sync terakhir yang diunduh
     """
-
-    results = []
     try:
-        # === CASE 1: download full repo (snapshot) ===
-        if files is None and auto_ext is None:
-            local_dir = snapshot_download(
-                repo_id=repo_id,
-                repo_type="dataset",
-                local_dir=DATASET_PATH,
-                local_dir_use_symlinks=False
-            )
-            return {"status": "done", "mode": "snapshot", "path": local_dir}
-
-        # === CASE 2: filter by auto_ext or specific files ===
-        if files is None:
-            repo_files = list_repo_files(repo_id, repo_type="dataset")
-            if auto_ext is None:
-                auto_ext = ["jpg", "png", "json"]
-            files = [f for f in repo_files if f.split(".")[-1] in auto_ext]
-
-        elif isinstance(files, str):
+        if isinstance(files, str):
             files = [files]
+        if files is not None:
+            patterns = [glob.escape(f) for f in files]
+        elif auto_ext is not None:
+            patterns = [f"*.{ext.lstrip('.')}" for ext in auto_ext]
+        else:
+            patterns = ["*"]
 
-        # === download per file with progress ===
-        for fname in tqdm(files, desc=f"Downloading {repo_id}"):
-            try:
-                local_path = hf_hub_download(
-                    repo_id=repo_id,
-                    repo_type="dataset",
-                    filename=fname,
-                    local_dir=DATASET_PATH,
-                    local_dir_use_symlinks=False
-                )
-                results.append({"file": fname, "status": "ok", "path": local_path})
-            except Exception as e:
-                results.append({"file": fname, "status": "error", "message": str(e)})
-
-        return {"status": "done", "mode": "file-download", "results": results}
+        store = BlobStore(DATASET_PATH)
+        start_workers, max_workers = sync_workers()
+        report = sync(
+            repo_id, DATASET_PATH, revision, patterns,
+            start_workers=start_workers, max_workers=max_workers,
+            **store_hooks(store, f"hf:{repo_id}", commit=dataset_vol.commit),
+        )
+        store.save()
+        dataset_vol.commit()
+        return report
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -1,33 +1,44 @@
 #GPT
 
+import os
+import time
+
 import modal
-from huggingface_hub import hf_hub_download, list_repo_files
-from tqdm import tqdm
+from huggingface_hub import hf_hub_url
+from huggingface_hub.utils import build_hf_headers
+
+from blobstore import BlobStore, hf_remote_files, plan_sync, sha256_file
+from downloader import DownloadTask, download_files
+from model_registry import ModelRegistry
+from settings import CONFIG_FILE, model_limits, parallel_download_workers, resources
 
 # path dan volume
 MODELS_PATH = "/kohya_ss/models"
 models_vol = modal.Volume.from_name("kohya-models", create_if_missing=True)
 
-# bikin base image dengan huggingface_hub + tqdm
+# bikin base image dengan huggingface_hub + toml
 image = (
     modal.Image.debian_slim()
-    .pip_install("huggingface_hub>=0.23.0", "tqdm")
+    .pip_install("huggingface_hub>=0.23.0", "toml")
+    .add_local_file(CONFIG_FILE, "/root/config.toml")
+    .add_local_python_source("blobstore", "config_schema", "downloader", "model_registry", "settings", "warm_pool")
 )
 
+COMMIT_EVERY = 60  # seconds, commit partial chunks so resume survives restarts
+
 # definisi app
 app = modal.App(name="download-hf-model", image=image)
 
 @app.function(
-    timeout=3600,
     secrets=[modal.Secret.from_name("huggingface-secret")],
     volumes={MODELS_PATH: models_vol},
-    memory=4096,
-    cpu=2,
+    **resources("download"),
 )
 def download_model(
     repo_id: str,
     files=None,             # string atau list file
-    auto_ext=None           # filter ekstensi
+    auto_ext=None,          # filter ekstensi
+    workers=None            # override [optimization] parallel_downloads
 ):
     """
     Unduh model Hugging Face ke volume /kohya_ss/models
@@ -35,45 +46,108 @@ def download_model(
       repo_id (str): nama repo Hugging Face, contoh: stabilityai/stable-diffusion-xl-base-1.0
       files (str|list): nama file (bisa 1 string atau list of string)
       auto_ext (list): filter ekstensi otomatis, contoh ["safetensors","bin"]
+      workers (int): jumlah worker paralel, default dari config.toml
     """
     results = []
+    max_models, max_bytes, cache_models = model_limits()
 
     try:
+        if isinstance(files, str):
+            files = [files]
+
+        # udah ada di registry -> jawab tanpa nanya hub
+        registry = ModelRegistry(MODELS_PATH)
+        cached = None
+        if cache_models and (files is not None or auto_ext is None):
+            cached = registry.lookup(repo_id=repo_id, files=files)
+        if cached:
+            registry.touch(repo_id)
+            registry.save()
+            models_vol.commit()
+            return {
+                "status": "done",
+                "results": [{"file": os.path.relpath(p, MODELS_PATH), "status": "cached", "path": p} for p in cached],
+                "throughput": None,
+            }
+
+        # satu list call, sekalian dapet etag/sha256 buat dedup
+        remote = hf_remote_files(repo_id, repo_type="model")
+
         # ambil daftar file dari repo kalau files None
         if files is None:
-            repo_files = list_repo_files(repo_id, repo_type="model")
+            repo_files = list(remote)
             if auto_ext is None:
                 auto_ext = ["safetensors", "bin", "pt"]
             files = [f for f in repo_files if f.split(".")[-1] in auto_ext]
-
-        elif isinstance(files, str):
-            files = [files]
+            scope = "*" if auto_ext == ["safetensors", "bin", "pt"] else None
 
         elif isinstance(files, list):
-            pass
+            scope = None
         else:
             return {"error": "files harus string atau list"}
 
         if not files:
             return {"status": "error", "message": "Tidak ada file cocok di repo"}
 
+        if workers is None:
+            workers = parallel_download_workers()
+
         print(f"Mulai download dari repo: {repo_id}")
-        print(f"Total file: {len(files)}")
-
-        for fname in tqdm(files, desc="Downloading", unit="file"):
-            try:
-                local_path = hf_hub_download(
-                    repo_id=repo_id,
-                    repo_type="model",
-                    filename=fname,
-                    local_dir=MODELS_PATH,
-                    local_dir_use_symlinks=False
-                )
-                results.append({"file": fname, "status": "ok", "path": local_path})
-            except Exception as e:
-                results.append({"file": fname, "status": "error", "message": str(e)})
-
-        return {"status": "done", "results": results}
+        print(f"Total file: {len(files)}, workers: {workers}")
+
+        # skip yang udah ada di blob store, link kalau isinya sama
+        store = BlobStore(MODELS_PATH)
+        present, linked, missing = plan_sync(store, remote, MODELS_PATH, files)
+        store.save()
+        results = [{"file": f, "status": "cached", "path": f"{MODELS_PATH}/{f}"} for f in present]
+        results += [{"file": f, "status": "linked", "path": f"{MODELS_PATH}/{f}"} for f in linked]
+        print(f"cached: {len(present)}, linked: {len(linked)}, download: {len(missing)}")
+
+        headers = build_hf_headers()
+        tasks = [
+            DownloadTask(
+                url=hf_hub_url(repo_id, fname, repo_type="model"),
+                dest=f"{MODELS_PATH}/{fname}",
+                headers=headers,
+                name=fname,
+            )
+            for fname in missing
+        ]
+
+        last_commit = [time.monotonic()]
+
+        def checkpoint():
+            if time.monotonic() - last_commit[0] >= COMMIT_EVERY:
+                models_vol.commit()
+                last_commit[0] = time.monotonic()
+
+        fetched, throughput = download_files(
+            tasks, workers=workers, on_checkpoint=checkpoint
+        )
+        for item in fetched:
+            if item["status"] == "ok":
+                etag, sha, _ = remote.get(item["file"], (None, None, None))
+                digest = sha256_file(item["path"])
+                if sha and digest != sha:
+                    os.remove(item["path"])
+                    item.update(status="error", message=f"sha256 mismatch: {digest}")
+                    continue
+                store.ingest(item["path"], etag=etag, source=f"hf:{repo_id}", digest=digest)
+        store.save()
+        results += fetched
+
+        done = [r["file"] for r in results if r["status"] in ("cached", "linked", "ok")]
+        if done:
+            complete = scope if len(done) == len(files) else None
+            registry.register(repo_id, done, repo_id=repo_id, revision="main", source=f"hf:{repo_id}", scope=complete)
+            evicted = registry.enforce(max_models, max_bytes, keep={repo_id}, store=store)
+            store.save()
+            registry.save()
+            if evicted:
+                print(f"evicted: {[e['name'] for e in evicted]}")
+        models_vol.commit()
+
+        return {"status": "done", "results": results, "throughput": throughput}
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -0,0 +1,398 @@
+"""parallel, chunked, resumable http downloader
+
+big files are split into range chunks and every chunk of every file goes
+through one bounded worker pool, so several files download at once.
+progress per chunk is kept in `<dest>.incomplete.json` next to the partial
+file, so a restarted container continues where the last one stopped.
+
+only stdlib here, it is imported on the local side too. RangeServer is a
+local stand-in for the hub cdn (ranged or not, with dropped
+connections), used by bench.py and the tests.
+"""
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+CHUNK_SIZE = 64 * 1024 * 1024  # 64MB range per request
+BLOCK_SIZE = 1024 * 1024  # read size inside a chunk
+STATE_EVERY = 8 * 1024 * 1024  # flush chunk progress every 8MB
+REPORT_EVERY = 10  # seconds between throughput prints
+RETRIES = 5
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass
+class DownloadTask:
+    url: str
+    dest: str
+    headers: dict = field(default_factory=dict)
+    name: str = None
+
+    def __post_init__(self):
+        if self.name is None:
+            self.name = os.path.basename(self.dest)
+
+
+class _StripAuthOnRedirect(urllib.request.HTTPRedirectHandler):
+    # hf redirects to a cdn with signed urls, sending our token there breaks it
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new is not None:
+            old_host = urllib.parse.urlparse(req.full_url).netloc
+            if urllib.parse.urlparse(newurl).netloc != old_host:
+                new.remove_header("Authorization")
+        return new
+
+
+_opener = urllib.request.build_opener(_StripAuthOnRedirect)
+
+
+def _open(url, headers, method="GET", timeout=TIMEOUT):
+    req = urllib.request.Request(url, headers=headers, method=method)
+    return _opener.open(req, timeout=timeout)
+
+
+def probe(url: str, headers: dict = None, timeout=TIMEOUT):
+    """HEAD the url, returns (size, accepts_ranges, etag)."""
+    with _open(url, headers or {}, method="HEAD", timeout=timeout) as resp:
+        size = resp.headers.get("Content-Length")
+        ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        etag = resp.headers.get("ETag")
+    return (int(size) if size is not None else None), ranges, etag
+
+
+class Throughput:
+    """thread safe byte counter shared by all workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.start = time.monotonic()
+
+    def add(self, n):
+        with self.lock:
+            self.bytes += n
+
+    def elapsed(self):
+        return max(time.monotonic() - self.start, 1e-6)
+
+    def mb_per_s(self):
+        return self.bytes / self.elapsed() / (1024 * 1024)
+
+
+class _FileJob:
+    """one destination file split into chunks, with its resume state."""
+
+    def __init__(self, task, size, etag, ranges, chunk_size):
+        self.task = task
+        self.size = size
+        self.etag = etag
+        self.partial = task.dest + ".incomplete"
+        self.state_path = self.partial + ".json"
+        self.lock = threading.Lock()
+
+        if size is None or not ranges or size <= chunk_size:
+            self.chunk_size = size if size else 0
+            self.chunks = [(0, size)]
+        else:
+            self.chunk_size = chunk_size
+            self.chunks = [
+                (start, min(chunk_size, size - start))
+                for start in range(0, size, chunk_size)
+            ]
+        self.ranged = len(self.chunks) > 1
+        self.done = self._load_state()
+        self.remaining = sum(
+            1 for i in range(len(self.chunks)) if not self.chunk_complete(i)
+        )
+
+    def _load_state(self):
+        done = {}
+        if os.path.exists(self.state_path) and os.path.exists(self.partial):
+            try:
+                with open(self.state_path) as f:
+                    state = json.load(f)
+                same = (
+                    state.get("size") == self.size
+                    and state.get("etag") == self.etag
+                    and state.get("chunk_size") == self.chunk_size
+                )
+                if same:
+                    done = {int(k): v for k, v in state.get("done", {}).items()}
+            except (OSError, ValueError):
+                done = {}
+
+        os.makedirs(os.path.dirname(self.partial) or ".", exist_ok=True)
+        if not done:
+            # stale or missing state, start over
+            with open(self.partial, "wb") as f:
+                if self.size:
+                    f.truncate(self.size)
+        if not self.ranged:
+            # single stream can't resume mid-file without ranges
+            done = {}
+        return done
+
+    def chunk_complete(self, index):
+        length = self.chunks[index][1]
+        return length is not None and self.done.get(index, 0) >= length
+
+    def record(self, index, done_bytes):
+        with self.lock:
+            self.done[index] = done_bytes
+            state = {
+                "url": self.task.url,
+                "size": self.size,
+                "etag": self.etag,
+                "chunk_size": self.chunk_size,
+                "done": self.done,
+            }
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+
+    def finish_chunk(self):
+        with self.lock:
+            self.remaining -= 1
+            return self.remaining == 0
+
+    def finalize(self):
+        if self.size is not None:
+            actual = os.path.getsize(self.partial)
+            if actual != self.size:
+                raise DownloadError(
+                    f"{self.task.name}: size mismatch {actual} != {self.size}"
+                )
+        os.replace(self.partial, self.task.dest)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+def _fetch_chunk(job, index, meter, retries=RETRIES):
+    start, length = job.chunks[index]
+    attempt = 0
+    while True:
+        done = job.done.get(index, 0) if job.ranged else 0
+        headers = dict(job.task.headers)
+        if job.ranged:
+            headers["Range"] = f"bytes={start + done}-{start + length - 1}"
+        try:
+            with _open(job.task.url, headers) as resp:
+                if job.ranged and resp.status != 206:
+                    raise DownloadError(f"{job.task.name}: server ignored range")
+                flags = os.O_WRONLY | getattr(os, "O_BINARY", 0)
+                fd = os.open(job.partial, flags)
+                try:
+                    since_state = 0
+                    while True:
+                        block = resp.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        os.pwrite(fd, block, start + done)
+                        done += len(block)
+                        since_state += len(block)
+                        meter.add(len(block))
+                        if job.ranged and since_state >= STATE_EVERY:
+                            job.record(index, done)
+                            since_state = 0
+                finally:
+                    os.close(fd)
+            if length is not None and done < length:
+                raise DownloadError(f"{job.task.name}: short read on chunk {index}")
+            job.record(index, done)
+            return done
+        except (urllib.error.URLError, OSError, DownloadError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code in (401, 403, 404):
+                raise
+            attempt += 1
+            if not job.ranged and done:
+                # whole-file retry starts from byte 0 again, don't count this attempt twice
+                meter.add(-done)
+            if attempt > retries:
+                raise
+            if job.ranged and done:
+                job.record(index, done)
+            time.sleep(min(2 ** attempt, 30))
+
+
+def _reporter(meter, stop, total_bytes):
+    while not stop.wait(REPORT_EVERY):
+        pct = f" ({meter.bytes / total_bytes:.0%})" if total_bytes else ""
+        print(
+            f"downloaded {meter.bytes / (1024 ** 3):.2f}GB{pct} "
+            f"at {meter.mb_per_s():.1f} MB/s"
+        )
+
+
+def download_files(
+    tasks,
+    workers: int = 4,
+    chunk_size: int = CHUNK_SIZE,
+    on_file_done=None,
+    on_checkpoint=None,
+):
+    """download all tasks with one bounded pool of chunk workers.
+
+    on_file_done(task) runs after a file is in place, on_checkpoint() after
+    every finished chunk (use it to commit the volume so resume survives a
+    container restart). returns per-file results and aggregate throughput.
+    """
+    meter = Throughput()
+    results = {}
+    jobs = []
+    for task in tasks:
+        try:
+            size, ranges, etag = probe(task.url, task.headers)
+            jobs.append(_FileJob(task, size, etag, ranges, chunk_size))
+        except Exception as e:
+            results[task.dest] = {"file": task.name, "status": "error", "message": str(e)}
+
+    resumed = sum(sum(job.done.values()) for job in jobs)
+    total = sum(job.size or 0 for job in jobs)
+    if resumed:
+        print(f"resuming, {resumed / (1024 ** 2):.1f}MB already on disk")
+
+    stop = threading.Event()
+    report = threading.Thread(target=_reporter, args=(meter, stop, total - resumed), daemon=True)
+    report.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {}
+            for job in jobs:
+                if job.remaining == 0:
+                    # every chunk already on disk from an earlier run
+                    futures[pool.submit(lambda: None)] = (job, None)
+                for index in range(len(job.chunks)):
+                    if not job.chunk_complete(index):
+                        futures[pool.submit(_fetch_chunk, job, index, meter)] = (job, index)
+
+            failed = set()
+            for future in as_completed(futures):
+                job, index = futures[future]
+                name, key = job.task.name, job.task.dest
+                if key in failed:
+                    continue
+                try:
+                    future.result()
+                    last = job.remaining == 0 if index is None else job.finish_chunk()
+                    if on_checkpoint is not None:
+                        on_checkpoint()
+                    if last:
+                        job.finalize()
+                        results[key] = {"file": name, "status": "ok", "path": job.task.dest}
+                        if on_file_done is not None:
+                            on_file_done(job.task)
+                except Exception as e:
+                    failed.add(key)
+                    results[key] = {"file": name, "status": "error", "message": str(e)}
+    finally:
+        stop.set()
+        report.join()
+
+    summary = {
+        "files": len(tasks),
+        "bytes": meter.bytes,
+        "resumed_bytes": resumed,
+        "seconds": round(meter.elapsed(), 2),
+        "mb_per_s": round(meter.mb_per_s(), 2),
+    }
+    print(
+        f"done: {summary['bytes'] / (1024 ** 3):.2f}GB in {summary['seconds']}s "
+        f"({summary['mb_per_s']} MB/s, {workers} workers)"
+    )
+    ordered = [results[t.dest] for t in tasks if t.dest in results]
+    return ordered, summary
+
+
+class RangeServer:
+    """serves a directory over http with HEAD, ETag and Range, like the hub cdn.
+
+    ranges=False ignores Range (200 + whole file, no Accept-Ranges);
+    drops=n cuts the next n GET responses after drop_after bytes.
+    `requests` records (method, path, range header) of every call.
+    """
+
+    def __init__(self, root, ranges=True, drops=0, drop_after=64 * 1024):
+        from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+        self.ranges = ranges
+        self.drops = drops
+        self.drop_after = drop_after
+        self.requests = []
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=root, **kwargs)
+
+            def send_head(self):
+                path = self.translate_path(self.path)
+                with stand_in._lock:
+                    stand_in.requests.append((self.command, self.path, self.headers.get("Range")))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return None
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                ranged = stand_in.ranges and self.headers.get("Range", "").startswith("bytes=")
+                if ranged:
+                    first, _, last = self.headers["Range"][6:].partition("-")
+                    start, end = int(first), min(int(last) if last else size - 1, size - 1)
+                f = open(path, "rb")
+                f.seek(start)
+                self.send_response(206 if ranged else 200)
+                self.send_header("Content-Length", str(end - start + 1))
+                if stand_in.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{size}-{int(os.path.getmtime(path))}"')
+                if ranged:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                self.remaining = end - start + 1
+                return f
+
+            def copyfile(self, source, outputfile):
+                limit = None
+                with stand_in._lock:
+                    if stand_in.drops > 0 and self.remaining > stand_in.drop_after:
+                        stand_in.drops -= 1
+                        limit = stand_in.drop_after
+                sent = 0
+                while self.remaining > 0:
+                    block = source.read(min(BLOCK_SIZE, self.remaining, limit - sent if limit else BLOCK_SIZE))
+                    if not block:
+                        break
+                    outputfile.write(block)
+                    self.remaining -= len(block)
+                    sent += len(block)
+                    if limit is not None and sent >= limit:
+                        self.close_connection = True  # client sees a short body
+                        break
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
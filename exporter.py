@@ -0,0 +1,398 @@
+"""chunked, resumable export of kohya-outputs to the client
+
+select() picks files (runs, globs, latest N checkpoints per run), plan()
+lays them out as one uncompressed tar whose headers only depend on path,
+size and mtime. so the archive is deterministic and never written
+anywhere: any byte range can be produced straight from the volume
+files, and the archive is cut into fixed-size chunks that are generated,
+compressed (one zstd frame each, when zstandard is installed) and
+checksummed independently.
+
+that gives the client everything it needs: several streams pull disjoint
+chunk lists in parallel, each chunk is written at its offset in the
+local .tar, and `<tar>.export.json` (plan + finished chunks) lets a rerun
+fetch only what is missing. files changed on the volume after planning
+fail the affected chunk instead of producing a corrupt archive.
+"""
+import bisect
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+
+from retention import PROTECTED, checkpoint_unit, run_id
+
+CHUNK_SIZE = 16 * 1024 * 1024
+BLOCK = 512
+STATE_SUFFIX = ".export.json"
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ExportError(Exception):
+    pass
+
+
+def default_compression():
+    return "zstd" if zstandard is not None else "none"
+
+
+# ---------- selection + layout ----------
+
+def select(root, runs=None, patterns=None, latest=None):
+    """[[rel, size, mtime]] sorted by path.
+
+    runs: run dir names or globs (relative to root), patterns: globs on
+    the relative path, latest: keep only the newest N checkpoints (model
+    files / `*-state` dirs) per run, everything else is kept.
+    """
+    found = []
+    for top, dirs, names in os.walk(root):
+        dirs.sort()
+        rel_top = os.path.relpath(top, root)
+        if rel_top != "." and rel_top.split(os.sep)[0] in PROTECTED:
+            dirs[:] = []
+            continue
+        for name in sorted(names):
+            rel = os.path.normpath(os.path.join(rel_top, name))
+            if rel.split(os.sep)[0] in PROTECTED:
+                continue
+            if runs and not any(fnmatch.fnmatch(run_id(rel), r) or rel.startswith(r.rstrip("/") + os.sep)
+                                for r in runs):
+                continue
+            if patterns and not any(fnmatch.fnmatch(rel, p) for p in patterns):
+                continue
+            st = os.stat(os.path.join(top, name))
+            found.append([rel, st.st_size, int(st.st_mtime)])
+
+    if latest:
+        units = {}
+        for rel, _, mtime in found:
+            unit = checkpoint_unit(rel)
+            if unit is not None:
+                entry = units.setdefault(run_id(rel), {}).setdefault(unit, 0)
+                units[run_id(rel)][unit] = max(entry, mtime)
+        keep = set()
+        for run_units in units.values():
+            # mtime is whole seconds, ties (one save loop) go by step number, then name
+            ranked = sorted(run_units, key=lambda u: (run_units[u], _step(u), u), reverse=True)
+            keep.update(ranked[:latest])
+        found = [f for f in found if checkpoint_unit(f[0]) is None or checkpoint_unit(f[0]) in keep]
+    return found
+
+
+def _step(unit):
+    """last number in a checkpoint name (model-000020.safetensors, model-000020-state), -1 if none."""
+    numbers = re.findall(r"\d+", os.path.basename(unit))
+    return int(numbers[-1]) if numbers else -1
+
+
+def _header(rel, size, mtime):
+    info = tarfile.TarInfo(rel.replace(os.sep, "/"))
+    info.size, info.mtime, info.mode = size, mtime, 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info.tobuf(format=tarfile.GNU_FORMAT, encoding="utf-8", errors="surrogateescape")
+
+
+def _padding(size):
+    return -size % BLOCK
+
+
+def plan(files, chunk_size=CHUNK_SIZE):
+    """archive layout: total size, chunk count and an id covering every file's identity."""
+    total = 0
+    digest = hashlib.sha256()
+    for rel, size, mtime in files:
+        total += len(_header(rel, size, mtime)) + size + _padding(size)
+        digest.update(f"{rel}\0{size}\0{mtime}\n".encode())
+    total += 2 * BLOCK  # end of archive
+    return {
+        "id": digest.hexdigest()[:16],
+        "files": files,
+        "size": total,
+        "chunk_size": chunk_size,
+        "chunks": -(-total // chunk_size),
+        "created": time.time(),
+    }
+
+
+_layout_cache = {}
+
+
+def _layout(plan):
+    """archive offset of every file's header, built once per plan (tobuf is the slow part)."""
+    key = (plan["id"], plan["size"])
+    starts = _layout_cache.get(key)
+    if starts is None:
+        starts, offset = [], 0
+        for rel, size, mtime in plan["files"]:
+            starts.append(offset)
+            offset += len(_header(rel, size, mtime)) + size + _padding(size)
+        starts.append(offset)  # end of archive marker
+        _layout_cache.clear()  # one export at a time per container
+        _layout_cache[key] = starts
+    return starts
+
+
+def _segments(plan, starts, first=0):
+    """(offset, length, kind, payload) from file index first on: header bytes, a file, or zero padding."""
+    files = plan["files"]
+    for i in range(first, len(files)):
+        rel, size, mtime = files[i]
+        offset = starts[i]
+        header = _header(rel, size, mtime)
+        yield offset, len(header), "bytes", header
+        offset += len(header)
+        yield offset, size, "file", (rel, size, mtime)
+        offset += size
+        pad = _padding(size)
+        if pad:
+            yield offset, pad, "zero", None
+    yield starts[-1], 2 * BLOCK, "zero", None
+
+
+def read_range(root, plan, start, end):
+    """bytes [start, end) of the archive, read straight from root."""
+    starts = _layout(plan)
+    # last file whose header starts at or before start, segments before it are skipped
+    first = max(0, bisect.bisect_right(starts, start, 0, len(plan["files"])) - 1)
+    out = bytearray()
+    for offset, length, kind, payload in _segments(plan, starts, first):
+        if offset + length <= start:
+            continue
+        if offset >= end:
+            break
+        lo, hi = max(start, offset) - offset, min(end, offset + length) - offset
+        if kind == "bytes":
+            out += payload[lo:hi]
+        elif kind == "zero":
+            out += bytes(hi - lo)
+        else:
+            rel, size, mtime = payload
+            path = os.path.join(root, rel)
+            st = os.stat(path)
+            if st.st_size != size or int(st.st_mtime) != mtime:
+                raise ExportError(f"{rel} changed since the export was planned, start a fresh export")
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                data = os.pread(fd, hi - lo, lo)
+            finally:
+                os.close(fd)
+            if len(data) != hi - lo:
+                raise ExportError(f"{rel}: short read")
+            out += data
+    return bytes(out)
+
+
+# ---------- server side ----------
+
+def iter_chunks(root, plan, indices, compression="none", level=3):
+    """yield {"index", "data", "raw_size", "sha256", "compression"} per chunk index."""
+    if compression == "zstd" and zstandard is None:
+        compression = "none"
+    compressor = zstandard.ZstdCompressor(level=level) if compression == "zstd" else None
+    size, chunk = plan["size"], plan["chunk_size"]
+    for index in indices:
+        start = index * chunk
+        raw = read_range(root, plan, start, min(start + chunk, size))
+        yield {
+            "index": index,
+            "data": compressor.compress(raw) if compressor else raw,
+            "raw_size": len(raw),
+            "sha256": hashlib.sha256(raw).hexdigest(),
+            "compression": compression,
+        }
+
+
+def decode_chunk(item):
+    data = item["data"]
+    if item["compression"] == "zstd":
+        if zstandard is None:
+            raise ExportError("server sent zstd chunks, pip install zstandard")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    if len(data) != item["raw_size"] or hashlib.sha256(data).hexdigest() != item["sha256"]:
+        raise ExportError(f"chunk {item['index']} failed its checksum")
+    return data
+
+
+# ---------- client side ----------
+
+class ExportDownload:
+    """local .tar assembled chunk by chunk, resumable via <tar>.export.json."""
+
+    def __init__(self, path, plan=None, selection=None):
+        self.path = path
+        self.state_path = path + STATE_SUFFIX
+        self._lock = threading.Lock()
+        state = self._load()
+        if state and (plan is None or state["plan"]["id"] == plan["id"]) \
+                and (selection is None or state.get("selection") == selection):
+            self.plan, self.done = state["plan"], set(state["done"])
+        elif plan is None:
+            raise ExportError(f"no export state at {self.state_path}")
+        else:
+            self.plan, self.done = plan, set()
+        self.selection = selection if selection is not None else (state or {}).get("selection")
+        if not os.path.exists(path):
+            self.done = set()
+        with open(path, "ab") as f:
+            f.truncate(self.plan["size"])
+        self.save()
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def missing(self):
+        return [i for i in range(self.plan["chunks"]) if i not in self.done]
+
+    def save(self):
+        with self._lock:
+            state = {"plan": self.plan, "selection": self.selection, "done": sorted(self.done)}
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def write(self, item):
+        data = decode_chunk(item)
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, item["index"] * self.plan["chunk_size"])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self.done.add(item["index"])
+        return len(data), len(item["data"])
+
+    def complete(self):
+        return not self.missing()
+
+    def extract(self, dest):
+        """unpack into dest (paths can't escape it), drop state and tar."""
+        with tarfile.open(self.path, "r:") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(dest, filter="data")
+            else:
+                base = os.path.realpath(dest)
+                for member in tar.getmembers():
+                    target = os.path.realpath(os.path.join(dest, member.name))
+                    if not target.startswith(base + os.sep) or not member.isfile():
+                        raise ExportError(f"refusing to extract {member.name}")
+                tar.extractall(dest)
+        for path in (self.path, self.state_path):
+            os.remove(path)
+
+
+def fetch(download, fetch_chunks, streams=4, on_chunk=None, save_every=8):
+    """pull every missing chunk over `streams` parallel fetch_chunks(indices) iterators.
+
+    chunks are dealt round robin so each stream walks the archive front to
+    back. returns raw/wire byte counts; the first failing stream raises
+    after the others finished (what they got is kept for the next run).
+    """
+    missing = download.missing()
+    streams = max(1, min(streams, len(missing) or 1))
+    lists = [missing[i::streams] for i in range(streams)]
+    totals = {"raw": 0, "wire": 0, "chunks": 0}
+    errors = []
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def run(indices):
+        try:
+            for item in fetch_chunks(indices):
+                raw, wire = download.write(item)
+                with lock:
+                    totals["raw"] += raw
+                    totals["wire"] += wire
+                    totals["chunks"] += 1
+                    count = totals["chunks"]
+                if count % save_every == 0:
+                    download.save()
+                if on_chunk is not None:
+                    on_chunk(count, len(missing), dict(totals))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(indices,), daemon=True) for indices in lists if indices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    download.save()
+    seconds = max(time.monotonic() - start, 1e-6)
+    totals.update(seconds=round(seconds, 2), streams=streams,
+                  mb_per_s=round(totals["raw"] / seconds / (1024 ** 2), 2),
+                  ratio=round(totals["wire"] / totals["raw"], 3) if totals["raw"] else None)
+    if errors:
+        raise errors[0]
+    return totals
+
+
+def demo(files=200, streams=4, chunk_size=256 * 1024):
+    """fake outputs tree, export interrupted after a few chunks, resumed, extracted, compared."""
+    import filecmp
+    import random
+    import shutil
+    import tempfile
+
+    work = tempfile.mkdtemp(prefix="export-")
+    try:
+        root, out = os.path.join(work, "outputs"), os.path.join(work, "client")
+        rng = random.Random(0)
+        for i in range(files):
+            run = f"run_{i % 4}"
+            rel = f"model-{i:04d}.safetensors" if i % 10 == 0 else os.path.join("sample", f"{i:04d}.png")
+            path = os.path.join(root, run, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(rng.randbytes(rng.randint(1, 64 * 1024)) + b"\0" * rng.randint(0, 64 * 1024))
+        os.makedirs(os.path.join(root, ".resume"))
+        open(os.path.join(root, ".resume", "state.json"), "w").close()
+
+        selected = select(root)
+        layout = plan(selected, chunk_size)
+        tar_path = os.path.join(out, "export.tar")
+        os.makedirs(out)
+        compression = default_compression()
+
+        def flaky(indices, fail_after=None):
+            for n, item in enumerate(iter_chunks(root, layout, indices, compression)):
+                if fail_after is not None and n >= fail_after:
+                    raise ConnectionError("stream dropped")
+                yield item
+
+        download = ExportDownload(tar_path, layout)
+        try:
+            fetch(download, lambda idx: flaky(idx, fail_after=2), streams)
+        except ConnectionError:
+            pass
+        first = len(download.done)
+        resumed = ExportDownload(tar_path, layout)
+        report = fetch(resumed, flaky, streams)
+        resumed.extract(os.path.join(out, "outputs"))
+        same = all(filecmp.cmp(os.path.join(root, rel), os.path.join(out, "outputs", rel), shallow=False)
+                   for rel, _, _ in selected)
+        with_latest = select(root, latest=2)
+        return {"files": len(selected), "chunks": layout["chunks"], "archive_bytes": layout["size"],
+                "chunks_before_interrupt": first, "resumed": report, "identical": same,
+                "compression": compression,
+                "latest_2_checkpoints": sorted(r for r, _, _ in with_latest if r.endswith(".safetensors"))}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print(json.dumps(demo(), indent=2))
@@ -0,0 +1,171 @@
+"""kohya gui startup with a timing breakdown
+
+"inprocess" mode imports torch/gradio/kohya once in the modal process and
+runs kohya_gui.py in a thread, instead of spawning `accelerate launch`
+which re-imports the whole stack in a second interpreter. "subprocess" is
+the old behaviour, kept as a fallback.
+
+phases recorded: image_import (process start -> launcher), cuda_init,
+gui_import, port_bind.
+"""
+import json
+import os
+import runpy
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# modules kohya_gui.py pulls in, imported up front so the gui thread finds
+# them in sys.modules. missing ones are skipped, kohya moves things around.
+GUI_MODULES = [
+    "gradio",
+    "kohya_gui.common_gui",
+    "kohya_gui.class_gui_config",
+    "kohya_gui.dreambooth_gui",
+    "kohya_gui.finetune_gui",
+    "kohya_gui.lora_gui",
+    "kohya_gui.textual_inversion_gui",
+    "kohya_gui.utilities",
+]
+
+STARTUP_FILE = "/tmp/kohya_startup.json"
+
+_last_report = {}
+
+
+def process_age():
+    """seconds since this process started, from /proc (0 if unavailable)."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.last = self.start
+        self.phases = {"image_import": round(process_age(), 3)}
+
+    def mark(self, name):
+        now = time.monotonic()
+        self.phases[name] = round(now - self.last, 3)
+        self.last = now
+        print(f"[startup] {name}: {self.phases[name]:.2f}s")
+
+    def report(self):
+        return {
+            "phases": dict(self.phases),
+            "total": round(sum(self.phases.values()), 3),
+            "timestamp": time.time(),
+        }
+
+
+def last_report():
+    return dict(_last_report)
+
+
+def wait_for_port(port, timeout=300, host="127.0.0.1", alive=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if alive is not None and not alive():
+            raise RuntimeError("kohya gui exited before binding its port")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"port {port} not open after {timeout}s")
+
+
+def init_cuda():
+    import torch
+
+    info = {"torch": torch.__version__, "cuda": torch.cuda.is_available()}
+    if info["cuda"]:
+        torch.cuda.init()
+        info["gpu"] = torch.cuda.get_device_name(0)
+    print(f"pytorch version: {info['torch']}")
+    print(f"cuda available: {info['cuda']}")
+    if info["cuda"]:
+        print(f"gpu name: {info['gpu']}")
+    return info
+
+
+def preimport(kohya_base, modules=GUI_MODULES):
+    import importlib
+
+    # kohya_gui.py sits next to the kohya_gui/ package, never import the script
+    has_package = os.path.isdir(os.path.join(kohya_base, "kohya_gui"))
+    loaded = []
+    for name in modules:
+        if name.startswith("kohya_gui.") and not has_package:
+            continue
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"[startup] skip preimport {name}: {e}")
+    return loaded
+
+
+def _run_gui(script, argv):
+    sys.argv = [script] + argv
+    runpy.run_path(script, run_name="__main__")
+
+
+def launch(kohya_base, port, gui_args, mode="inprocess", timeout=300, history=None, init=init_cuda):
+    """start the gui and return once its port accepts connections.
+
+    history: optional jsonl path, one timing report appended per startup.
+    init: cuda setup, bench.py swaps it out to run without torch/gpu.
+    """
+    global _last_report
+    timer = StartupTimer()
+    info = init()
+    timer.mark("cuda_init")
+
+    script = os.path.join(kohya_base, "kohya_gui.py")
+    argv = ["--listen", "0.0.0.0", "--server_port", str(port)] + list(gui_args)
+
+    if mode == "inprocess":
+        os.chdir(kohya_base)
+        if kohya_base not in sys.path:
+            sys.path.insert(0, kohya_base)
+        preimport(kohya_base)
+        timer.mark("gui_import")
+        thread = threading.Thread(target=_run_gui, args=(script, argv), daemon=True, name="kohya-gui")
+        thread.start()
+        alive = thread.is_alive
+    else:
+        cmd = (
+            f"cd {kohya_base} && "
+            f"accelerate launch --num_cpu_threads_per_process=4 kohya_gui.py "
+            + " ".join(argv)
+        )
+        print(f"starting kohya with: {cmd}")
+        process = subprocess.Popen(cmd, shell=True)
+        timer.mark("gui_import")  # just the spawn, imports land in port_bind
+        alive = lambda: process.poll() is None
+
+    wait_for_port(port, timeout=timeout, alive=alive)
+    timer.mark("port_bind")
+
+    report = timer.report()
+    report.update(mode=mode, gpu=info.get("gpu"))
+    _last_report = report
+    print(f"[startup] total {report['total']:.2f}s ({mode})")
+    with open(STARTUP_FILE, "w") as f:
+        json.dump(report, f)
+    if history:
+        os.makedirs(os.path.dirname(history), exist_ok=True)
+        with open(history, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    return report
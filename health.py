@@ -0,0 +1,101 @@
+"""health / readiness of the gui container
+
+checks (gui port, gpu, training, queue depth, volume mounts, ...) run in
+a background thread every `interval` seconds; report() only returns the
+cached results, so /healthz answers in milliseconds even when a volume
+is slow. a check is a callable returning a dict, with an "ok" key when
+it can fail; it is timed, and an exception marks it failed instead of
+breaking the report.
+
+status: "starting" until every required check passed once, then "ok",
+or "degraded" when a required check fails or the results go stale.
+"""
+import os
+import socket
+import threading
+import time
+
+DEFAULT_INTERVAL = 5
+# results older than this many intervals mean the checker itself is stuck
+STALE_AFTER = 3
+
+
+def port_open(port, host="127.0.0.1", timeout=0.2):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def mount_status(paths):
+    """{path: {"mounted", "ok"}} for volume mount points."""
+    status = {}
+    for path in paths:
+        mounted = os.path.ismount(path)
+        status[path] = {"mounted": mounted, "ok": mounted or os.path.isdir(path)}
+    return {"ok": all(s["ok"] for s in status.values()), "paths": status}
+
+
+class Health:
+    def __init__(self, checks, required=(), interval=DEFAULT_INTERVAL):
+        self.checks = dict(checks)
+        self.required = set(required)
+        self.interval = interval
+        self.results = {}
+        self.updated = None
+        self.ready_since = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_checks(self):
+        results = {}
+        for name, check in self.checks.items():
+            start = time.monotonic()
+            try:
+                result = dict(check() or {})
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            result["check_ms"] = round((time.monotonic() - start) * 1000, 1)
+            results[name] = result
+        now = time.time()
+        ready = all(results[name].get("ok", True) for name in self.required if name in results)
+        with self._lock:
+            self.results = results
+            self.updated = now
+            if ready and self.ready_since is None:
+                self.ready_since = now
+        return results
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_checks()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name="health").start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def report(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            results, updated, ready_since = dict(self.results), self.updated, self.ready_since
+        failing = sorted(n for n in self.required if not results.get(n, {}).get("ok", False))
+        stale = updated is None or now - updated > self.interval * STALE_AFTER
+        if ready_since is None:
+            status = "starting"
+        elif failing or stale:
+            status = "degraded"
+        else:
+            status = "ok"
+        return {
+            "status": status,
+            "ready": status == "ok",
+            "failing": failing,
+            "age_s": None if updated is None else round(now - updated, 2),
+            "ready_since": ready_since,
+            "checks": results,
+        }
@@ -0,0 +1,152 @@
+"""locked, hashed dependency set for kohya_image
+
+`image.lock` (toml, next to app.py) is written by `python deploy.py lock`
+and pins:
+
+    [repos]   kohya_ss / sd_scripts commit shas
+    [wheels]  requirements: one `name==version --hash=sha256:...` per
+              resolved wheel, all of them stored in the kohya-wheelhouse
+              volume
+
+with a lock, the image installs from the wheelhouse with --no-index
+--require-hashes and clones at the pinned shas, so a rebuild never
+downloads or resolves anything. without one app.py builds the old way.
+"""
+import hashlib
+import os
+import re
+import subprocess
+import time
+from pathlib import Path
+
+LOCK_FILE = Path(__file__).parent / "image.lock"
+WHEEL_PATH = "/wheelhouse"
+KOHYA_REPO_URL = "https://github.com/bmaltais/kohya_ss.git"
+SD_SCRIPTS_URL = "https://github.com/kohya-ss/sd-scripts.git"
+TORCH_INDEX = "https://download.pytorch.org/whl/cu118"
+# what the image installs on top of kohya's requirements.txt
+PINNED = [
+    "torch==2.1.2+cu118", "torchvision==0.16.2+cu118", "torchaudio==2.1.2+cu118",
+    "xformers==0.0.23.post1+cu118", "bitsandbytes==0.41.1", "diffusers", "accelerate",
+]
+# same lines the unlocked build sed's out of kohya's requirements.txt
+SKIP_REQUIREMENTS = ("torch", "torchvision", "torchaudio", "xformers", "bitsandbytes", "sd-scripts")
+_WHEEL_RE = re.compile(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(-\d[^-]*)?-[^-]+-[^-]+-[^-]+\.whl$")
+
+
+def load_lock(path=LOCK_FILE):
+    """the lock as a dict, None when there is none (or it's unusable)."""
+    import toml
+
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        lock = toml.load(path)
+    except (OSError, ValueError) as e:
+        print(f"image lock {path} unreadable, building unlocked: {e}")
+        return None
+    repos = lock.get("repos", {})
+    if not (repos.get("kohya_ss") and repos.get("sd_scripts") and lock.get("wheels", {}).get("requirements")):
+        print(f"image lock {path} incomplete, building unlocked")
+        return None
+    return lock
+
+
+def write_lock(path, repos, requirements, python):
+    # by hand, toml.dump would put the requirement list on one line
+    lines = [
+        "# generated by `python deploy.py lock`, commit it with the code",
+        "",
+        "[repos]",
+        *(f'{name} = "{sha}"' for name, sha in sorted(repos.items())),
+        "",
+        "[wheels]",
+        f'python = "{python}"',
+        f'created = "{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}"',
+        "requirements = [",
+        *(f'    "{line}",' for line in requirements),
+        "]",
+        "",
+    ]
+    Path(path).write_text("\n".join(lines))
+
+
+def filter_requirements(text):
+    """kohya's requirements.txt minus what the image pins itself and local installs."""
+    keep = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if any(skip in stripped for skip in SKIP_REQUIREMENTS):
+            continue
+        if stripped.startswith(("-e", ".", "/", "-r", "-c")):
+            continue
+        keep.append(stripped)
+    return keep
+
+
+def wheel_name(filename):
+    """(name, version) from a wheel filename, None for anything else."""
+    match = _WHEEL_RE.match(filename)
+    if not match:
+        return None
+    return match["name"].replace("_", "-").lower(), match["version"]
+
+
+def sha256_file(path, chunk=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def requirement_lines(wheel_dir, files):
+    """pip --require-hashes lines for the given wheel files."""
+    lines = []
+    for filename in sorted(files, key=str.lower):
+        parsed = wheel_name(filename)
+        if parsed is None:
+            raise ValueError(f"not a wheel: {filename}")
+        name, version = parsed
+        lines.append(f"{name}=={version} --hash=sha256:{sha256_file(os.path.join(wheel_dir, filename))}")
+    return lines
+
+
+def install_locked(requirements, wheel_dir=WHEEL_PATH, fallback_index=None):
+    """image build step: pip install the locked set from the wheelhouse.
+
+    --no-index first; if a wheel went missing from the volume, fall back
+    to the index, still hash checked, so the result is the same set.
+    """
+    lock_path = "/tmp/requirements.lock"
+    with open(lock_path, "w") as f:
+        f.write("\n".join(requirements) + "\n")
+    base = ["pip", "install", "--require-hashes", "--no-deps", "-r", lock_path]
+    start = time.monotonic()
+    if subprocess.run(base + ["--no-index", "--find-links", wheel_dir]).returncode != 0:
+        print("wheelhouse incomplete, fetching the missing wheels (hash checked)")
+        extra = ["--extra-index-url", fallback_index] if fallback_index else []
+        subprocess.run(base + ["--find-links", wheel_dir] + extra, check=True)
+    print(f"installed {len(requirements)} locked wheels in {time.monotonic() - start:.1f}s")
+
+
+def clone_commands(url, sha, dest):
+    """shallow clone of exactly one commit."""
+    return [
+        f"git init -q {dest}",
+        f"git -C {dest} fetch -q --depth 1 {url} {sha}",
+        f"git -C {dest} checkout -q FETCH_HEAD",
+    ]
+
+
+def remote_sha(url, ref="HEAD"):
+    """resolve a branch/tag/HEAD to a commit sha without cloning."""
+    if re.fullmatch(r"[0-9a-f]{40}", ref):
+        return ref
+    out = subprocess.run(["git", "ls-remote", url, ref], capture_output=True, text=True, check=True).stdout
+    if not out.strip():
+        raise ValueError(f"{ref} not found in {url}")
+    return out.split()[0]
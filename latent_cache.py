@@ -0,0 +1,478 @@
+"""latent / text-encoder output cache for a dataset folder
+
+caches live outside the dataset, one dir per dataset and key:
+
+    <cache_root>/<dataset>/latents/<key>/<relpath stem>.npz      (vae latents)
+    <cache_root>/<dataset>/te/<key>/<relpath stem>_te_outputs.npz (sdxl te)
+    <cache_root>/<dataset>/<kind>/<key>/manifest.json
+
+the latent key is model fingerprint + resolution + bucket settings + vae
+dtype, the te key is model fingerprint + token length. every entry remembers the image
+(size, mtime, content hash) and caption hash it was built from, so a rerun
+only encodes what changed. an image whose mtime moved (staged, expanded
+from shards, copied without timestamps) is hashed and still matches. `install()` copies valid cache files next to the images with
+the names sd-scripts looks for (`<stem>.npz`, `<stem>_te_outputs.npz`),
+so a training run with cache_latents_to_disk picks them up instead of
+encoding again.
+
+key/plan logic is stdlib only; encoders are pluggable, anything with
+`encode(batch) -> list of {name: array}` works (see VaeEncoder, and
+DummyEncoder for cpu tests without torch or PIL).
+
+the vae runs in float32 by default: the stock sdxl vae overflows in fp16
+and would write NaN latents that every later run reuses. use float16 only
+with an fp16-fix vae; non-finite latents are refused either way.
+"""
+import hashlib
+import json
+import os
+import time
+
+from bucket_manager import target_reso
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+CAPTION_EXTS = (".txt", ".caption")
+FINGERPRINT_BYTES = 1024 * 1024
+HASH_BLOCK = 4 * 1024 * 1024
+
+
+def model_fingerprint(model_path, store=None):
+    """cheap stable id for a model file.
+
+    uses the blob store digest when the file went through it, otherwise
+    size + sha256 of the first and last MB (a full hash of a 6GB file on
+    a network volume costs more than the cache saves).
+    """
+    if store is not None:
+        digest = store.index["paths"].get(store._rel(model_path))
+        if digest:
+            return digest[:16]
+    h = hashlib.sha256()
+    if os.path.isdir(model_path):
+        # diffusers folder: fingerprint every weight file
+        for root, _, files in sorted(os.walk(model_path)):
+            for name in sorted(files):
+                if name.endswith((".safetensors", ".bin")):
+                    h.update(model_fingerprint(os.path.join(root, name)).encode())
+        return h.hexdigest()[:16]
+    size = os.path.getsize(model_path)
+    h.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        h.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def _key(params):
+    blob = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def latent_params(model_fp, resolution, enable_bucket=True, min_bucket_reso=256,
+                  max_bucket_reso=1024, bucket_reso_steps=64, bucket_no_upscale=False,
+                  flip_aug=False, vae_dtype="float32"):
+    if isinstance(resolution, int):
+        resolution = (resolution, resolution)
+    return {
+        "kind": "latents",
+        "model": model_fp,
+        "resolution": list(resolution),
+        "enable_bucket": bool(enable_bucket),
+        "min_bucket_reso": min_bucket_reso,
+        "max_bucket_reso": max_bucket_reso,
+        "bucket_reso_steps": bucket_reso_steps,
+        "bucket_no_upscale": bool(bucket_no_upscale),
+        "flip_aug": bool(flip_aug),
+        "vae_dtype": vae_dtype,
+    }
+
+
+def te_params(model_fp, max_token_length=None):
+    return {"kind": "te", "model": model_fp, "max_token_length": max_token_length}
+
+
+def cache_key(params):
+    return _key(params)
+
+
+# ---------- dataset scan / plan ----------
+
+def caption_for(image_path):
+    stem = os.path.splitext(image_path)[0]
+    for ext in CAPTION_EXTS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def _caption_hash(path):
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _image_hash(info):
+    """content hash of a scanned image, read once and kept in the scan entry."""
+    if info.get("sha") is None:
+        h = hashlib.sha256()
+        with open(info["path"], "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                h.update(block)
+        info["sha"] = h.hexdigest()[:16]
+    return info["sha"]
+
+
+def scan_dataset(dataset_dir):
+    """{relpath: {"size", "mtime", "caption", "path"}} for every image in the folder.
+
+    the image content hash is only computed when something needs it.
+    """
+    entries = {}
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if not name.lower().endswith(IMAGE_EXTS):
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            entries[os.path.relpath(path, dataset_dir)] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "caption": _caption_hash(caption_for(path)),
+                "path": path,
+            }
+    return entries
+
+
+class CacheDir:
+    def __init__(self, cache_root, dataset, params):
+        self.params = params
+        self.kind = params["kind"]
+        self.key = cache_key(params)
+        self.dir = os.path.join(cache_root, dataset, self.kind, self.key)
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        self.manifest = self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("params") == self.params:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {"key": self.key, "params": self.params, "entries": {}}
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        self.manifest["updated"] = time.time()
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def cache_file(self, relpath):
+        stem = os.path.splitext(relpath)[0]
+        suffix = "_te_outputs.npz" if self.kind == "te" else ".npz"
+        return os.path.join(self.dir, stem + suffix)
+
+    def _source(self, info):
+        # latents only care about the pixels, te outputs only about the caption
+        if self.kind == "te":
+            return {"caption": info["caption"]}
+        return {"size": info["size"], "mtime": info["mtime"], "sha": _image_hash(info)}
+
+    def _matches(self, source, info):
+        if self.kind == "te":
+            return source == {"caption": info["caption"]}
+        if source.get("size") != info["size"]:
+            return False
+        if source.get("mtime") == info["mtime"]:
+            return True  # untouched since it was encoded, no need to read it
+        # copied without timestamps: same bytes is still a hit
+        return source.get("sha") is not None and source["sha"] == _image_hash(info)
+
+    def plan(self, scanned):
+        """(todo, removed): entries to (re)encode and entries whose image is gone."""
+        entries = self.manifest["entries"]
+        todo = []
+        for rel, info in sorted(scanned.items()):
+            if self.kind == "te" and info["caption"] is None:
+                continue
+            old = entries.get(rel)
+            if old is None or not self._matches(old["source"], info):
+                todo.append(rel)
+            elif not os.path.exists(self.cache_file(rel)):
+                todo.append(rel)
+        removed = [rel for rel in entries if rel not in scanned]
+        return todo, removed
+
+    def record(self, rel, info, extra=None):
+        entry = {"source": self._source(info)}
+        if extra:
+            entry.update(extra)
+        self.manifest["entries"][rel] = entry
+
+    def drop(self, rel):
+        self.manifest["entries"].pop(rel, None)
+        path = self.cache_file(rel)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def precompute(dataset_dir, cache, encoder, batch_size=8, on_batch=None):
+    """encode everything the cache is missing. returns a small report."""
+    start = time.monotonic()
+    scanned = scan_dataset(dataset_dir)
+    todo, removed = cache.plan(scanned)
+    for rel in removed:
+        cache.drop(rel)
+    print(f"[{cache.kind}:{cache.key}] {len(scanned)} images, {len(todo)} to encode, {len(removed)} removed")
+
+    done = 0
+    for i in range(0, len(todo), batch_size):
+        batch = todo[i:i + batch_size]
+        items = [
+            {"rel": rel, "path": os.path.join(dataset_dir, rel), "caption": caption_for(os.path.join(dataset_dir, rel))}
+            for rel in batch
+        ]
+        outputs = encoder.encode(items, cache.params)
+        for item, out in zip(items, outputs):
+            path = cache.cache_file(item["rel"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_npz(path, out)
+            extra = {"reso": list(out["reso"])} if "reso" in out else None
+            cache.record(item["rel"], scanned[item["rel"]], extra)
+        done += len(batch)
+        cache.save()
+        if on_batch is not None:
+            on_batch(done, len(todo))
+
+    cache.save()
+    seconds = time.monotonic() - start
+    return {
+        "kind": cache.kind,
+        "key": cache.key,
+        "images": len(scanned),
+        "encoded": done,
+        "removed": len(removed),
+        "seconds": round(seconds, 2),
+        "images_per_s": round(done / seconds, 2) if seconds and done else 0.0,
+    }
+
+
+def _write_npz(path, arrays):
+    import numpy as np
+
+    arrays = {k: v for k, v in arrays.items() if k != "reso"}
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+# ---------- pick up at training time ----------
+
+def find_caches(cache_root, dataset, kind, dataset_dir, scanned=None):
+    """caches covering at least part of this dataset, newest first."""
+    scanned = scan_dataset(dataset_dir) if scanned is None else scanned
+    found = []
+    base = os.path.join(cache_root, dataset, kind)
+    if not os.path.isdir(base):
+        return found
+    for key in os.listdir(base):
+        manifest_path = os.path.join(base, key, "manifest.json")
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        cache = CacheDir(cache_root, dataset, manifest["params"])
+        todo, _ = cache.plan(scanned)
+        covered = len(scanned) - len(todo)
+        if covered:
+            found.append((manifest.get("updated", 0), covered, cache))
+    found.sort(key=lambda t: (-t[0], -t[1]))
+    return [cache for _, _, cache in found]
+
+
+def install(cache, dataset_dir, scanned=None):
+    """copy valid cache files next to the images. returns how many.
+
+    copies, not hardlinks: sd-scripts rewrites a mismatching npz in place,
+    which would corrupt the cached blob through a shared inode.
+    """
+    import shutil
+
+    scanned = scan_dataset(dataset_dir) if scanned is None else scanned
+    todo, _ = cache.plan(scanned)
+    stale = set(todo)
+    count = 0
+    for rel in scanned:
+        if rel in stale or rel not in cache.manifest["entries"]:
+            continue
+        src = cache.cache_file(rel)
+        dest = os.path.join(dataset_dir, os.path.relpath(src, cache.dir))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(src, dest)
+        count += 1
+    return count
+
+
+def install_latest(cache_root, dataset, dataset_dir):
+    """link the newest valid latent and te cache for a dataset, if any."""
+    installed = {}
+    # one scan for both kinds, so a moved image is hashed once
+    scanned = scan_dataset(dataset_dir)
+    for kind in ("latents", "te"):
+        caches = find_caches(cache_root, dataset, kind, dataset_dir, scanned)
+        if caches:
+            installed[kind] = {"key": caches[0].key, "files": install(caches[0], dataset_dir, scanned)}
+    return installed
+
+
+# ---------- real encoders (gpu container only) ----------
+
+class VaeEncoder:
+    """sd/sdxl vae, writes the npz layout sd-scripts expects for latents."""
+
+    def __init__(self, model_path, device="cuda", dtype="float32"):
+        import torch
+        from diffusers import AutoencoderKL
+
+        self.torch = torch
+        self.device = device
+        self.dtype = getattr(torch, dtype)
+        if os.path.isdir(model_path):
+            vae = AutoencoderKL.from_pretrained(model_path, subfolder="vae")
+        else:
+            vae = AutoencoderKL.from_single_file(model_path)
+        self.vae = vae.to(device, dtype=self.dtype).eval()
+
+    def _load(self, path, params):
+        import numpy as np
+        from PIL import Image
+
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            width, height = img.size
+            reso = target_reso(width, height, params)
+            # resize so the image covers the bucket, then center crop like kohya
+            scale = max(reso[0] / width, reso[1] / height)
+            resized = (int(width * scale + 0.5), int(height * scale + 0.5))
+            img = img.resize(resized, Image.LANCZOS)
+            left = (resized[0] - reso[0]) // 2
+            top = (resized[1] - reso[1]) // 2
+            img = img.crop((left, top, left + reso[0], top + reso[1]))
+            arr = np.asarray(img, dtype=np.float32) / 127.5 - 1.0
+        crop_ltrb = (left, top, left + reso[0], top + reso[1])
+        return arr, reso, (width, height), crop_ltrb
+
+    def encode(self, items, params):
+        import numpy as np
+
+        torch = self.torch
+        loaded = [self._load(item["path"], params) for item in items]
+        outputs = [None] * len(items)
+        # one forward per bucket size in the batch
+        by_reso = {}
+        for i, (_, reso, _, _) in enumerate(loaded):
+            by_reso.setdefault(reso, []).append(i)
+        with torch.no_grad():
+            for reso, idx in by_reso.items():
+                pixels = np.stack([loaded[i][0] for i in idx]).transpose(0, 3, 1, 2)
+                batch = torch.from_numpy(pixels).to(self.device, dtype=self.dtype)
+                latents = self.vae.encode(batch).latent_dist.sample().float().cpu().numpy()
+                flipped = None
+                if params.get("flip_aug"):
+                    flipped = self.vae.encode(torch.flip(batch, dims=[3])).latent_dist.sample().float().cpu().numpy()
+                # nan di cache kepake terus tiap run, mending gagal di sini
+                if not np.isfinite(latents).all() or (flipped is not None and not np.isfinite(flipped).all()):
+                    raise ValueError(f"vae produced non-finite latents in {self.dtype}, use float32 or an fp16-fix vae")
+                for j, i in enumerate(idx):
+                    out = {
+                        "latents": latents[j],
+                        "original_size": np.array(loaded[i][2]),
+                        "crop_ltrb": np.array(loaded[i][3]),
+                        "reso": reso,
+                    }
+                    if flipped is not None:
+                        out["latents_flipped"] = flipped[j]
+                    outputs[i] = out
+        return outputs
+
+
+class DummyEncoder:
+    """cpu stand-in for VaeEncoder / SdxlTextEncoder: arrays derived from the file bytes.
+
+    no torch or PIL; every image gets the params' resolution as its bucket.
+    `calls` lists the relpaths encoded, so tests can see what was redone.
+    """
+
+    def __init__(self, channels=4):
+        self.channels = channels
+        self.calls = []
+
+    def encode(self, items, params):
+        import numpy as np
+
+        outputs = []
+        for item in items:
+            self.calls.append(item["rel"])
+            path = item["caption"] if params["kind"] == "te" else item["path"]
+            with open(path, "rb") as f:
+                seed = int.from_bytes(hashlib.sha256(f.read()).digest()[:4], "little")
+            rng = np.random.default_rng(seed)
+            if params["kind"] == "te":
+                outputs.append({"hidden_state1": rng.standard_normal((77, 8), dtype=np.float32)})
+                continue
+            width, height = params["resolution"]
+            outputs.append({
+                "latents": rng.standard_normal((self.channels, height // 8, width // 8), dtype=np.float32),
+                "reso": (width, height),
+            })
+        return outputs
+
+
+class SdxlTextEncoder:
+    """both sdxl text encoders, layout of sd-scripts' *_te_outputs.npz."""
+
+    def __init__(self, model_path, device="cuda", dtype="float16"):
+        import torch
+        from transformers import (
+            CLIPTextModel,
+            CLIPTextModelWithProjection,
+            CLIPTokenizer,
+        )
+
+        if not os.path.isdir(model_path):
+            raise ValueError("te caching needs a diffusers-format sdxl folder")
+        self.torch = torch
+        self.device = device
+        dtype = getattr(torch, dtype)
+        self.tok1 = CLIPTokenizer.from_pretrained(model_path, subfolder="tokenizer")
+        self.tok2 = CLIPTokenizer.from_pretrained(model_path, subfolder="tokenizer_2")
+        self.te1 = CLIPTextModel.from_pretrained(model_path, subfolder="text_encoder").to(device, dtype=dtype).eval()
+        self.te2 = CLIPTextModelWithProjection.from_pretrained(model_path, subfolder="text_encoder_2").to(device, dtype=dtype).eval()
+
+    def encode(self, items, params):
+        torch = self.torch
+        captions = []
+        for item in items:
+            with open(item["caption"], encoding="utf-8") as f:
+                captions.append(f.read().strip())
+        kwargs = {"padding": "max_length", "truncation": True, "max_length": 77, "return_tensors": "pt"}
+        ids1 = self.tok1(captions, **kwargs).input_ids.to(self.device)
+        ids2 = self.tok2(captions, **kwargs).input_ids.to(self.device)
+        with torch.no_grad():
+            out1 = self.te1(ids1, output_hidden_states=True)
+            out2 = self.te2(ids2, output_hidden_states=True)
+        hidden1 = out1.hidden_states[11].float().cpu().numpy()
+        hidden2 = out2.hidden_states[-2].float().cpu().numpy()
+        pool2 = out2.text_embeds.float().cpu().numpy()
+        return [
+            {"hidden_state1": hidden1[i], "hidden_state2": hidden2[i], "pool2": pool2[i]}
+            for i in range(len(items))
+        ]
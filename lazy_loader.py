@@ -0,0 +1,356 @@
+"""tensor level lazy loading of safetensors from the models volume
+
+a single file sdxl/flux checkpoint bundles unet, text encoders and vae,
+but a run often needs only part of it first. LazyLoader reads the header,
+then fetches just the selected tensors with parallel pread()s straight
+into their buffers: tensors that sit next to each other in the file are
+read as one span, big spans are split into RANGE_BYTES pieces so several
+requests are in flight on the network volume. prefetch() reads the rest
+in a background thread while the caller is already working.
+
+warm() is the same read pattern with the data thrown away, to get a file
+into the page cache for another process (the sd-scripts trainer).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import safetensors_io as sio
+
+RANGE_BYTES = 16 * 1024 * 1024
+# holes up to this size are read through instead of starting a new span
+MERGE_GAP = 1024 * 1024
+DEFAULT_WORKERS = 8
+
+# key prefixes per component, sd/sdxl single file and flux bundles
+COMPONENTS = {
+    "unet": ("model.diffusion_model.", "double_blocks.", "single_blocks.", "img_in.", "txt_in.",
+             "time_in.", "vector_in.", "guidance_in.", "final_layer.", "model."),
+    "text_encoder": ("conditioner.", "cond_stage_model.", "text_encoders.", "te."),
+    "vae": ("first_stage_model.", "vae."),
+}
+
+
+def component(name):
+    """which component a key belongs to, "other" if none match."""
+    for comp, prefixes in COMPONENTS.items():
+        if comp != "unet" and name.startswith(prefixes):
+            return comp
+    # unet last, flux's "model." would swallow the others
+    return "unet" if name.startswith(COMPONENTS["unet"]) else "other"
+
+
+def select(names, include=None, exclude=None):
+    """keys matching include (component names or key prefixes), minus exclude."""
+    def prefixes(spec):
+        if isinstance(spec, str):
+            spec = [s.strip() for s in spec.split(",") if s.strip()]
+        return list(spec or [])
+
+    def match(name, spec):
+        return any(component(name) == p or name.startswith(p) for p in spec)
+
+    include, exclude = prefixes(include), prefixes(exclude)
+    return [n for n in names if (not include or match(n, include)) and not match(n, exclude)]
+
+
+def plan_spans(header, names, gap=MERGE_GAP):
+    """[(begin, end, [names])] in file order, relative to the data offset."""
+    ordered = sorted(names, key=lambda n: header[n]["data_offsets"][0])
+    spans = []
+    for name in ordered:
+        begin, end = header[name]["data_offsets"]
+        if spans and begin - spans[-1][1] <= gap:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2].append(name)
+        else:
+            spans.append([begin, end, [name]])
+    return [tuple(s) for s in spans]
+
+
+def _pieces(begin, end, size=RANGE_BYTES):
+    return [(start, min(end, start + size)) for start in range(begin, end, size)]
+
+
+def drop_cache(path):
+    """evict a file's clean pages, so a benchmark starts cold."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+class LazyLoader:
+    def __init__(self, path, workers=DEFAULT_WORKERS):
+        self.path = path
+        self.header, self.offset = sio.read_header(path)
+        self.metadata = self.header.pop("__metadata__", {}) or {}
+        self.workers = max(1, workers)
+        self._fd = os.open(path, os.O_RDONLY)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self._loaded = {}
+        self._prefetch = None
+        self.stats = {"bytes_read": 0, "reads": 0, "prefetched": 0}
+
+    def keys(self):
+        return list(self.header)
+
+    def info(self, name):
+        return self.header[name]
+
+    def nbytes(self, names=None):
+        names = self.header if names is None else names
+        return sum(self.header[n]["data_offsets"][1] - self.header[n]["data_offsets"][0] for n in names)
+
+    def _read_into(self, buf, start):
+        # pread straight into the span buffer, no intermediate bytes object
+        view = memoryview(buf)
+        done = 0
+        while done < len(view):
+            n = os.preadv(self._fd, [view[done:]], self.offset + start + done)
+            if n == 0:
+                raise EOFError(f"{self.path}: short read at {start + done}")
+            done += n
+        with self._lock:
+            self.stats["bytes_read"] += done
+            self.stats["reads"] += 1
+
+    def _fetch(self, names):
+        """read names into memory, returns {name: memoryview}."""
+        out = {}
+        futures = []
+        for begin, end, members in plan_spans(self.header, names):
+            buf = bytearray(end - begin)
+            view = memoryview(buf)
+            for start, stop in _pieces(begin, end):
+                futures.append(self._pool.submit(self._read_into, view[start - begin:stop - begin], start))
+            for name in members:
+                tb, te = self.header[name]["data_offsets"]
+                out[name] = view[tb - begin:te - begin]
+        for future in futures:
+            future.result()
+        return out
+
+    def load(self, names=None, include=None, exclude=None):
+        """{name: memoryview} of the selected tensors, read in parallel.
+
+        tensors a running prefetch already has are not read again.
+        """
+        if names is None:
+            names = select(self.header, include, exclude)
+        with self._lock:
+            have = {n: self._loaded[n] for n in names if n in self._loaded}
+        missing = [n for n in names if n not in have]
+        fetched = self._fetch(missing) if missing else {}
+        with self._lock:
+            self._loaded.update(fetched)
+        return {**have, **fetched}
+
+    def array(self, name, data=None):
+        """numpy view of a loaded tensor (bf16 as uint16, like safetensors_io)."""
+        import numpy as np
+
+        info = self.header[name]
+        data = self.load([name])[name] if data is None else data
+        return np.frombuffer(data, dtype=sio._np_dtype(info["dtype"])).reshape(info["shape"])
+
+    def prefetch(self, names=None, exclude_loaded=True):
+        """read (the rest of) the file in a background thread, span by span."""
+        if names is None:
+            names = list(self.header)
+        with self._lock:
+            if exclude_loaded:
+                names = [n for n in names if n not in self._loaded]
+
+        def run():
+            for begin, end, members in plan_spans(self.header, names):
+                with self._lock:
+                    members = [n for n in members if n not in self._loaded]
+                if not members:
+                    continue
+                fetched = self._fetch(members)
+                with self._lock:
+                    self._loaded.update(fetched)
+                    self.stats["prefetched"] += len(fetched)
+
+        self._prefetch = threading.Thread(target=run, daemon=True)
+        self._prefetch.start()
+        return self._prefetch
+
+    def wait(self, timeout=None):
+        if self._prefetch is not None:
+            self._prefetch.join(timeout)
+        return self._prefetch is None or not self._prefetch.is_alive()
+
+    def close(self):
+        self.wait()
+        self._pool.shutdown(wait=True)
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def warm(path, include=None, workers=DEFAULT_WORKERS):
+    """read a file into the page cache, selected components first.
+
+    the data is discarded; whoever opens the file next (the trainer)
+    reads from memory instead of the volume. returns (bytes, seconds).
+    """
+    start = time.monotonic()
+    header, offset = sio.read_header(path)
+    header.pop("__metadata__", None)
+    first = select(header, include) if include else []
+    first_set = set(first)
+    rest = [n for n in header if n not in first_set]
+    scratch = threading.local()
+    fd = os.open(path, os.O_RDONLY)
+
+    def read(piece):
+        begin, end = piece
+        buf = getattr(scratch, "buf", None)
+        if buf is None:
+            buf = scratch.buf = bytearray(RANGE_BYTES)
+        return os.preadv(fd, [memoryview(buf)[:end - begin]], offset + begin)
+
+    total = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for names in (first, rest):
+                pieces = [p for begin, end, _ in plan_spans(header, names) for p in _pieces(begin, end)]
+                total += sum(pool.map(read, pieces))
+    finally:
+        os.close(fd)
+    return total, round(time.monotonic() - start, 2)
+
+
+def warm_in_background(path, include=None, workers=DEFAULT_WORKERS):
+    """warm() in a daemon thread; errors are printed, never raised."""
+    def run():
+        try:
+            size, seconds = warm(path, include, workers)
+            print(f"lazy_loader: warmed {os.path.basename(path)} "
+                  f"({size / (1024 ** 2):.0f}MB in {seconds}s)", flush=True)
+        except Exception as e:
+            print(f"lazy_loader: warm of {path} failed: {e}", flush=True)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------- benchmark ----------
+
+def write_synthetic(path, size_gb=2.0, split=(("unet", 0.6), ("text_encoder", 0.3), ("vae", 0.1)),
+                    tensors=24, dtype="F16"):
+    """an sdxl-like single file: unet/text encoder/vae tensors, interleaved
+    in the header but stored component after component like real files."""
+    prefix = {"unet": "model.diffusion_model.", "text_encoder": "conditioner.", "vae": "first_stage_model."}
+    cols = 4096
+    itemsize = sio.DTYPE_SIZES[dtype]
+    layout = []
+    for comp, share in split:
+        per_tensor = int(size_gb * share * 1024 ** 3 / tensors / itemsize)
+        rows = max(1, per_tensor // cols)
+        layout += [(f"{prefix[comp]}block{i}.weight", dtype, [rows, cols]) for i in range(tensors)]
+    block = bytes(range(256)) * (sio.CHUNK_BYTES // 256)
+    writer = sio.Writer(path, layout, {"synthetic": "1"})
+    for name, _, shape in layout:
+        total = shape[0] * shape[1] * itemsize
+
+        def chunks(total=total):
+            for start in range(0, total, len(block)):
+                yield memoryview(block)[:min(len(block), total - start)]
+
+        writer.write(name, chunks())
+    writer.finish()
+    return path
+
+
+def _full_read(path):
+    # what loading the whole checkpoint costs: every byte, one stream
+    with open(path, "rb", buffering=0) as f:
+        buf = bytearray(sio.CHUNK_BYTES)
+        while f.readinto(buf):
+            pass
+
+
+def time_to_first_step(path, include="unet", step=None, steps=3, step_seconds=0.2,
+                       workers=DEFAULT_WORKERS, cold=True):
+    """seconds until the first step can start: full read vs lazy load.
+
+    step(tensors) stands in for a training step, the default sleeps
+    step_seconds. in the lazy case the rest of the file is prefetched
+    while the steps run. cold drops the page cache before each case
+    (only works for local files).
+    """
+    step = step or (lambda tensors: time.sleep(step_seconds))
+    size = os.path.getsize(path)
+    report = {"file": os.path.basename(path), "size_mb": round(size / (1024 ** 2), 1), "include": include}
+
+    if cold:
+        drop_cache(path)
+    start = time.monotonic()
+    _full_read(path)
+    first = time.monotonic() - start
+    for _ in range(steps):
+        step(None)
+    report["full"] = {
+        "first_step_s": round(first, 3),
+        "steps_done_s": round(time.monotonic() - start, 3),
+        "mb_per_s": round(size / max(first, 1e-6) / (1024 ** 2), 1),
+    }
+
+    if cold:
+        drop_cache(path)
+    start = time.monotonic()
+    with LazyLoader(path, workers=workers) as loader:
+        names = select(loader.header, include)
+        tensors = loader.load(names)
+        first = time.monotonic() - start
+        loader.prefetch()
+        for _ in range(steps):
+            step(tensors)
+        steps_done = time.monotonic() - start
+        loader.wait()
+        report["lazy"] = {
+            "first_step_s": round(first, 3),
+            "steps_done_s": round(steps_done, 3),
+            "prefetch_done_s": round(time.monotonic() - start, 3),
+            "selected_mb": round(loader.nbytes(names) / (1024 ** 2), 1),
+            "tensors": len(names),
+            "reads": loader.stats["reads"],
+        }
+    report["speedup"] = round(report["full"]["first_step_s"] / max(report["lazy"]["first_step_s"], 1e-6), 2)
+    return report
+
+
+def main(argv=None):
+    import argparse
+    import json
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="time to first step, full read vs lazy load")
+    parser.add_argument("file", nargs="?", help="safetensors file, default a synthetic one")
+    parser.add_argument("--include", default="unet", help="components or key prefixes, comma separated")
+    parser.add_argument("--size-gb", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+
+    if args.file:
+        report = time_to_first_step(args.file, args.include, workers=args.workers)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = write_synthetic(os.path.join(work_dir, "synthetic.safetensors"), args.size_gb)
+            report = time_to_first_step(path, args.include, workers=args.workers)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""model conversion for kohya-models (enable_model_converter)
+
+- .safetensors -> .safetensors with float tensors cast to fp16/bf16/fp32,
+  streamed through safetensors_io (mmap in, chunked write out)
+- .ckpt/.pt/.bin -> .safetensors: torch.load(mmap=True) keeps the pickle's
+  storages on disk, tensors are written one at a time
+- LoRA extraction from a fine-tune via sd-scripts'
+  networks/extract_lora_from_models.py
+
+every output gets its sha256 computed while it is written.
+"""
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import safetensors_io as sio
+
+TORCH_EXTS = (".ckpt", ".pt", ".pth", ".bin")
+TORCH_DTYPES = {
+    "float64": "F64", "float32": "F32", "float16": "F16", "bfloat16": "BF16",
+    "int64": "I64", "int32": "I32", "int16": "I16", "int8": "I8", "uint8": "U8", "bool": "BOOL",
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def output_path(src, dtype=None, dest_dir=None):
+    stem = os.path.splitext(os.path.basename(src))[0]
+    suffix = f"-{dtype}" if dtype else ""
+    return os.path.join(dest_dir or os.path.dirname(src), f"{stem}{suffix}.safetensors")
+
+
+def _torch_state_dict(path):
+    import torch
+
+    try:
+        obj = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, TypeError, ValueError):
+        # legacy (non zip) pickles can't be mmapped
+        obj = torch.load(path, map_location="cpu", weights_only=True)
+    # sd checkpoints nest the weights
+    while isinstance(obj, dict) and "state_dict" in obj and isinstance(obj["state_dict"], dict):
+        obj = obj["state_dict"]
+    return {k: v for k, v in obj.items() if isinstance(v, torch.Tensor)}
+
+
+def convert_torch(src, dest, dtype=None):
+    """ckpt/bin -> safetensors, one tensor in memory at a time."""
+    import torch
+
+    state = _torch_state_dict(src)
+    layout, seen = [], {}
+    for name in sorted(state):
+        tensor = state[name]
+        src_dtype = TORCH_DTYPES[str(tensor.dtype).replace("torch.", "")]
+        layout.append((name, sio.target_dtype(src_dtype, dtype), list(tensor.shape)))
+        seen[name] = src_dtype
+
+    writer = sio.Writer(dest, layout, {"format": "pt", "converted_from": os.path.basename(src)})
+    try:
+        for name, dst, _ in layout:
+            tensor = state[name].contiguous()
+            raw = memoryview(tensor.view(-1).view(torch.uint8).numpy())
+            writer.write(name, sio.cast_chunks(raw, seen[name], dst))
+            del tensor, raw
+        digest = writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+    return digest, writer.size
+
+
+def convert_file(src, dest=None, dtype=None):
+    """one file, returns a result dict with the output hash."""
+    start = time.monotonic()
+    dest = dest or output_path(src, dtype)
+    if os.path.abspath(dest) == os.path.abspath(src):
+        raise ValueError(f"output would overwrite the input: {src}")
+    if src.endswith(".safetensors"):
+        digest, size = sio.convert_safetensors(src, dest, dtype)
+    elif src.endswith(TORCH_EXTS):
+        digest, size = convert_torch(src, dest, dtype)
+    else:
+        raise ValueError(f"don't know how to convert {src}")
+    seconds = max(time.monotonic() - start, 1e-6)
+    return {
+        "src": src,
+        "dest": dest,
+        "sha256": digest,
+        "src_bytes": os.path.getsize(src),
+        "bytes": size,
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(os.path.getsize(src) / seconds / (1024 ** 2), 1),
+    }
+
+
+def convert_many(files, dtype=None, dest_dir=None, workers=2):
+    """convert several files in parallel. errors are per file, not raised."""
+    def one(src):
+        try:
+            return convert_file(src, output_path(src, dtype, dest_dir), dtype)
+        except Exception as e:
+            return {"src": src, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(one, files))
+    return {"results": results, "peak_rss_mb": peak_rss_mb()}
+
+
+def extract_lora(kohya_base, model_org, model_tuned, save_to, dim=32, conv_dim=None,
+                 sdxl=False, v2=False, save_precision="fp16", device="cpu"):
+    """run sd-scripts' LoRA extractor. returns (returncode, output tail)."""
+    import subprocess
+    import sys
+
+    script = os.path.join(kohya_base, "sd-scripts", "networks", "extract_lora_from_models.py")
+    command = [
+        sys.executable, script,
+        "--model_org", model_org,
+        "--model_tuned", model_tuned,
+        "--save_to", save_to,
+        "--dim", str(dim),
+        "--save_precision", save_precision,
+        "--device", device,
+    ]
+    if conv_dim:
+        command += ["--conv_dim", str(conv_dim)]
+    if sdxl:
+        command.append("--sdxl")
+    if v2:
+        command.append("--v2")
+    proc = subprocess.run(
+        command, cwd=os.path.join(kohya_base, "sd-scripts"),
+        capture_output=True, text=True,
+    )
+    return proc.returncode, (proc.stdout + proc.stderr).splitlines()[-20:]
+
+
+# ---------- benchmark ----------
+
+def write_synthetic(path, size_gb=2.0, tensors=8, dtype="F32"):
+    """a safetensors file of roughly size_gb, pseudo random floats."""
+    import numpy as np
+
+    per_tensor = int(size_gb * 1024 ** 3 / tensors / sio.DTYPE_SIZES[dtype])
+    cols = 4096
+    rows = max(1, per_tensor // cols)
+    layout = [(f"layer{i}.weight", dtype, [rows, cols]) for i in range(tensors)]
+    rng = np.random.default_rng(0)
+    block = rng.standard_normal(sio.CHUNK_BYTES // 4, dtype=np.float32)
+    writer = sio.Writer(path, layout, {"synthetic": "1"})
+    for name, _, shape in layout:
+        total = rows * cols * 4
+
+        def chunks(total=total):
+            raw = memoryview(block).cast("B")
+            for start in range(0, total, len(raw)):
+                yield raw[:min(len(raw), total - start)]
+
+        writer.write(name, chunks())
+    writer.finish()
+    return path
+
+
+def _bench_case(src, dest, dtype):
+    # runs in a fresh process so ru_maxrss is this conversion only
+    result = convert_file(src, dest, dtype)
+    result["peak_rss_mb"] = peak_rss_mb()
+    os.remove(dest)
+    return result
+
+
+def benchmark(work_dir, size_gb=2.0, dtypes=("fp16", "bf16")):
+    """convert a synthetic fp32 file to each dtype, one process per case."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(work_dir, exist_ok=True)
+    src = os.path.join(work_dir, "synthetic-fp32.safetensors")
+    start = time.monotonic()
+    write_synthetic(src, size_gb)
+    report = {
+        "size_mb": round(os.path.getsize(src) / (1024 ** 2), 1),
+        "write_s": round(time.monotonic() - start, 2),
+        "cases": [],
+    }
+    ctx = multiprocessing.get_context("spawn")
+    for dtype in dtypes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            dest = os.path.join(work_dir, f"synthetic-{dtype}.safetensors")
+            result = pool.submit(_bench_case, src, dest, dtype).result()
+        report["cases"].append({
+            "dtype": dtype,
+            "seconds": result["seconds"],
+            "mb_per_s": result["mb_per_s"],
+            "peak_rss_mb": result["peak_rss_mb"],
+            "out_mb": round(result["bytes"] / (1024 ** 2), 1),
+        })
+    os.remove(src)
+    return report
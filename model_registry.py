@@ -0,0 +1,204 @@
+"""model registry for the kohya-models volume
+
+`<models>/.registry.json` has one entry per model (a hub repo, an upload,
+a converted file):
+
+    {"models": {name: {"paths": [...], "repo_id", "revision", "source",
+                       "size", "sha256", "complete": [...], "added",
+                       "last_used", "pinned"}}}
+
+every download/upload/convert function registers what it wrote, training
+launches touch the model they use. lookup() answers "is it there?" from
+the index plus a stat per file, no network. enforce() keeps the volume
+within max_models / max_bytes by evicting the least recently used
+entries (pinned ones and the model just added are kept).
+"""
+import json
+import os
+import shutil
+import time
+
+REGISTRY_NAME = ".registry.json"
+MODEL_EXTS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf")
+
+
+def _overlaps(a, b):
+    """same path, or one inside the other."""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path) for name in files
+        )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class ModelRegistry:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, REGISTRY_NAME)
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("models", {})
+        return data
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    @property
+    def models(self):
+        return self.data["models"]
+
+    def _rel(self, path):
+        return os.path.relpath(os.path.join(self.root, path), self.root)
+
+    def register(self, name, paths, repo_id=None, revision=None, source=None,
+                 sha256=None, scope=None):
+        """add or extend an entry. paths are relative to the models root.
+
+        scope marks a complete download of a repo (e.g. "*" or a
+        subfolder), so a later lookup without a file list can hit.
+        """
+        now = time.time()
+        entry = self.models.setdefault(name, {
+            "paths": [], "added": now, "pinned": False, "complete": [],
+        })
+        entry["paths"] = sorted(set(entry["paths"]) | {self._rel(p) for p in paths})
+        entry.update(
+            repo_id=repo_id or entry.get("repo_id"),
+            revision=revision or entry.get("revision"),
+            source=source or entry.get("source"),
+            sha256=sha256 or entry.get("sha256"),
+            last_used=now,
+        )
+        if scope and scope not in entry["complete"]:
+            entry["complete"].append(scope)
+        entry["size"] = sum(_size(os.path.join(self.root, p)) for p in entry["paths"])
+        return entry
+
+    def owner(self, path):
+        """name of the model a path belongs to, None if untracked."""
+        rel = self._rel(path)
+        for name, entry in self.models.items():
+            for p in entry["paths"]:
+                if rel == p or rel.startswith(p + os.sep):
+                    return name
+        return None
+
+    def touch(self, name=None, path=None):
+        name = name or (self.owner(path) if path else None)
+        if name in self.models:
+            self.models[name]["last_used"] = time.time()
+        return name
+
+    def lookup(self, name=None, repo_id=None, files=None, scope="*"):
+        """local paths of a present model, None when anything is missing.
+
+        by name, or by repo_id plus either a file list or a complete
+        download scope. never goes to the network.
+        """
+        if name is not None:
+            entries = [self.models.get(name)]
+        else:
+            entries = [e for e in self.models.values() if e.get("repo_id") == repo_id]
+        for entry in entries:
+            if not entry:
+                continue
+            if files is not None:
+                wanted = [self._rel(f) for f in files]
+                if not set(wanted) <= set(entry["paths"]):
+                    continue
+            elif name is None and scope not in entry.get("complete", []):
+                continue
+            else:
+                wanted = entry["paths"]
+            paths = [os.path.join(self.root, p) for p in wanted]
+            if paths and all(os.path.exists(p) for p in paths):
+                return paths
+        return None
+
+    def prune_missing(self):
+        """drop paths (and entries) that are gone from the volume."""
+        dropped = []
+        for name, entry in list(self.models.items()):
+            entry["paths"] = [p for p in entry["paths"] if os.path.exists(os.path.join(self.root, p))]
+            if not entry["paths"]:
+                del self.models[name]
+                dropped.append(name)
+        return dropped
+
+    def adopt_untracked(self):
+        """register top level model files/dirs nobody owns, e.g. from the gui."""
+        adopted = []
+        for entry in sorted(os.listdir(self.root)):
+            # dot entries are volume internals (.blobs, the registry itself)
+            if entry.startswith(".") or entry.endswith((".partial", ".incomplete", ".tmp")):
+                continue
+            path = os.path.join(self.root, entry)
+            # a hub repo's subfolders (text_encoder/, vae/) are already owned
+            if any(_overlaps(entry, p) for e in self.models.values() for p in e["paths"]):
+                continue
+            if os.path.isdir(path) or entry.endswith(MODEL_EXTS):
+                model = self.register(entry, [entry], source="untracked")
+                model["last_used"] = os.path.getmtime(path)
+                adopted.append(entry)
+        return adopted
+
+    def total_bytes(self):
+        return sum(entry.get("size", 0) for entry in self.models.values())
+
+    def enforce(self, max_models=0, max_bytes=0, keep=(), store=None):
+        """evict least recently used models past the limits (0 = no limit).
+
+        files still listed by a kept model are left alone. with a BlobStore
+        the freed blobs are garbage collected too. returns the evicted names.
+        """
+        candidates = sorted(
+            (n for n, e in self.models.items() if not e.get("pinned") and n not in keep),
+            key=lambda n: self.models[n].get("last_used", 0),
+        )
+        evicted = []
+        for name in candidates:
+            over_count = max_models and len(self.models) > max_models
+            over_bytes = max_bytes and self.total_bytes() > max_bytes
+            if not (over_count or over_bytes):
+                break
+            entry = self.models.pop(name)
+            kept = [p for e in self.models.values() for p in e["paths"]]
+            for rel in entry["paths"]:
+                if any(_overlaps(rel, p) for p in kept):
+                    continue
+                path = os.path.join(self.root, rel)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                if store is not None:
+                    store.forget(path)
+            evicted.append({"name": name, "size": entry.get("size", 0)})
+            print(f"registry: evicted {name} ({entry.get('size', 0) / (1024 ** 3):.2f}GB)")
+        if evicted and store is not None:
+            store.gc()
+        return evicted
+
+    def pin(self, name, pinned=True):
+        self.models[name]["pinned"] = pinned
+
+    def listing(self):
+        """entries most recently used first, for display."""
+        return sorted(
+            ({"name": n, **e} for n, e in self.models.items()),
+            key=lambda e: -e.get("last_used", 0),
+        )
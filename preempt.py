@@ -0,0 +1,162 @@
+"""save training state on preemption / timeout, resume from it next run
+
+runs inside the trainer process, between accelerate and the sd-scripts
+script:
+
+    accelerate launch preempt.py --state-dir <dir> --deadline <epoch s> -- \\
+        sd-scripts/train_network.py --config_file ...
+
+SIGTERM/SIGINT, or the deadline passing, only sets a flag. the next
+optimizer step then calls accelerator.save_state() (sd-scripts' own save
+hooks add train_state.json with the epoch/step), writes
+`<dir>/resume.json` pointing at the new state and exits with
+EXIT_PREEMPTED. the next run of the same config passes
+`--resume <state>` (resume_args) and continues from there.
+"""
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+
+EXIT_PREEMPTED = 75  # EX_TEMPFAIL
+MARKER_NAME = "resume.json"
+PID_NAME = "trainer.pid"
+KEEP_STATES = 1  # older state dirs are removed after a newer one is saved
+
+_request = {"reason": None}
+_accelerators = []
+
+
+def state_dir_for(root, config):
+    """one state dir per training config, e.g. sweeps/s1/trial-000.toml -> sweeps__s1__trial-000."""
+    name = os.path.splitext(config.strip("/"))[0].replace("/", "__")
+    return os.path.join(root, name)
+
+
+def read_marker(state_dir):
+    """the resume marker, or None when there is nothing (valid) to resume."""
+    try:
+        with open(os.path.join(state_dir, MARKER_NAME)) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isdir(marker.get("state", "")):
+        return None
+    return marker
+
+
+def write_marker(state_dir, state, reason):
+    path = os.path.join(state_dir, MARKER_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"state": state, "reason": reason, "time": time.time()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def clear_marker(state_dir):
+    """training finished, the next run of this config starts fresh."""
+    if os.path.exists(os.path.join(state_dir, MARKER_NAME)):
+        os.remove(os.path.join(state_dir, MARKER_NAME))
+
+
+def resume_args(state_dir):
+    marker = read_marker(state_dir)
+    return ["--resume", marker["state"]] if marker else []
+
+
+def trainer_pid(state_dir):
+    try:
+        with open(os.path.join(state_dir, PID_NAME)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def request_save(reason):
+    if _request["reason"] is None:
+        print(f"preempt: {reason}, saving state at the next step", flush=True)
+        _request["reason"] = reason
+
+
+def _prune(state_dir, keep):
+    states = sorted(d for d in os.listdir(state_dir) if d.startswith("state-"))
+    for name in states[:-keep]:
+        shutil.rmtree(os.path.join(state_dir, name), ignore_errors=True)
+
+
+def _save_and_exit(state_dir):
+    accelerator = _accelerators[-1]
+    path = os.path.join(state_dir, time.strftime("state-%Y%m%d-%H%M%S"))
+    start = time.monotonic()
+    accelerator.save_state(path)
+    accelerator.wait_for_everyone()
+    if accelerator.is_main_process:
+        write_marker(state_dir, path, _request["reason"])
+        _prune(state_dir, KEEP_STATES)
+        print(f"preempt: state saved to {path} in {time.monotonic() - start:.1f}s", flush=True)
+    sys.exit(EXIT_PREEMPTED)
+
+
+def _watch_deadline(deadline):
+    while time.time() < deadline:
+        time.sleep(min(30, max(1, deadline - time.time())))
+    request_save("timeout")
+
+
+def install(state_dir, deadline=None):
+    """hook signals, the deadline and accelerate's optimizer step."""
+    import accelerate
+    from accelerate.optimizer import AcceleratedOptimizer
+
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, PID_NAME), "w") as f:
+        f.write(str(os.getpid()))
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: request_save(signal.Signals(signum).name))
+    if deadline:
+        threading.Thread(target=_watch_deadline, args=(deadline,), daemon=True).start()
+
+    init = accelerate.Accelerator.__init__
+
+    def patched_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        _accelerators.append(self)
+
+    step = AcceleratedOptimizer.step
+
+    def patched_step(self, *args, **kwargs):
+        result = step(self, *args, **kwargs)
+        # only between steps, a half applied update can't be saved
+        if _request["reason"] and _accelerators:
+            _save_and_exit(state_dir)
+        return result
+
+    accelerate.Accelerator.__init__ = patched_init
+    AcceleratedOptimizer.step = patched_step
+
+
+def main(argv=None):
+    import argparse
+    import runpy
+
+    argv = sys.argv[1:] if argv is None else argv
+    if "--" not in argv:
+        raise SystemExit("usage: preempt.py --state-dir DIR [--deadline T] -- script.py [args]")
+    split = argv.index("--")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state-dir", required=True)
+    parser.add_argument("--deadline", type=float, default=None)
+    args = parser.parse_args(argv[:split])
+    script, script_args = argv[split + 1], argv[split + 2:]
+
+    install(args.state_dir, args.deadline)
+    sys.argv = [script] + script_args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
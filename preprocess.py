@@ -0,0 +1,245 @@
+"""dataset preprocessing: downscale, re-encode, caption sidecar checks
+
+for every image in a dataset folder, spread over all cores:
+- decode it fully (broken files go to <dataset>/.quarantine with sidecars)
+- downscale to the smallest size that still covers its training bucket
+- re-encode to the configured format/quality when that changes anything
+- check the caption sidecar (.txt/.caption, and .json must parse)
+
+a format change never overwrites another file: when the new name is
+taken (a.png -> a.jpg next to an existing a.jpg) the image is left alone
+and reported under `collisions`.
+
+`<dataset>/.preprocess_manifest.json` remembers the (size, mtime) each
+output was left with, so a rerun only touches new or changed files.
+"""
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bucket_manager import IMAGE_EXTS, bucket_params, target_reso
+
+MANIFEST_NAME = ".preprocess_manifest.json"
+QUARANTINE_DIR = ".quarantine"
+CAPTION_EXTS = (".txt", ".caption")
+SIDECAR_EXTS = CAPTION_EXTS + (".json", ".npz")
+FORMATS = {"png": ".png", "jpg": ".jpg", "jpeg": ".jpg", "webp": ".webp"}
+SAVE_EVERY = 500  # files between manifest writes
+
+
+def preprocess_params(resolution=1024, fmt=None, quality=95, enable_bucket=True,
+                      min_bucket_reso=256, max_bucket_reso=1024, bucket_reso_steps=64,
+                      bucket_no_upscale=False):
+    """fmt None keeps each file's own format."""
+    if fmt is not None and fmt.lower() not in FORMATS:
+        raise ValueError(f"unsupported format {fmt}, use one of {sorted(FORMATS)}")
+    return {
+        "buckets": bucket_params(
+            resolution, enable_bucket, min_bucket_reso,
+            max_bucket_reso, bucket_reso_steps, bucket_no_upscale,
+        ),
+        "format": fmt.lower() if fmt else None,
+        "quality": quality,
+    }
+
+
+def _sidecars(path):
+    stem = os.path.splitext(path)[0]
+    return [stem + ext for ext in SIDECAR_EXTS if os.path.exists(stem + ext)]
+
+
+def _check_caption(path):
+    stem = os.path.splitext(path)[0]
+    has_text = any(os.path.exists(stem + ext) for ext in CAPTION_EXTS)
+    if os.path.exists(stem + ".json"):
+        try:
+            with open(stem + ".json", encoding="utf-8") as f:
+                json.load(f)
+            has_json = True
+        except (OSError, ValueError):
+            return "bad_json_caption"
+    else:
+        has_json = False
+    if not (has_text or has_json):
+        return "missing_caption"
+    return None
+
+
+def _save(img, dest, fmt, quality):
+    kwargs = {}
+    if fmt in ("jpg", "jpeg"):
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        kwargs = {"quality": quality, "optimize": True}
+    elif fmt == "webp":
+        kwargs = {"quality": quality, "method": 4}
+    elif fmt == "png":
+        kwargs = {"optimize": False, "compress_level": 6}
+    tmp = dest + ".tmp"
+    img.save(tmp, format="JPEG" if fmt in ("jpg", "jpeg") else fmt.upper(), **kwargs)
+    os.replace(tmp, dest)
+
+
+def process_one(path, params, shared_stem=False):
+    """work for one image, runs in a pool worker. returns a result dict.
+
+    shared_stem: another image has the same name without extension, so a
+    rename could race with it even if dest doesn't exist yet.
+    """
+    from PIL import Image
+
+    result = {"path": path, "status": "ok", "caption": _check_caption(path)}
+    try:
+        with Image.open(path) as img:
+            img.load()  # full decode, catches truncated files
+            width, height = img.size
+            src_fmt = (img.format or "").lower()
+            src_fmt = {"jpeg": "jpg"}.get(src_fmt, src_fmt)
+
+            bw, bh = target_reso(width, height, params["buckets"])
+            scale = max(bw / width, bh / height)
+            fmt = {"jpeg": "jpg"}.get(params["format"], params["format"]) or src_fmt
+            # already in that format: keep the name as it is (photo.jpeg, IMG.JPG)
+            dest = path if fmt == src_fmt else os.path.splitext(path)[0] + FORMATS[fmt]
+            if dest != path and (shared_stem or os.path.exists(dest)):
+                return {"path": path, "status": "collision", "caption": result["caption"], "dest": dest}
+
+            resized = None
+            if scale < 1.0:
+                size = (max(bw, math.ceil(width * scale)), max(bh, math.ceil(height * scale)))
+                resized = img.resize(size, Image.LANCZOS)
+                result["resized"] = [width, height, size[0], size[1]]
+            if resized is not None or dest != path:
+                _save(resized if resized is not None else img, dest, fmt, params["quality"])
+                result["status"] = "rewritten"
+    except Exception as e:
+        return {"path": path, "status": "corrupt", "error": str(e)}
+
+    if dest != path:
+        os.remove(path)
+        result["path"] = dest
+    st = os.stat(result["path"])
+    result["file"] = [st.st_size, st.st_mtime_ns]
+    return result
+
+
+def _process_star(args):
+    return process_one(*args)
+
+
+def _quarantine(dataset_dir, path):
+    rel = os.path.relpath(path, dataset_dir)
+    for src in [path] + _sidecars(path):
+        dest = os.path.join(dataset_dir, QUARANTINE_DIR, os.path.dirname(rel), os.path.basename(src))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(src, dest)
+
+
+def _load_manifest(dataset_dir, params):
+    try:
+        with open(os.path.join(dataset_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"params": params, "files": {}}
+
+
+def _write_manifest(dataset_dir, manifest):
+    path = os.path.join(dataset_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def preprocess_dataset(dataset_dir, params=None, workers=None, on_progress=None):
+    start = time.monotonic()
+    params = params or preprocess_params()
+    manifest = _load_manifest(dataset_dir, params)
+    files = manifest["files"]
+
+    todo, images, captions, unchanged = [], set(), set(), {}
+    stems = {}
+    for root, dirs, names in os.walk(dataset_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if name.startswith("."):
+                continue  # our own manifests (.preprocess_manifest.json, .captioner.json, ...)
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dataset_dir)
+            lower = name.lower()
+            if lower.endswith(CAPTION_EXTS + (".json",)):
+                captions.add(os.path.splitext(rel)[0])
+            if not lower.endswith(IMAGE_EXTS):
+                continue
+            stem = os.path.splitext(rel)[0]
+            images.add(stem)
+            stems[stem] = stems.get(stem, 0) + 1
+            st = os.stat(path)
+            prev = files.get(rel)
+            if prev and prev["file"] == [st.st_size, st.st_mtime_ns]:
+                # image already done, captions can still change under it
+                unchanged[rel] = _check_caption(path)
+                continue
+            todo.append(path)
+
+    counts = {"ok": 0, "rewritten": 0, "corrupt": 0, "collision": 0}
+    caption_issues, collisions = {}, {}
+    bytes_before = sum(os.path.getsize(p) for p in todo)
+    bytes_after = 0
+    workers = workers or os.cpu_count() or 1
+    print(f"preprocess {dataset_dir}: {len(todo)} files to check, {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = ((p, params, stems[os.path.splitext(os.path.relpath(p, dataset_dir))[0]] > 1) for p in todo)
+        results = pool.map(_process_star, jobs, chunksize=16)
+        for done, result in enumerate(results, 1):
+            path = result["path"]
+            counts[result["status"]] += 1
+            if result["status"] == "corrupt":
+                _quarantine(dataset_dir, path)
+                files.pop(os.path.relpath(path, dataset_dir), None)
+            elif result["status"] == "collision":
+                # not recorded as done, checked again once the name is free
+                collisions[os.path.relpath(path, dataset_dir)] = os.path.relpath(result["dest"], dataset_dir)
+                files.pop(os.path.relpath(path, dataset_dir), None)
+            else:
+                rel = os.path.relpath(path, dataset_dir)
+                files[rel] = {"file": result["file"], "caption": result["caption"]}
+                bytes_after += result["file"][0]
+            if result.get("caption"):
+                caption_issues[os.path.relpath(path, dataset_dir)] = result["caption"]
+            if done % SAVE_EVERY == 0:
+                _write_manifest(dataset_dir, manifest)
+                if on_progress is not None:
+                    on_progress(done, len(todo))
+
+    # files the manifest knows about but that are gone now
+    for rel in list(files):
+        if not os.path.exists(os.path.join(dataset_dir, rel)):
+            del files[rel]
+    for rel, issue in unchanged.items():
+        files[rel]["caption"] = issue
+        if issue:
+            caption_issues[rel] = issue
+    _write_manifest(dataset_dir, manifest)
+
+    orphans = sorted(captions - images)
+    seconds = time.monotonic() - start
+    return {
+        "checked": len(todo),
+        "unchanged": len(unchanged),
+        "rewritten": counts["rewritten"],
+        "quarantined": counts["corrupt"],
+        "collisions": collisions,
+        "caption_issues": caption_issues,
+        "orphan_captions": orphans,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "seconds": round(seconds, 2),
+        "files_per_s": round(len(todo) / seconds, 1) if seconds else 0.0,
+    }
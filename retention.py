@@ -0,0 +1,277 @@
+"""retention for the outputs volume
+
+a persisted index (`<root>/.retention_index.json`) keeps size, mtime,
+last use and run id per file plus the mtime of every directory. a rescan
+only lists and stats directories whose mtime changed (files added,
+removed or renamed), everything else comes from the index; a full rescan
+happens every FULL_SCAN_EVERY seconds or on request, to catch files
+rewritten in place.
+
+policies, applied in this order, each file evicted at most once. files
+are grouped into units first (a `*-state` dir, a checkpoint file, any
+other single file) and only whole units are evicted:
+- max_age_days: not modified/used for that long
+- keep_last: per run dir, only the newest N checkpoints (model files and
+  sd-scripts `*-state` dirs)
+- quota_gb: while the total is over quota, least recently used first,
+  non-checkpoints before checkpoints
+
+plan() is the dry run, apply() deletes in batches and calls on_batch
+after each one (the modal function commits the volume there).
+"""
+import json
+import os
+import time
+
+INDEX_NAME = ".retention_index.json"
+FULL_SCAN_EVERY = 24 * 3600
+CHECKPOINT_EXTS = (".safetensors", ".ckpt", ".pt", ".bin")
+# preempt.py's resume states and the startup history are never evicted
+PROTECTED = (".resume", ".startup", INDEX_NAME)
+BATCH_SIZE = 500
+
+
+def run_id(rel):
+    """the directory a file belongs to; `-state` dirs count as their parent run."""
+    parts = rel.split(os.sep)[:-1]
+    while parts and parts[-1].endswith("-state"):
+        parts.pop()
+    return os.sep.join(parts) or "."
+
+
+def checkpoint_unit(rel):
+    """what keep_last counts: a model file, or a whole `*-state` dir. None otherwise."""
+    parts = rel.split(os.sep)
+    for i, part in enumerate(parts[:-1]):
+        if part.endswith("-state"):
+            return os.sep.join(parts[:i + 1])
+    return rel if rel.endswith(CHECKPOINT_EXTS) else None
+
+
+class RetentionIndex:
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, INDEX_NAME)
+        self.data = self._load()
+        self.stats = {"dirs_listed": 0, "dirs_reused": 0, "files_statted": 0}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"dirs": {}, "files": {}, "full_scan": 0}
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.data, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def refresh(self, full=False):
+        """bring the index up to date, returns the file table."""
+        full = full or time.time() - self.data.get("full_scan", 0) > FULL_SCAN_EVERY
+        dirs, files = self.data["dirs"], self.data["files"]
+        children, by_dir = {}, {}
+        for d in dirs:
+            if d != ".":
+                children.setdefault(os.path.dirname(d) or ".", []).append(d)
+        for f in files:
+            by_dir.setdefault(os.path.dirname(f) or ".", []).append(f)
+
+        seen_dirs = {}
+        todo = ["."]
+        while todo:
+            rel = todo.pop()
+            path = os.path.join(self.root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            seen_dirs[rel] = mtime
+            if not full and dirs.get(rel) == mtime:
+                # listing unchanged: subdirs from the index, files untouched
+                self.stats["dirs_reused"] += 1
+                todo += children.get(rel, [])
+                continue
+            self.stats["dirs_listed"] += 1
+            prefix = "" if rel == "." else rel + os.sep
+            present = set()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    entry_rel = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        todo.append(entry_rel)
+                    elif entry.is_file(follow_symlinks=False):
+                        if entry_rel in (INDEX_NAME, INDEX_NAME + ".tmp"):
+                            continue
+                        present.add(entry_rel)
+                        st = entry.stat(follow_symlinks=False)
+                        self.stats["files_statted"] += 1
+                        files[entry_rel] = {
+                            "size": st.st_size,
+                            "mtime": st.st_mtime,
+                            "used": max(st.st_mtime, st.st_atime),
+                            "run": run_id(entry_rel),
+                        }
+            for name in by_dir.get(rel, []):
+                if name not in present:
+                    del files[name]
+
+        # directories that disappeared take their files with them
+        for rel in dirs:
+            if rel not in seen_dirs:
+                for name in by_dir.get(rel, []):
+                    files.pop(name, None)
+        self.data["dirs"] = seen_dirs
+        if full:
+            self.data["full_scan"] = time.time()
+        return files
+
+
+def _protected(rel):
+    return rel.split(os.sep)[0] in PROTECTED
+
+
+def _units(candidates):
+    """group files into what gets evicted together: a `*-state` dir, a model file or any other file."""
+    units = {}
+    for rel, info in candidates.items():
+        key = checkpoint_unit(rel)
+        unit = units.setdefault(key or rel, {
+            "files": [], "size": 0, "mtime": 0, "used": 0, "run": info["run"], "checkpoint": key is not None,
+        })
+        unit["files"].append(rel)
+        unit["size"] += info["size"]
+        unit["mtime"] = max(unit["mtime"], info["mtime"])
+        unit["used"] = max(unit["used"], info["used"])
+    return units
+
+
+def plan(files, max_age_days=None, keep_last=None, quota_gb=None, now=None):
+    """[(rel, size, reason)] to evict. pure, works on the index table.
+
+    whole units only, so a resume state or checkpoint is never half deleted.
+    """
+    now = now or time.time()
+    candidates = {rel: info for rel, info in files.items() if not _protected(rel)}
+    units = _units(candidates)
+    evict = {}
+
+    if max_age_days:
+        # the newest file decides, one fresh file keeps the whole unit
+        cutoff = now - max_age_days * 86400
+        for key, unit in units.items():
+            if unit["used"] < cutoff:
+                evict[key] = "age"
+
+    if keep_last:
+        by_run = {}
+        for key, unit in units.items():
+            if unit["checkpoint"]:
+                by_run.setdefault(unit["run"], []).append(key)
+        for keys in by_run.values():
+            ordered = sorted(keys, key=lambda k: -units[k]["mtime"])
+            for key in ordered[keep_last:]:
+                evict.setdefault(key, "keep_last")
+
+    if quota_gb:
+        quota = quota_gb * 1024 ** 3
+        total = sum(info["size"] for info in files.values()) - sum(units[k]["size"] for k in evict)
+        ordered = sorted(
+            (k for k in units if k not in evict),
+            key=lambda k: (units[k]["checkpoint"], units[k]["used"]),
+        )
+        for key in ordered:
+            if total <= quota:
+                break
+            evict[key] = "quota"
+            total -= units[key]["size"]
+
+    return sorted(
+        ((rel, files[rel]["size"], reason) for key, reason in evict.items() for rel in units[key]["files"]),
+        key=lambda item: item[0],
+    )
+
+
+def _prune_dirs(root, rels):
+    # empty run dirs left behind, deepest first, never the root itself
+    dirs = {os.path.dirname(rel) for rel in rels if os.path.dirname(rel)}
+    for rel in sorted(dirs, key=lambda d: -d.count(os.sep)):
+        path = os.path.join(root, rel)
+        while rel and os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+            rel = os.path.dirname(rel)
+            path = os.path.join(root, rel)
+
+
+def apply(index, evictions, batch_size=BATCH_SIZE, on_batch=None):
+    """delete planned files batch by batch. returns (deleted, bytes, errors)."""
+    files = index.data["files"]
+    deleted, freed, errors = 0, 0, {}
+    start = 0
+    while start < len(evictions):
+        end = min(start + batch_size, len(evictions))
+        # never split a `*-state` dir across two commits
+        while end < len(evictions) and checkpoint_unit(evictions[end][0]) == checkpoint_unit(evictions[end - 1][0]) \
+                and checkpoint_unit(evictions[end][0]) is not None:
+            end += 1
+        batch = evictions[start:end]
+        for rel, size, _ in batch:
+            try:
+                os.remove(os.path.join(index.root, rel))
+                deleted += 1
+                freed += size
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors[rel] = str(e)
+                continue
+            files.pop(rel, None)
+        _prune_dirs(index.root, [rel for rel, _, _ in batch])
+        # our own deletes shouldn't force a relisting next time
+        for rel in {os.path.dirname(rel) or "." for rel, _, _ in batch}:
+            try:
+                index.data["dirs"][rel] = os.stat(os.path.join(index.root, rel)).st_mtime_ns
+            except OSError:
+                index.data["dirs"].pop(rel, None)
+        index.save()
+        if on_batch is not None:
+            on_batch(end, len(evictions))
+        start = end
+    return deleted, freed, errors
+
+
+def cleanup(root, max_age_days=None, keep_last=None, quota_gb=None, dry_run=False,
+            full_scan=False, on_batch=None):
+    """refresh the index, plan, and (unless dry_run) delete. returns a report."""
+    start = time.monotonic()
+    index = RetentionIndex(root)
+    files = index.refresh(full=full_scan)
+    evictions = plan(files, max_age_days, keep_last, quota_gb)
+    total = sum(info["size"] for info in files.values())
+    evict_bytes = sum(size for _, size, _ in evictions)
+    reasons = {}
+    for _, size, reason in evictions:
+        reasons.setdefault(reason, {"files": 0, "bytes": 0})
+        reasons[reason]["files"] += 1
+        reasons[reason]["bytes"] += size
+
+    report = {
+        "dry_run": dry_run,
+        "files": len(files),
+        "bytes": total,
+        "evict_files": len(evictions),
+        "evict_bytes": evict_bytes,
+        "bytes_after": total - evict_bytes,
+        "by_reason": reasons,
+        "scan": index.stats,
+    }
+    if dry_run:
+        index.save()
+        report["evict"] = [{"path": rel, "size": size, "reason": reason} for rel, size, reason in evictions[:200]]
+    else:
+        deleted, freed, errors = apply(index, evictions, on_batch=on_batch)
+        index.save()
+        report.update(deleted=deleted, freed_bytes=freed, errors=errors)
+    report["seconds"] = round(time.monotonic() - start, 2)
+    return report
@@ -0,0 +1,239 @@
+"""streaming safetensors read/write over mmap
+
+the format is an 8 byte little endian header length, a json header
+({name: {"dtype", "shape", "data_offsets": [begin, end]}, "__metadata__": {...}})
+and the raw tensor bytes. Reader mmaps the file and hands out zero-copy
+views; Writer takes the full layout up front and then streams tensor data
+in order, hashing as it goes. both work in CHUNK_BYTES pieces and drop
+pages they are done with, so a 7GB checkpoint goes through a few hundred
+MB of memory.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+CHUNK_BYTES = 64 * 1024 * 1024
+DTYPE_SIZES = {
+    "F64": 8, "F32": 4, "F16": 2, "BF16": 2,
+    "I64": 8, "I32": 4, "I16": 2, "I8": 1, "U8": 1, "BOOL": 1,
+    "F8_E4M3": 1, "F8_E5M2": 1,
+}
+FLOAT_DTYPES = ("F64", "F32", "F16", "BF16")
+# names accepted by cast targets
+DTYPE_NAMES = {"fp16": "F16", "float16": "F16", "bf16": "BF16", "bfloat16": "BF16",
+               "fp32": "F32", "float32": "F32"}
+
+
+def _numel(shape):
+    n = 1
+    for dim in shape:
+        n *= dim
+    return n
+
+
+def read_header(path):
+    """(header, data_offset) without touching the tensor data."""
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+class Reader:
+    def __init__(self, path):
+        self.path = path
+        self.header, self.offset = read_header(path)
+        self.metadata = self.header.pop("__metadata__", {}) or {}
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def keys(self):
+        return list(self.header)
+
+    def info(self, name):
+        return self.header[name]
+
+    def raw(self, name, start=0, end=None):
+        """memoryview of (part of) one tensor's bytes, no copy."""
+        begin, stop = self.header[name]["data_offsets"]
+        end = stop - begin if end is None else min(end, stop - begin)
+        return memoryview(self._map)[self.offset + begin + start:self.offset + begin + end]
+
+    def array(self, name):
+        """numpy view of one tensor (bf16 comes back as uint16)."""
+        import numpy as np
+
+        info = self.header[name]
+        dtype = _np_dtype(info["dtype"])
+        return np.frombuffer(self.raw(name), dtype=dtype).reshape(info["shape"])
+
+    def release(self, name):
+        """tell the kernel we're done with this tensor's pages."""
+        begin, stop = self.header[name]["data_offsets"]
+        start = (self.offset + begin) // mmap.PAGESIZE * mmap.PAGESIZE
+        length = self.offset + stop - start
+        if self._map is not None and length > 0 and hasattr(self._map, "madvise"):
+            self._map.madvise(mmap.MADV_DONTNEED, start, length)
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a caller still holds a view
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _np_dtype(dtype):
+    import numpy as np
+
+    return {
+        "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+        "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8,
+        "U8": np.uint8, "BOOL": np.bool_, "F8_E4M3": np.uint8, "F8_E5M2": np.uint8,
+    }[dtype]
+
+
+class Writer:
+    """layout: [(name, dtype, shape)] in write order. write() each in that order."""
+
+    def __init__(self, path, layout, metadata=None):
+        self.path = path
+        self.tmp = path + ".tmp"
+        header, offset = {}, 0
+        for name, dtype, shape in layout:
+            nbytes = _numel(shape) * DTYPE_SIZES[dtype]
+            header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + nbytes]}
+            offset += nbytes
+        if metadata:
+            header = {"__metadata__": {k: str(v) for k, v in metadata.items()}, **header}
+        blob = json.dumps(header, separators=(",", ":")).encode()
+        blob += b" " * (-len(blob) % 8)  # keep tensor data 8 byte aligned
+        self.header = header
+        self._order = [name for name, _, _ in layout]
+        self._next = 0
+        self._remaining = 0
+        self._sha = hashlib.sha256()
+        self._file = open(self.tmp, "wb")
+        self._emit(struct.pack("<Q", len(blob)) + blob)
+        self.size = 8 + len(blob) + offset
+
+    def _emit(self, data):
+        self._file.write(data)
+        self._sha.update(data)
+
+    def begin(self, name):
+        if self._remaining:
+            raise ValueError(f"{self._order[self._next - 1]} is missing {self._remaining} bytes")
+        if self._next >= len(self._order) or self._order[self._next] != name:
+            raise ValueError(f"expected {self._order[self._next] if self._next < len(self._order) else 'nothing'}, got {name}")
+        begin, end = self.header[name]["data_offsets"]
+        self._remaining = end - begin
+        self._next += 1
+
+    def feed(self, data):
+        data = memoryview(data).cast("B")
+        if len(data) > self._remaining:
+            raise ValueError("more bytes than the tensor's shape allows")
+        self._emit(data)
+        self._remaining -= len(data)
+
+    def write(self, name, chunks):
+        """one tensor from an iterable of byte chunks."""
+        self.begin(name)
+        for chunk in chunks:
+            self.feed(chunk)
+        if self._remaining:
+            raise ValueError(f"{name}: {self._remaining} bytes short")
+
+    def finish(self):
+        """close, fsync and move into place. returns the sha256 of the file."""
+        if self._next != len(self._order) or self._remaining:
+            self.abort()
+            raise ValueError("not every tensor was written")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp, self.path)
+        return self._sha.hexdigest()
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+# ---------- casting ----------
+
+def _to_f32(arr, dtype):
+    import numpy as np
+
+    if dtype == "BF16":
+        return (arr.astype(np.uint32) << 16).view(np.float32)
+    return arr.astype(np.float32, copy=False)
+
+
+def _from_f32(arr, dtype):
+    import numpy as np
+
+    if dtype == "BF16":
+        # round to nearest even, nan stays nan
+        bits = arr.view(np.uint32)
+        rounded = (bits + 0x7FFF + ((bits >> 16) & 1)) >> 16
+        rounded = np.where(np.isnan(arr), (bits >> 16) | 0x40, rounded)
+        return rounded.astype(np.uint16)
+    if dtype == "F16":
+        return arr.astype(np.float16)
+    return arr.astype(np.float32, copy=False)
+
+
+def cast_chunks(raw, src, dst, chunk_bytes=CHUNK_BYTES):
+    """yield dst-typed bytes for a raw src-typed buffer, chunk by chunk."""
+    import numpy as np
+
+    if src == dst or src not in FLOAT_DTYPES or dst not in FLOAT_DTYPES:
+        for start in range(0, len(raw), chunk_bytes):
+            yield raw[start:start + chunk_bytes]
+        return
+    size = DTYPE_SIZES[src]
+    step = max(size, chunk_bytes // size * size)
+    for start in range(0, len(raw), step):
+        arr = np.frombuffer(raw[start:start + step], dtype=_np_dtype(src))
+        arr = arr.astype(np.float32) if src == "F64" else _to_f32(arr, src)
+        yield memoryview(np.ascontiguousarray(_from_f32(arr, dst))).cast("B")
+
+
+def target_dtype(src, dtype):
+    """dtype a tensor ends up as: floats are cast, everything else stays."""
+    if dtype is None or src not in FLOAT_DTYPES:
+        return src
+    return DTYPE_NAMES.get(dtype.lower(), dtype.upper())
+
+
+def convert_safetensors(src_path, dest_path, dtype=None, metadata=None):
+    """stream src into dest, casting float tensors. returns (sha256, bytes)."""
+    with Reader(src_path) as reader:
+        names = sorted(reader.keys(), key=lambda n: reader.info(n)["data_offsets"][0])
+        layout = [(n, target_dtype(reader.info(n)["dtype"], dtype), reader.info(n)["shape"]) for n in names]
+        meta = dict(reader.metadata)
+        meta.update(metadata or {})
+        writer = Writer(dest_path, layout, meta)
+        try:
+            for name, dst, _ in layout:
+                writer.write(name, cast_chunks(reader.raw(name), reader.info(name)["dtype"], dst))
+                reader.release(name)
+            digest = writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+    return digest, writer.size
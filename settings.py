@@ -0,0 +1,89 @@
+"""shared config.toml helpers
+
+the same config.toml is shipped into the containers, so every modal app
+(app.py, download_model.py, download_dataset.py) reads the same values.
+"""
+import logging
+from pathlib import Path
+
+import toml
+
+from config_schema import ConfigError, modal_resources, validate
+
+CONFIG_FILE = Path(__file__).parent / "config.toml"
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+
+def load_config(path=CONFIG_FILE) -> dict:
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return toml.load(path)
+
+
+def validated_config(path=CONFIG_FILE) -> dict:
+    """config.toml checked against config_schema, defaults filled in.
+
+    raises ConfigError on bad values instead of falling back, warnings
+    (unknown or deprecated keys) are only logged.
+    """
+    config, warnings = validate(load_config(path))
+    for warning in warnings:
+        logging.getLogger(__name__).warning("config.toml: %s", warning)
+    return config
+
+
+def resources(name: str, config: dict = None) -> dict:
+    """@app.function kwargs (gpu, cpu, memory, timeout, ...) of a [profiles.<name>]."""
+    if config is None:
+        config = validated_config()
+    profiles = config["profiles"]
+    if name not in profiles:
+        raise ConfigError(f"unknown resource profile: {name} (have {', '.join(sorted(profiles))})")
+    return modal_resources(profiles[name])
+
+
+def parallel_download_workers(config: dict = None) -> int:
+    """worker count for the download engine.
+
+    `[optimization] parallel_downloads` can be true/false or a number.
+    """
+    if config is None:
+        config = load_config()
+    value = config.get("optimization", {}).get("parallel_downloads", True)
+    if value is True:
+        return DEFAULT_DOWNLOAD_WORKERS
+    if value is False:
+        return 1
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return DEFAULT_DOWNLOAD_WORKERS
+
+
+def model_limits(config: dict = None):
+    """(max_models, max_bytes, cache_models) for the model registry, 0 = no limit."""
+    if config is None:
+        config = load_config()
+    kohya = config.get("kohya_settings", {})
+    max_models = int(kohya.get("max_models", 0) or 0)
+    max_bytes = int(float(kohya.get("max_models_gb", 0) or 0) * 1024 ** 3)
+    cache_models = bool(config.get("optimization", {}).get("cache_models", True))
+    return max_models, max_bytes, cache_models
+
+
+def sync_workers(config: dict = None):
+    """(start, max) workers for dataset_sync's adaptive controller.
+
+    starts at parallel_downloads, `[optimization] sync_max_workers` caps
+    how far it may ramp up before the hub pushes back.
+    """
+    if config is None:
+        config = load_config()
+    start = parallel_download_workers(config)
+    try:
+        maximum = int(config.get("optimization", {}).get("sync_max_workers", 32))
+    except (TypeError, ValueError):
+        maximum = 32
+    return start, max(start, maximum)
@@ -0,0 +1,263 @@
+"""packed dataset shards (webdataset style tar + offset index)
+
+a dataset dir with one file per image/caption becomes a few big tar files:
+
+    <out>/shard-00000.tar, shard-00001.tar, ...
+    <out>/index.json   {"shards": [...], "samples": {key: [shard, {ext: [offset, size]}]},
+                        "mtimes": {member: mtime_ns}}
+
+members are named `<key>.<ext>` (key = path without extension), so one
+sample's image, caption and npz sit next to each other. the shards are
+plain uncompressed tar, `tar xf` still works on them.
+
+ShardReader mmaps the shards and hands out memoryview slices straight
+from the page cache (no copy, no per-file open). expand() writes the
+shards back out as loose files, e.g. onto local ssd at container start.
+"""
+import json
+import mmap
+import os
+import tarfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_NAME = "index.json"
+SHARD_SIZE = 1024 * 1024 * 1024  # 1GB per shard
+
+
+def _samples(dataset_dir):
+    """{key: [(ext, path), ...]} for every file, grouped by path stem."""
+    samples = {}
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dataset_dir)
+            key, ext = os.path.splitext(rel)
+            samples.setdefault(key, []).append((ext.lstrip("."), path))
+    return samples
+
+
+def _member_name(key, ext):
+    return f"{key}.{ext}" if ext else key
+
+
+def _member_offsets(shard_path):
+    offsets = {}
+    with tarfile.open(shard_path, "r:") as tar:
+        for member in tar:
+            if member.isfile():
+                offsets[member.name] = (member.offset_data, member.size)
+    return offsets
+
+
+def pack(dataset_dir, out_dir, shard_size=SHARD_SIZE):
+    """pack a loose dataset dir into shards. returns the index."""
+    start = time.monotonic()
+    os.makedirs(out_dir, exist_ok=True)
+    samples = _samples(dataset_dir)
+
+    groups, current, current_size = [], [], 0
+    for key in sorted(samples):
+        size = sum(os.path.getsize(p) for _, p in samples[key])
+        if current and current_size + size > shard_size:
+            groups.append(current)
+            current, current_size = [], 0
+        current.append(key)
+        current_size += size
+    if current:
+        groups.append(current)
+
+    index = {"shards": [], "samples": {}, "mtimes": {}}
+    total = 0
+    for i, keys in enumerate(groups):
+        name = f"shard-{i:05d}.tar"
+        path = os.path.join(out_dir, name)
+        with tarfile.open(path + ".tmp", "w:", format=tarfile.GNU_FORMAT) as tar:
+            for key in keys:
+                for ext, file_path in samples[key]:
+                    info = tar.gettarinfo(file_path, arcname=_member_name(key, ext))
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with open(file_path, "rb") as f:
+                        tar.addfile(info, f)
+                    # tar keeps whole seconds, expand() restores the exact mtime
+                    index["mtimes"][info.name] = os.stat(file_path).st_mtime_ns
+        os.replace(path + ".tmp", path)
+        offsets = _member_offsets(path)
+        for key in keys:
+            index["samples"][key] = [
+                i, {ext: list(offsets[_member_name(key, ext)]) for ext, _ in samples[key]}
+            ]
+        size = os.path.getsize(path)
+        total += size
+        index["shards"].append({"name": name, "size": size, "samples": len(keys)})
+
+    # leftovers from an earlier, bigger pack
+    names = {s["name"] for s in index["shards"]}
+    for name in os.listdir(out_dir):
+        if name.startswith("shard-") and name.endswith(".tar") and name not in names:
+            os.remove(os.path.join(out_dir, name))
+
+    index["created"] = time.time()
+    index["source"] = os.path.abspath(dataset_dir)
+    with open(os.path.join(out_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f)
+    print(f"packed {len(samples)} samples into {len(groups)} shards "
+          f"({total / (1024 ** 2):.1f}MB) in {time.monotonic() - start:.1f}s")
+    return index
+
+
+class ShardReader:
+    """zero-copy sample access over mmapped shards."""
+
+    def __init__(self, shard_dir):
+        self.dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self._maps = {}
+
+    def _map(self, shard):
+        m = self._maps.get(shard)
+        if m is None:
+            path = os.path.join(self.dir, self.index["shards"][shard]["name"])
+            with open(path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = m
+        return m
+
+    def keys(self):
+        return self.index["samples"].keys()
+
+    def __len__(self):
+        return len(self.index["samples"])
+
+    def exts(self, key):
+        return list(self.index["samples"][key][1])
+
+    def get(self, key, ext):
+        """memoryview of one member, valid until close()."""
+        shard, members = self.index["samples"][key]
+        offset, size = members[ext]
+        return memoryview(self._map(shard))[offset:offset + size]
+
+    def sample(self, key):
+        return {ext: self.get(key, ext) for ext in self.exts(key)}
+
+    def close(self):
+        for m in self._maps.values():
+            try:
+                m.close()
+            except BufferError:
+                pass  # a caller still holds a view, gc will clean up
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _expand_shard(reader, shard, keys, dest_dir):
+    mtimes = reader.index.get("mtimes", {})
+    written = 0
+    for key in keys:
+        for ext in reader.exts(key):
+            data = reader.get(key, ext)
+            name = _member_name(key, ext)
+            path = os.path.join(dest_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            if name in mtimes:
+                # same mtime as the packed file, latent cache entries match without a rehash
+                os.utime(path, ns=(mtimes[name], mtimes[name]))
+            written += len(data)
+            data.release()
+    return written
+
+
+def expand(shard_dir, dest_dir, workers=8):
+    """write every sample back as loose files, one thread per shard."""
+    start = time.monotonic()
+    by_shard = {}
+    with ShardReader(shard_dir) as reader:
+        for key, (shard, _) in reader.index["samples"].items():
+            by_shard.setdefault(shard, []).append(key)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_expand_shard, reader, shard, keys, dest_dir)
+                for shard, keys in by_shard.items()
+            ]
+            written = sum(f.result() for f in futures)
+    seconds = max(time.monotonic() - start, 1e-6)
+    return {
+        "samples": sum(len(k) for k in by_shard.values()),
+        "bytes": written,
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(written / seconds / (1024 ** 2), 1),
+    }
+
+
+def _drop_page_cache(paths):
+    # best effort, so reads hit the disk/volume instead of ram
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.close(fd)
+        except (OSError, AttributeError):
+            pass
+
+
+def benchmark_roundtrip(dataset_dir, work_dir, shard_size=SHARD_SIZE):
+    """pack, read every sample both ways, expand. returns timings."""
+    shard_dir = os.path.join(work_dir, "shards")
+    expand_dir = os.path.join(work_dir, "expanded")
+    report = {}
+
+    start = time.monotonic()
+    index = pack(dataset_dir, shard_dir, shard_size)
+    report["pack_s"] = round(time.monotonic() - start, 3)
+
+    samples = _samples(dataset_dir)
+    loose = [p for files in samples.values() for _, p in files]
+    _drop_page_cache(loose)
+    start = time.monotonic()
+    loose_bytes = 0
+    for path in loose:
+        with open(path, "rb") as f:
+            data = f.read()
+        zlib.crc32(data)  # touch every byte, same as the shard side
+        loose_bytes += len(data)
+    loose_s = max(time.monotonic() - start, 1e-6)
+
+    _drop_page_cache([os.path.join(shard_dir, s["name"]) for s in index["shards"]])
+    start = time.monotonic()
+    shard_bytes = 0
+    with ShardReader(shard_dir) as reader:
+        for key in reader.keys():
+            for ext in reader.exts(key):
+                view = reader.get(key, ext)
+                zlib.crc32(view)
+                shard_bytes += len(view)
+                view.release()
+    shard_s = max(time.monotonic() - start, 1e-6)
+
+    report.update(
+        files=len(loose),
+        samples=len(samples),
+        shards=len(index["shards"]),
+        loose_read_s=round(loose_s, 3),
+        loose_files_per_s=round(len(loose) / loose_s, 1),
+        loose_mb_per_s=round(loose_bytes / loose_s / (1024 ** 2), 1),
+        shard_read_s=round(shard_s, 3),
+        shard_files_per_s=round(len(loose) / shard_s, 1),
+        shard_mb_per_s=round(shard_bytes / shard_s / (1024 ** 2), 1),
+        expand=expand(shard_dir, expand_dir),
+    )
+    return report
@@ -0,0 +1,165 @@
+"""stage the dataset volume onto local disk
+
+the gui container mounts kohya-dataset at /mnt/kohya-dataset, but kohya
+and DATASET_PATH look at /kohya_ss/dataset on the container's own disk.
+stage() copies (or hardlinks, when both sides share a filesystem) the
+active datasets (all, or selected subfolders) across in parallel, checks
+every copied file against the source size, and keeps
+`<dest>/.staging_manifest.json` so a restage only moves what changed and
+drops what was deleted on the volume.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = ".staging_manifest.json"
+# store internals and other function outputs that training never reads
+SKIP_DIRS = {".blobs", ".shards", ".quarantine", ".cache"}
+
+status = {"state": "idle"}
+_lock = threading.Lock()
+
+
+def _set_status(**kwargs):
+    with _lock:
+        status.update(kwargs)
+
+
+def get_status():
+    with _lock:
+        return dict(status)
+
+
+def scan(src_root, subdirs=None):
+    """{relpath: [size, mtime_ns]} under src_root (or the given subfolders)."""
+    roots = [os.path.join(src_root, s) for s in subdirs] if subdirs else [src_root]
+    found = {}
+    for top in roots:
+        if not os.path.isdir(top):
+            print(f"staging: {top} not found, skipped")
+            continue
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            for name in files:
+                if name.endswith((".incomplete", ".partial", ".tmp")):
+                    continue
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                found[os.path.relpath(path, src_root)] = [st.st_size, st.st_mtime_ns]
+    return found
+
+
+def _load_manifest(dest_root):
+    try:
+        with open(os.path.join(dest_root, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def _copy(src, dest, size, link=False, mtime_ns=None):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = dest + ".staging"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if link:
+        os.link(src, tmp)
+    else:
+        shutil.copyfile(src, tmp)
+    if os.path.getsize(tmp) != size:
+        os.remove(tmp)
+        raise OSError(f"size mismatch after copy: {src}")
+    if not link and mtime_ns is not None:
+        # keep the source mtime, the latent cache then trusts (size, mtime) without hashing
+        os.utime(tmp, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp, dest)
+    return size
+
+
+def stage(src_root, dest_root, subdirs=None, workers=16):
+    """sync src_root into dest_root. returns bytes/s and time-to-ready."""
+    start = time.monotonic()
+    _set_status(state="scanning", started=time.time(), src=src_root, dest=dest_root)
+    os.makedirs(dest_root, exist_ok=True)
+
+    source = scan(src_root, subdirs)
+    manifest = _load_manifest(dest_root)
+    staged = manifest["files"]
+
+    todo = []
+    for rel, sig in source.items():
+        dest = os.path.join(dest_root, rel)
+        if staged.get(rel) == sig and os.path.exists(dest) and os.path.getsize(dest) == sig[0]:
+            continue
+        todo.append(rel)
+
+    removed = [rel for rel in staged if rel not in source]
+    for rel in removed:
+        path = os.path.join(dest_root, rel)
+        if os.path.exists(path):
+            os.remove(path)
+        del staged[rel]
+
+    # hardlinks only when both sides are one filesystem (never volume -> local)
+    link = os.stat(src_root).st_dev == os.stat(dest_root).st_dev
+    total = sum(source[rel][0] for rel in todo)
+    _set_status(state="copying", files=len(todo), bytes_total=total, bytes_done=0)
+    copied, errors = 0, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                _copy, os.path.join(src_root, rel), os.path.join(dest_root, rel), source[rel][0], link,
+                source[rel][1],
+            ): rel
+            for rel in todo
+        }
+        for future, rel in futures.items():
+            try:
+                copied += future.result()
+                staged[rel] = source[rel]
+                _set_status(bytes_done=copied)
+            except OSError as e:
+                errors[rel] = str(e)
+
+    manifest["files"] = staged
+    manifest["updated"] = time.time()
+    with open(os.path.join(dest_root, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+
+    seconds = max(time.monotonic() - start, 1e-6)
+    report = {
+        "files": len(source),
+        "copied": len(todo) - len(errors),
+        "unchanged": len(source) - len(todo),
+        "removed": len(removed),
+        "errors": errors,
+        "bytes": copied,
+        "seconds_to_ready": round(seconds, 2),
+        "mb_per_s": round(copied / seconds / (1024 ** 2), 1),
+    }
+    print(
+        f"staging: {report['copied']} files ({copied / (1024 ** 2):.1f}MB) in "
+        f"{report['seconds_to_ready']}s, {report['mb_per_s']} MB/s, "
+        f"{report['unchanged']} unchanged, {len(removed)} removed"
+    )
+    _set_status(state="ready" if not errors else "ready_with_errors", report=report)
+    return report
+
+
+def stage_in_background(src_root, dest_root, subdirs=None, after=None):
+    """run stage() (then after()) in a thread so the gui port opens meanwhile."""
+    def run():
+        try:
+            stage(src_root, dest_root, subdirs)
+            if after is not None:
+                after()
+        except Exception as e:
+            print(f"staging failed: {e}")
+            _set_status(state="failed", error=str(e))
+
+    thread = threading.Thread(target=run, daemon=True, name="dataset-staging")
+    thread.start()
+    return thread
@@ -0,0 +1,186 @@
+"""hyperparameter sweeps over a kohya toml config
+
+a spec is either a grid (every combination) or a random search:
+
+    {"grid": {"learning_rate": [1e-4, 5e-4], "network_dim": [16, 32]}}
+    {"random": {"learning_rate": {"min": 1e-5, "max": 1e-3, "log": true},
+                "network_dim": [8, 16, 32]},
+     "trials": 8, "seed": 0}
+
+expand() turns it into per-trial overrides, write_trials() writes one toml
+per trial under `<configs>/sweeps/<sweep_id>/` with its own output_dir /
+output_name / logging_dir, and collect() builds the results table (final
+loss from the trainer log, saved files) once the trials ran.
+"""
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import re
+import time
+
+import toml
+
+# sd-scripts' progress bar: "steps: 100%|###| 1000/1000 [.., avr_loss=0.0912]"
+LOSS_RE = re.compile(r"avr_loss=([0-9.]+(?:[eE][-+]?[0-9]+)?)")
+MODEL_EXTS = (".safetensors", ".ckpt", ".pt")
+
+
+def expand(spec):
+    """list of {param: value} overrides, one per trial."""
+    if "grid" in spec and "random" in spec:
+        raise ValueError("spec needs either grid or random, not both")
+    if "grid" in spec:
+        keys = sorted(spec["grid"])
+        values = [v if isinstance(v, list) else [v] for v in (spec["grid"][k] for k in keys)]
+        return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    if "random" in spec:
+        rng = random.Random(spec.get("seed"))
+        return [
+            {key: _sample(rng, space) for key, space in sorted(spec["random"].items())}
+            for _ in range(int(spec.get("trials", 8)))
+        ]
+    raise ValueError("spec needs a grid or random section")
+
+
+def _sample(rng, space):
+    if isinstance(space, list):
+        return rng.choice(space)
+    if not isinstance(space, dict):
+        return space
+    low, high = space["min"], space["max"]
+    if space.get("log"):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    if space.get("int") or (isinstance(low, int) and isinstance(high, int)):
+        return int(round(value))
+    return float(f"{value:.6g}")
+
+
+def _set(config, key, value):
+    # dotted keys reach into toml tables, e.g. "optimizer_args.weight_decay"
+    *parents, leaf = key.split(".")
+    for part in parents:
+        config = config.setdefault(part, {})
+    config[leaf] = value
+
+
+def write_trials(base_path, spec, configs_dir, output_root, sweep_id=None):
+    """write the trial tomls, returns the sweep description (also saved as sweep.json)."""
+    base = toml.load(base_path)
+    sweep_id = sweep_id or time.strftime("sweep-%Y%m%d-%H%M%S")
+    sweep_dir = os.path.join(configs_dir, "sweeps", sweep_id)
+    os.makedirs(sweep_dir, exist_ok=True)
+    base_name = base.get("output_name") or os.path.splitext(os.path.basename(base_path))[0]
+
+    trials = []
+    for i, overrides in enumerate(expand(spec)):
+        name = f"trial-{i:03d}"
+        config = json.loads(json.dumps(base))  # deep copy
+        for key, value in overrides.items():
+            _set(config, key, value)
+        output_dir = os.path.join(output_root, "sweeps", sweep_id, name)
+        config["output_dir"] = output_dir
+        config["output_name"] = f"{base_name}-{name}"
+        config["logging_dir"] = os.path.join(output_dir, "logs")
+        path = os.path.join(sweep_dir, f"{name}.toml")
+        with open(path, "w") as f:
+            toml.dump(config, f)
+        trials.append({
+            "id": f"{sweep_id}-{name}",
+            "name": name,
+            "config": os.path.relpath(path, configs_dir),
+            "overrides": overrides,
+            "output_dir": output_dir,
+        })
+
+    sweep = {"id": sweep_id, "base": base_path, "spec": spec, "created": time.time(), "trials": trials}
+    with open(os.path.join(sweep_dir, "sweep.json"), "w") as f:
+        json.dump(sweep, f, indent=2)
+    return sweep
+
+
+def final_loss(log_path):
+    """last avr_loss the trainer printed, None if it never got that far."""
+    try:
+        with open(log_path, errors="replace") as f:
+            matches = LOSS_RE.findall(f.read())
+    except OSError:
+        return None
+    return float(matches[-1]) if matches else None
+
+
+def saved_models(output_dir):
+    if not os.path.isdir(output_dir):
+        return []
+    return sorted(
+        os.path.join(output_dir, name)
+        for name in os.listdir(output_dir)
+        if name.endswith(MODEL_EXTS)
+    )
+
+
+def collect(sweep, results):
+    """one row per trial, best (lowest final loss) first."""
+    rows = []
+    for trial, result in zip(sweep["trials"], results):
+        if isinstance(result, Exception) or not isinstance(result, dict):
+            result = {"returncode": -1, "error": str(result)}
+        rows.append({
+            "trial": trial["name"],
+            **trial["overrides"],
+            "status": "ok" if result.get("returncode") == 0 else "failed",
+            "final_loss": final_loss(result["log"]) if result.get("log") else None,
+            "seconds": result.get("seconds"),
+            "outputs": saved_models(trial["output_dir"]),
+            "log": result.get("log"),
+            "error": result.get("error"),
+        })
+    rows.sort(key=lambda r: (r["final_loss"] is None, r["final_loss"] or 0.0))
+    return rows
+
+
+def write_table(rows, out_dir):
+    """results.json and results.csv in out_dir, returns the csv path."""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "results.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+    columns = []
+    for row in rows:
+        columns += [k for k in row if k not in columns]
+    path = os.path.join(out_dir, "results.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "outputs": ";".join(row["outputs"])})
+    return path
+
+
+def shared_inputs(base_path, dataset_root, cache_root, store=None):
+    """model, dataset and latent caches every trial uses, resolved once.
+
+    the trials get the cache params directly instead of fingerprinting the
+    model and scanning every cache dir again in each container.
+    """
+    from latent_cache import find_caches, model_fingerprint
+
+    base = toml.load(base_path)
+    shared = {"model": base.get("pretrained_model_name_or_path"), "dataset": None, "caches": {}}
+    train_data_dir = base.get("train_data_dir")
+    if train_data_dir and os.path.abspath(train_data_dir).startswith(os.path.abspath(dataset_root) + os.sep):
+        shared["dataset"] = os.path.relpath(train_data_dir, dataset_root).split(os.sep)[0]
+
+    if shared["model"] and os.path.exists(shared["model"]):
+        shared["fingerprint"] = model_fingerprint(shared["model"], store)
+        if shared["dataset"]:
+            dataset_dir = os.path.join(dataset_root, shared["dataset"])
+            for kind in ("latents", "te"):
+                for cache in find_caches(cache_root, shared["dataset"], kind, dataset_dir):
+                    if cache.params.get("model") == shared["fingerprint"]:
+                        shared["caches"][kind] = cache.params
+                        break
+    return shared
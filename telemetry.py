@@ -0,0 +1,488 @@
+"""gpu / training telemetry for the gui container
+
+a Sampler thread polls the gpus (NVML, nvidia-smi as fallback, or a fake
+backend for local runs) and the trainer's progress, and keeps the samples
+in a ring buffer. serve() exposes them on their own port:
+
+    /metrics   prometheus text format, latest sample
+    /history   json ring buffer (?since=<epoch s>&limit=<n>)
+    /summary   averages over the last minute and a gpu/input bound verdict
+
+trainer progress comes from its output: capture_output() tees the
+process' stdout and stderr (inherited by the `accelerate launch` the gui
+starts) through pipes into a log file and a LogParser, which picks step,
+total, it/s, loss and epoch out of sd-scripts' tqdm lines.
+"""
+import json
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_INTERVAL = 2.0
+DEFAULT_HISTORY = 1800  # samples, an hour at 2s
+# no progress line for this long = not training
+ACTIVE_WINDOW = 30
+LOG_MAX_BYTES = 64 * 1024 * 1024
+
+# "steps:  12%|#2   | 120/1000 [01:23<10:12,  1.44it/s, avr_loss=0.0912]"
+PROGRESS_RE = re.compile(r"(\d+)/(\d+) \[[^\]<]*<[^,\]]*,\s*([0-9.]+)(it/s|s/it)")
+LOSS_RE = re.compile(r"(?:avr_)?loss=([0-9.]+(?:[eE][-+]?[0-9]+)?)")
+EPOCH_RE = re.compile(r"epoch (\d+)/(\d+)")
+
+
+# ---------- gpu backends ----------
+
+class NvmlBackend:
+    name = "nvml"
+
+    def __init__(self):
+        import pynvml
+
+        pynvml.nvmlInit()
+        self._nvml = pynvml
+        self._handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def sample(self):
+        nvml = self._nvml
+        gpus = []
+        for i, handle in enumerate(self._handles):
+            util = nvml.nvmlDeviceGetUtilizationRates(handle)
+            mem = nvml.nvmlDeviceGetMemoryInfo(handle)
+            name = nvml.nvmlDeviceGetName(handle)
+            try:
+                power = nvml.nvmlDeviceGetPowerUsage(handle) / 1000
+            except nvml.NVMLError:
+                power = None
+            gpus.append({
+                "index": i,
+                "name": name.decode() if isinstance(name, bytes) else name,
+                "util": util.gpu,
+                "mem_util": util.memory,
+                "mem_used_mb": mem.used // (1024 ** 2),
+                "mem_total_mb": mem.total // (1024 ** 2),
+                "temp_c": nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU),
+                "power_w": power,
+            })
+        return gpus
+
+
+class SmiBackend:
+    name = "nvidia-smi"
+    FIELDS = "index,name,utilization.gpu,utilization.memory,memory.used,memory.total,temperature.gpu,power.draw"
+
+    def __init__(self):
+        self.sample()  # fail here, not in the sampler thread
+
+    def sample(self):
+        out = subprocess.run(
+            ["nvidia-smi", f"--query-gpu={self.FIELDS}", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout
+
+        def num(value):
+            try:
+                return float(value)
+            except ValueError:
+                return None  # "[N/A]"
+
+        gpus = []
+        for line in out.strip().splitlines():
+            index, name, util, mem_util, used, total, temp, power = [v.strip() for v in line.split(",")]
+            gpus.append({
+                "index": int(index), "name": name, "util": num(util), "mem_util": num(mem_util),
+                "mem_used_mb": num(used), "mem_total_mb": num(total), "temp_c": num(temp), "power_w": num(power),
+            })
+        return gpus
+
+
+class FakeBackend:
+    """deterministic gpus for local runs; util follows util_fn(t) if given."""
+    name = "fake"
+
+    def __init__(self, gpus=1, util_fn=None):
+        self.gpus = gpus
+        self.util_fn = util_fn or (lambda t: 70 + 25 * math.sin(t / 10))
+        self._start = time.monotonic()
+
+    def sample(self):
+        t = time.monotonic() - self._start
+        util = max(0, min(100, round(self.util_fn(t))))
+        return [{
+            "index": i, "name": "Fake GPU", "util": util, "mem_util": util // 2,
+            "mem_used_mb": 12000 + 100 * i, "mem_total_mb": 24576, "temp_c": 60, "power_w": 150.0,
+        } for i in range(self.gpus)]
+
+
+class NullBackend:
+    name = "none"
+
+    def sample(self):
+        return []
+
+
+def gpu_backend(name="auto"):
+    """backend by name; auto tries nvml, then nvidia-smi, then no gpus."""
+    if name == "fake":
+        return FakeBackend()
+    candidates = {"nvml": [NvmlBackend], "nvidia-smi": [SmiBackend]}.get(name, [NvmlBackend, SmiBackend])
+    for backend in candidates:
+        try:
+            return backend()
+        except Exception as e:
+            print(f"telemetry: {backend.name} unavailable: {e}")
+    return NullBackend()
+
+
+def cpu_times():
+    with open("/proc/stat") as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields), idle
+
+
+# ---------- trainer output ----------
+
+class LogParser:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partial = ""
+        self.state = {"step": None, "total": None, "it_per_s": None, "loss": None,
+                      "epoch": None, "epochs": None, "last_progress": None, "lines": 0}
+
+    def feed(self, text):
+        # tqdm redraws with \r, every redraw is a line for us
+        text = self._partial + text
+        parts = re.split(r"[\r\n]", text)
+        self._partial = parts.pop()
+        for line in parts:
+            if line:
+                self.line(line)
+
+    def line(self, line, now=None):
+        with self._lock:
+            self.state["lines"] += 1
+            progress = PROGRESS_RE.search(line)
+            if progress:
+                step, total, rate, unit = progress.groups()
+                rate = float(rate)
+                self.state.update(
+                    step=int(step), total=int(total),
+                    it_per_s=rate if unit == "it/s" else (1 / rate if rate else None),
+                    last_progress=now or time.time(),
+                )
+            loss = LOSS_RE.search(line)
+            if loss:
+                self.state["loss"] = float(loss.group(1))
+            epoch = EPOCH_RE.search(line)
+            if epoch:
+                self.state["epoch"], self.state["epochs"] = int(epoch.group(1)), int(epoch.group(2))
+
+    def snapshot(self, now=None):
+        with self._lock:
+            state = dict(self.state)
+        last = state["last_progress"]
+        state["active"] = bool(last and (now or time.time()) - last < ACTIVE_WINDOW)
+        return state
+
+
+class LogTail:
+    """follow a log file into a parser (e.g. a headless job's .train_logs)."""
+
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self.offset = 0
+
+    def poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.offset:
+            self.offset = 0  # truncated / rotated
+        with open(self.path, errors="replace") as f:
+            f.seek(self.offset)
+            text = f.read()
+            self.offset = f.tell()
+        self.parser.feed(text)
+        return len(text)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def capture_output(log_path, on_text):
+    """tee fd 1 and fd 2 (and every child that inherits them) into log_path and on_text.
+
+    each fd gets its own pipe and goes back to its original target, so
+    modal still shows stdout and stderr apart. the pump threads keep
+    draining even when a write fails; a stuck pipe would block every
+    print in the gui and the trainer.
+    """
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    lock = threading.Lock()
+    log = [open(log_path, "ab")]
+
+    def record(data):
+        with lock:
+            log[0].write(data)
+            log[0].flush()
+            if log[0].tell() > LOG_MAX_BYTES:
+                log[0].close()
+                os.replace(log_path, log_path + ".1")
+                log[0] = open(log_path, "ab")
+        on_text(data.decode(errors="replace"))
+
+    def pump(read_fd, original):
+        while True:
+            try:
+                data = os.read(read_fd, 65536)
+            except OSError:
+                break
+            if not data:
+                break
+            try:
+                _write_all(original, data)
+            except OSError:
+                pass  # original target gone, still drain the pipe
+            try:
+                record(data)
+            except Exception:
+                pass  # never block the writers because of us
+
+    for fd in (1, 2):
+        read_fd, write_fd = os.pipe()
+        original = os.dup(fd)
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+        threading.Thread(target=pump, args=(read_fd, original), daemon=True, name=f"telemetry-tee-{fd}").start()
+
+
+# ---------- sampler ----------
+
+class Sampler:
+    def __init__(self, backend=None, parser=None, interval=DEFAULT_INTERVAL, history=DEFAULT_HISTORY, tails=()):
+        self.backend = backend or NullBackend()
+        self.parser = parser or LogParser()
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.tails = list(tails)
+        self.errors = 0
+        self.started = time.time()
+        self._cpu = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _cpu_percent(self):
+        try:
+            total, idle = cpu_times()
+        except OSError:
+            return None
+        previous, self._cpu = self._cpu, (total, idle)
+        if previous is None or total == previous[0]:
+            return None
+        return round(100 * (1 - (idle - previous[1]) / (total - previous[0])), 1)
+
+    def sample_once(self, now=None):
+        now = now or time.time()
+        for tail in self.tails:
+            tail.poll()
+        try:
+            gpus = self.backend.sample()
+        except Exception as e:
+            self.errors += 1
+            print(f"telemetry: gpu sample failed: {e}")
+            gpus = []
+        sample = {
+            "time": now,
+            "gpus": gpus,
+            "cpu_percent": self._cpu_percent(),
+            "train": self.parser.snapshot(now),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="telemetry-sampler")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def history(self, since=None, limit=None):
+        samples = [s for s in list(self.samples) if since is None or s["time"] > since]
+        return samples[-limit:] if limit else samples
+
+    def summary(self, window=60):
+        """averages over the last window seconds, and whether training is gpu or input bound.
+
+        while steps are coming in, gpu idle time is time the trainer
+        spends waiting on something else, mostly the dataloader.
+        """
+        latest = self.latest()
+        if latest is None:
+            return {"samples": 0}
+        recent = [s for s in self.samples if s["time"] >= latest["time"] - window]
+        utils = [g["util"] for s in recent for g in s["gpus"] if g.get("util") is not None]
+        training = [s for s in recent if s["train"]["active"]]
+        train_utils = [g["util"] for s in training for g in s["gpus"] if g.get("util") is not None]
+        cpus = [s["cpu_percent"] for s in recent if s["cpu_percent"] is not None]
+        report = {
+            "samples": len(recent),
+            "window_s": window,
+            "backend": self.backend.name,
+            "gpu_util_avg": round(sum(utils) / len(utils), 1) if utils else None,
+            "cpu_percent_avg": round(sum(cpus) / len(cpus), 1) if cpus else None,
+            "train": latest["train"],
+            "bound": None,
+            "input_stall_ratio": None,
+        }
+        if train_utils:
+            busy = sum(train_utils) / len(train_utils)
+            report["input_stall_ratio"] = round(1 - busy / 100, 3)
+            report["bound"] = "gpu" if busy >= 80 else "input" if busy < 50 else "mixed"
+        return report
+
+    def prometheus(self):
+        latest = self.latest()
+        out = []
+
+        def metric(name, kind, help_text, values):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                if value is None:
+                    continue
+                label = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                out.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+
+        gpus = latest["gpus"] if latest else []
+        lab = [{"gpu": str(g["index"]), "name": g["name"]} for g in gpus]
+        metric("kohya_gpu_utilization_percent", "gauge", "gpu utilization",
+               [(l, g["util"]) for l, g in zip(lab, gpus)])
+        metric("kohya_gpu_memory_utilization_percent", "gauge", "gpu memory controller utilization",
+               [(l, g["mem_util"]) for l, g in zip(lab, gpus)])
+        metric("kohya_gpu_memory_used_bytes", "gauge", "vram in use",
+               [(l, _mb(g["mem_used_mb"])) for l, g in zip(lab, gpus)])
+        metric("kohya_gpu_memory_total_bytes", "gauge", "vram total",
+               [(l, _mb(g["mem_total_mb"])) for l, g in zip(lab, gpus)])
+        metric("kohya_gpu_temperature_celsius", "gauge", "gpu temperature",
+               [(l, g["temp_c"]) for l, g in zip(lab, gpus)])
+        metric("kohya_gpu_power_watts", "gauge", "gpu power draw",
+               [(l, g["power_w"]) for l, g in zip(lab, gpus)])
+        metric("kohya_cpu_percent", "gauge", "container cpu utilization",
+               [({}, latest["cpu_percent"] if latest else None)])
+
+        train = latest["train"] if latest else {}
+        metric("kohya_train_active", "gauge", "1 while trainer progress lines keep coming",
+               [({}, int(bool(train.get("active"))))])
+        metric("kohya_train_step", "gauge", "current step", [({}, train.get("step"))])
+        metric("kohya_train_total_steps", "gauge", "total steps", [({}, train.get("total"))])
+        metric("kohya_train_iterations_per_second", "gauge", "trainer it/s", [({}, train.get("it_per_s"))])
+        metric("kohya_train_loss", "gauge", "last (average) loss", [({}, train.get("loss"))])
+        metric("kohya_train_epoch", "gauge", "current epoch", [({}, train.get("epoch"))])
+        summary = self.summary()
+        metric("kohya_input_stall_ratio", "gauge", "share of training time the gpu sat idle (last 60s)",
+               [({}, summary.get("input_stall_ratio"))])
+        metric("kohya_telemetry_samples_total", "counter", "samples taken",
+               [({}, len(self.samples))])
+        metric("kohya_telemetry_errors_total", "counter", "failed gpu samples", [({}, self.errors)])
+        return "\n".join(out) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _mb(value):
+    return None if value is None else int(value * 1024 ** 2)
+
+
+# ---------- http ----------
+
+def serve(sampler, port, routes=None, host="0.0.0.0"):
+    """metrics server in a daemon thread. routes: {path: fn(query) -> (status, type, body)}."""
+    handlers = {
+        "/metrics": lambda q: (200, "text/plain; version=0.0.4", sampler.prometheus()),
+        "/history": lambda q: (200, "application/json", json.dumps(sampler.history(
+            since=float(q["since"][0]) if "since" in q else None,
+            limit=int(q["limit"][0]) if "limit" in q else None,
+        ))),
+        "/summary": lambda q: (200, "application/json", json.dumps(sampler.summary())),
+    }
+    handlers.update(routes or {})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            handler = handlers.get(url.path.rstrip("/") or "/")
+            if handler is None:
+                status, kind, body = 404, "text/plain", "not found\n"
+            else:
+                try:
+                    status, kind, body = handler(parse_qs(url.query))
+                except Exception as e:
+                    status, kind, body = 500, "text/plain", f"{e}\n"
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass  # scrapes every few seconds would flood the modal logs
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="telemetry-http").start()
+    return server
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="telemetry server, e.g. with --fake outside modal")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--backend", default="auto", choices=["auto", "nvml", "nvidia-smi", "fake"])
+    parser.add_argument("--fake", action="store_true", help="same as --backend fake")
+    parser.add_argument("--log", action="append", default=[], help="trainer log to follow")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    args = parser.parse_args(argv)
+
+    log_parser = LogParser()
+    sampler = Sampler(
+        gpu_backend("fake" if args.fake else args.backend), log_parser,
+        interval=args.interval, tails=[LogTail(path, log_parser) for path in args.log],
+    ).start()
+    serve(sampler, args.port)
+    print(f"telemetry on http://127.0.0.1:{args.port}/metrics ({sampler.backend.name})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sampler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import json
+import os
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import captioner
+from captioner import DummyModel, caption_dataset, run_pipeline
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    root = tmp_path / "dataset"
+    (root / "sub").mkdir(parents=True)
+    (root / ".cache").mkdir()
+    rng = random.Random(0)
+    for i in range(10):
+        (root / f"img_{i:02d}.jpg").write_bytes(rng.randbytes(1024))
+    (root / "sub" / "img_10.png").write_bytes(rng.randbytes(1024))
+    (root / ".cache" / "hidden.jpg").write_bytes(b"not part of the dataset")
+    (root / "img_00.txt").write_text("already captioned")
+    return str(root)
+
+
+def model():
+    return DummyModel(seconds_per_batch=0, seconds_per_image=0, image_size=8, decode_s=0)
+
+
+def captions(root):
+    return sorted(os.path.relpath(os.path.join(d, n), root) for d, _, names in os.walk(root)
+                  for n in names if n.endswith(".txt"))
+
+
+def test_pipeline_batches_and_collects_errors():
+    batches = []
+    jobs = [(i, "x" * i) for i in range(7)] + [("bad", 5)]
+    stats, errors = run_pipeline(jobs, len, lambda items: [n * 2 for n in items],
+                                 batch_size=3, workers=2, prefetch=1, on_batch=batches.append)
+    assert stats["items"] == 7
+    assert stats["batches"] == 3
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert sorted(out for b in batches for out in b) == sorted((i, i * 2) for i in range(7))
+    assert list(errors) == ["bad"]
+    assert errors["bad"].startswith("TypeError")
+
+
+def test_skips_captioned_and_resumes(dataset):
+    first = caption_dataset(dataset, model(), batch_size=4, workers=2, prefix="sks, ", limit=6)
+    assert first["todo"] == 10
+    assert first["captioned"] == 6
+    assert first["remaining"] == 4
+    assert first["batches"] == 2
+
+    second = caption_dataset(dataset, model(), batch_size=4, workers=2, prefix="sks, ")
+    assert second["todo"] == 4
+    assert second["captioned"] == 4
+    assert captions(dataset) == [f"img_{i:02d}.txt" for i in range(10)] + [os.path.join("sub", "img_10.txt")]
+    with open(os.path.join(dataset, "img_00.txt")) as f:
+        assert f.read() == "already captioned"
+    with open(os.path.join(dataset, "img_03.txt")) as f:
+        assert f.read().startswith("sks, dummy, brightness ")
+
+    assert caption_dataset(dataset, model(), batch_size=4, workers=2)["todo"] == 0
+    assert not os.path.exists(os.path.join(dataset, captioner.MANIFEST_NAME))
+
+
+def test_overwrite_keeps_a_manifest(dataset):
+    first = caption_dataset(dataset, model(), batch_size=4, workers=2, overwrite=True, limit=5)
+    assert first["captioned"] == 5
+    with open(os.path.join(dataset, captioner.MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest["model"] == model().key
+    assert len(manifest["done"]) == 5
+
+    # the rerun does the other six, the captioned image included
+    second = caption_dataset(dataset, model(), batch_size=4, workers=2, overwrite=True)
+    assert second["todo"] == 6
+    with open(os.path.join(dataset, "img_00.txt")) as f:
+        assert f.read().startswith("dummy, brightness ")
+    with open(os.path.join(dataset, captioner.MANIFEST_NAME)) as f:
+        assert len(json.load(f)["done"]) == 11
+
+    # another model starts over
+    other = DummyModel(seconds_per_batch=0.001, seconds_per_image=0, image_size=8, decode_s=0)
+    assert caption_dataset(dataset, other, batch_size=4, workers=2, overwrite=True)["todo"] == 11
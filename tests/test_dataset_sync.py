@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from blobstore import BlobStore
+from dataset_sync import FakeHub, store_hooks, sync
+
+
+@pytest.fixture
+def hub(tmp_path, monkeypatch):
+    repo = tmp_path / "hub" / "me" / "images"
+    repo.mkdir(parents=True)
+    for i in range(20):
+        (repo / f"img_{i:02d}.jpg").write_bytes(os.urandom(2048 + i))
+        (repo / f"img_{i:02d}.txt").write_text(f"caption {i}")
+    server = FakeHub(str(tmp_path / "hub")).start()
+    monkeypatch.setenv("HF_ENDPOINT", server.url)
+    yield repo, server
+    server.stop()
+
+
+def test_incremental_sync(hub, tmp_path):
+    repo, _ = hub
+    dest = str(tmp_path / "dataset")
+    first = sync("me/images", dest, max_workers=4)
+    assert first["status"] == "done"
+    assert first["fetched"] == 40
+    assert (tmp_path / "dataset" / "img_03.txt").read_text() == "caption 3"
+
+    again = sync("me/images", dest)
+    assert again["status"] == "up_to_date"
+    assert again["fetched"] == 0
+
+    (repo / "img_03.txt").write_text("better caption")
+    (repo / "img_04.jpg").unlink()
+    (repo / "new.txt").write_text("new")
+    changed = sync("me/images", dest)
+    assert changed["fetched"] == 2
+    assert changed["deleted"] == 1
+    assert changed["unchanged"] == 38
+    assert (tmp_path / "dataset" / "img_03.txt").read_text() == "better caption"
+    assert not (tmp_path / "dataset" / "img_04.jpg").exists()
+
+
+def test_patterns_filter(hub, tmp_path):
+    report = sync("me/images", str(tmp_path / "dataset"), patterns=["*.txt"])
+    assert report["fetched"] == 20
+    assert not any(name.endswith(".jpg") for name in os.listdir(tmp_path / "dataset"))
+
+
+def test_throttling_and_errors_still_complete(tmp_path, monkeypatch):
+    repo = tmp_path / "hub" / "me" / "images"
+    repo.mkdir(parents=True)
+    for i in range(40):
+        (repo / f"img_{i:02d}.jpg").write_bytes(os.urandom(1024))
+    server = FakeHub(str(tmp_path / "hub"), max_concurrent=3, error_rate=0.05, retry_after=0.01).start()
+    monkeypatch.setenv("HF_ENDPOINT", server.url)
+    try:
+        report = sync("me/images", str(tmp_path / "dataset"), start_workers=8, max_workers=16)
+    finally:
+        server.stop()
+    assert report["status"] == "done"
+    assert report["fetched"] == 40
+    assert report["workers"]["throttles"] > 0
+
+
+def test_store_hooks_link_known_content(hub, tmp_path):
+    commits = []
+    root = tmp_path / "volume"
+    store = BlobStore(str(root))
+    hooks = store_hooks(store, "hf:me/images", commit=lambda: commits.append(1), commit_every=0)
+    first = sync("me/images", str(root / "a"), patterns=["*.jpg"], **hooks)
+    store.save()
+    assert first["fetched"] == 20
+
+    # same repo into another folder: everything comes from the store
+    second = sync("me/images", str(root / "b"), patterns=["*.jpg"], **store_hooks(BlobStore(str(root)), "hf:me/images"))
+    assert second["linked"] == 20
+    assert second["fetched"] == 0
+    assert (root / "a" / "img_05.jpg").read_bytes() == (root / "b" / "img_05.jpg").read_bytes()
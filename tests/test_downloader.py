@@ -0,0 +1,112 @@
+import os
+import random
+
+import pytest
+
+import downloader
+from downloader import DownloadTask, RangeServer, download_files
+
+SIZE = 300 * 1024
+CHUNK = 64 * 1024
+
+
+@pytest.fixture
+def hub(tmp_path):
+    root = tmp_path / "hub"
+    root.mkdir()
+    data = random.Random(0).randbytes(SIZE)
+    (root / "model.safetensors").write_bytes(data)
+    return str(root), data
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+
+
+def fetch(server, tmp_path, **kwargs):
+    dest = str(tmp_path / "models" / "model.safetensors")
+    task = DownloadTask(f"{server.url}/model.safetensors", dest)
+    results, summary = download_files([task], workers=4, chunk_size=CHUNK, **kwargs)
+    return dest, results, summary
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def ranges(server):
+    return [r for method, _, r in server.requests if method == "GET" and r]
+
+
+def test_ranged_download(hub, tmp_path):
+    root, data = hub
+    server = RangeServer(root).start()
+    try:
+        dest, results, summary = fetch(server, tmp_path)
+    finally:
+        server.stop()
+    assert results == [{"file": "model.safetensors", "status": "ok", "path": dest}]
+    assert read(dest) == data
+    assert len(ranges(server)) == -(-SIZE // CHUNK)
+    assert summary["bytes"] == SIZE
+    assert not os.path.exists(dest + ".incomplete")
+    assert not os.path.exists(dest + ".incomplete.json")
+
+
+def test_server_without_ranges(hub, tmp_path):
+    root, data = hub
+    server = RangeServer(root, ranges=False).start()
+    try:
+        dest, results, summary = fetch(server, tmp_path)
+    finally:
+        server.stop()
+    assert results[0]["status"] == "ok"
+    assert read(dest) == data
+    assert ranges(server) == []
+    assert summary["bytes"] == SIZE
+
+
+def test_ranged_retry_continues_the_chunk(hub, tmp_path):
+    root, data = hub
+    server = RangeServer(root, drops=2, drop_after=10 * 1024).start()
+    try:
+        dest, results, summary = fetch(server, tmp_path)
+    finally:
+        server.stop()
+    assert results[0]["status"] == "ok"
+    assert read(dest) == data
+    # the retries asked only for what was missing, nothing counted twice
+    assert any(not r.endswith("-") and int(r[6:].split("-")[0]) % CHUNK == 10 * 1024 for r in ranges(server))
+    assert summary["bytes"] == SIZE
+
+
+def test_whole_file_retry_resets_progress(hub, tmp_path):
+    root, data = hub
+    server = RangeServer(root, ranges=False, drops=2, drop_after=100 * 1024).start()
+    try:
+        dest, results, summary = fetch(server, tmp_path)
+    finally:
+        server.stop()
+    assert results[0]["status"] == "ok"
+    assert read(dest) == data
+    assert summary["bytes"] == SIZE
+
+
+def test_resume_after_failed_run(hub, tmp_path):
+    root, data = hub
+    server = RangeServer(root, drops=100, drop_after=4 * 1024).start()
+    try:
+        dest, results, _ = fetch(server, tmp_path)
+        assert results[0]["status"] == "error"
+        assert os.path.exists(dest + ".incomplete.json")
+
+        server.drops = 0
+        dest, results, summary = fetch(server, tmp_path)
+    finally:
+        server.stop()
+    assert results[0]["status"] == "ok"
+    assert read(dest) == data
+    assert summary["resumed_bytes"] > 0
+    assert summary["bytes"] + summary["resumed_bytes"] == SIZE
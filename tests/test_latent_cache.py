@@ -0,0 +1,162 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import latent_cache as lc
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    root = tmp_path / "dataset" / "mydata"
+    for i in range(3):
+        write(str(root / f"img_{i}.png"), f"pixels {i}".encode())
+        write(str(root / f"img_{i}.txt"), f"caption {i}".encode())
+    return str(root)
+
+
+def run(cache_root, dataset_dir, params):
+    cache = lc.CacheDir(cache_root, "mydata", params)
+    encoder = lc.DummyEncoder()
+    report = lc.precompute(dataset_dir, cache, encoder, batch_size=2)
+    return cache, encoder, report
+
+
+def test_latent_key_covers_every_setting():
+    base = lc.latent_params("fp", 1024)
+    changed = [
+        lc.latent_params("other", 1024),
+        lc.latent_params("fp", 768),
+        lc.latent_params("fp", (1024, 768)),
+        lc.latent_params("fp", 1024, enable_bucket=False),
+        lc.latent_params("fp", 1024, max_bucket_reso=2048),
+        lc.latent_params("fp", 1024, bucket_reso_steps=32),
+        lc.latent_params("fp", 1024, flip_aug=True),
+        lc.latent_params("fp", 1024, vae_dtype="float16"),
+    ]
+    keys = {lc.cache_key(p) for p in changed}
+    assert lc.cache_key(base) not in keys
+    assert len(keys) == len(changed)
+    assert lc.cache_key(lc.latent_params("fp", 1024)) == lc.cache_key(base)
+    assert base["vae_dtype"] == "float32"
+
+
+def test_te_key_ignores_resolution():
+    assert lc.cache_key(lc.te_params("fp")) == lc.cache_key(lc.te_params("fp"))
+    assert lc.cache_key(lc.te_params("fp")) != lc.cache_key(lc.te_params("other"))
+    assert lc.cache_key(lc.te_params("fp")) != lc.cache_key(lc.latent_params("fp", 1024))
+
+
+def test_model_fingerprint_follows_content(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    write(path, b"a" * 3 * lc.FINGERPRINT_BYTES)
+    first = lc.model_fingerprint(path)
+    assert lc.model_fingerprint(path) == first
+    write(path, b"a" * 3 * lc.FINGERPRINT_BYTES + b"b")
+    assert lc.model_fingerprint(path) != first
+
+
+def test_rerun_encodes_nothing(tmp_path, dataset):
+    params = lc.latent_params("fp", 64)
+    _, encoder, report = run(str(tmp_path / "cache"), dataset, params)
+    assert report["encoded"] == 3
+    assert sorted(encoder.calls) == ["img_0.png", "img_1.png", "img_2.png"]
+
+    _, encoder, report = run(str(tmp_path / "cache"), dataset, params)
+    assert report["encoded"] == 0
+    assert encoder.calls == []
+
+
+def test_changed_image_only_invalidates_latents(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    latents, te = lc.latent_params("fp", 64), lc.te_params("fp")
+    run(cache_root, dataset, latents)
+    run(cache_root, dataset, te)
+
+    write(os.path.join(dataset, "img_1.png"), b"new pixels, other size")
+    _, encoder, _ = run(cache_root, dataset, latents)
+    assert encoder.calls == ["img_1.png"]
+    _, encoder, _ = run(cache_root, dataset, te)
+    assert encoder.calls == []
+
+
+def test_changed_caption_only_invalidates_te(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    latents, te = lc.latent_params("fp", 64), lc.te_params("fp")
+    run(cache_root, dataset, latents)
+    run(cache_root, dataset, te)
+
+    write(os.path.join(dataset, "img_2.txt"), b"another caption")
+    _, encoder, _ = run(cache_root, dataset, te)
+    assert encoder.calls == ["img_2.png"]
+    _, encoder, _ = run(cache_root, dataset, latents)
+    assert encoder.calls == []
+
+
+def test_removed_image_and_missing_file(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    params = lc.latent_params("fp", 64)
+    cache, _, _ = run(cache_root, dataset, params)
+
+    os.remove(os.path.join(dataset, "img_0.png"))
+    os.remove(cache.cache_file("img_1.png"))
+    cache, encoder, report = run(cache_root, dataset, params)
+    assert report["removed"] == 1
+    assert "img_0.png" not in cache.manifest["entries"]
+    assert not os.path.exists(cache.cache_file("img_0.png"))
+    assert encoder.calls == ["img_1.png"]
+
+
+def test_new_settings_get_their_own_cache(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    first, _, _ = run(cache_root, dataset, lc.latent_params("fp", 64))
+    second, encoder, _ = run(cache_root, dataset, lc.latent_params("fp", 128))
+    assert first.dir != second.dir
+    assert len(encoder.calls) == 3
+    with np.load(second.cache_file("img_0.png")) as npz:
+        assert npz["latents"].shape == (4, 16, 16)
+
+
+def test_install_skips_stale_entries(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    run(cache_root, dataset, lc.latent_params("fp", 64))
+    write(os.path.join(dataset, "img_2.png"), b"edited after caching")
+
+    installed = lc.install_latest(cache_root, "mydata", dataset)
+    assert installed["latents"]["files"] == 2
+    assert os.path.exists(os.path.join(dataset, "img_0.npz"))
+    assert not os.path.exists(os.path.join(dataset, "img_2.npz"))
+
+
+def test_copied_dataset_still_matches(tmp_path, dataset):
+    cache_root = str(tmp_path / "cache")
+    run(cache_root, dataset, lc.latent_params("fp", 64))
+    run(cache_root, dataset, lc.te_params("fp"))
+
+    # a copy without timestamps, like rsync without -t or an upload
+    copy = str(tmp_path / "local" / "mydata")
+    os.makedirs(copy)
+    for name in os.listdir(dataset):
+        with open(os.path.join(dataset, name), "rb") as src, open(os.path.join(copy, name), "wb") as dst:
+            dst.write(src.read())
+        os.utime(os.path.join(copy, name), ns=(1, 1))
+    # same size, other pixels: only this one is stale
+    write(os.path.join(copy, "img_2.png"), b"pixels X")
+    os.utime(os.path.join(copy, "img_2.png"), ns=(1, 1))
+
+    installed = lc.install_latest(cache_root, "mydata", copy)
+    assert installed["latents"]["files"] == 2
+    assert installed["te"]["files"] == 3
+    assert os.path.exists(os.path.join(copy, "img_0.npz"))
+    assert not os.path.exists(os.path.join(copy, "img_2.npz"))
+
+    # the copy is its own dataset dir now, only the changed image is encoded
+    _, encoder, _ = run(cache_root, copy, lc.latent_params("fp", 64))
+    assert encoder.calls == ["img_2.png"]
@@ -0,0 +1,138 @@
+import functools
+import os
+import random
+
+import pytest
+
+import lazy_loader
+import safetensors_io as sio
+from lazy_loader import LazyLoader, component, plan_spans, select
+
+SDXL = [
+    ("model.diffusion_model.input_blocks.0.0.weight", 3000),
+    ("model.diffusion_model.input_blocks.0.0.bias", 40),
+    ("model.diffusion_model.middle_block.1.proj_in.weight", 9000),
+    ("conditioner.embedders.0.transformer.text_model.embeddings.token_embedding.weight", 5000),
+    ("conditioner.embedders.1.model.ln_final.weight", 24),
+    ("first_stage_model.encoder.conv_in.weight", 7000),
+    ("first_stage_model.decoder.conv_out.bias", 12),
+]
+FLUX = [
+    "double_blocks.0.img_attn.qkv.weight",
+    "single_blocks.37.linear1.weight",
+    "img_in.weight",
+    "txt_in.bias",
+    "time_in.in_layer.weight",
+    "vector_in.out_layer.bias",
+    "guidance_in.in_layer.weight",
+    "final_layer.linear.weight",
+    "model.diffusion_model.double_blocks.0.txt_mlp.0.weight",
+]
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    rng = random.Random(0)
+    data = {name: rng.randbytes(size * 2) for name, size in SDXL}
+    path = str(tmp_path / "model.safetensors")
+    writer = sio.Writer(path, [(name, "F16", [size]) for name, size in SDXL])
+    for name, _ in SDXL:
+        writer.write(name, [data[name]])
+    writer.finish()
+    return path, data
+
+
+@pytest.fixture
+def small_reads(monkeypatch):
+    # tiny ranges and merge gap so a few KB file gets split and merged spans
+    monkeypatch.setattr(lazy_loader, "plan_spans", functools.partial(plan_spans, gap=256))
+    monkeypatch.setattr(lazy_loader, "_pieces", functools.partial(lazy_loader._pieces, size=4096))
+
+
+def reference(path, names):
+    with sio.Reader(path) as reader:
+        return {name: bytes(reader.raw(name)) for name in names}
+
+
+def test_component_of_sdxl_and_flux_keys():
+    assert [component(name) for name, _ in SDXL] == ["unet"] * 3 + ["text_encoder"] * 2 + ["vae"] * 2
+    assert {component(name) for name in FLUX} == {"unet"}
+    assert component("text_encoders.t5xxl.transformer.shared.weight") == "text_encoder"
+    assert component("text_encoders.clip_l.transformer.text_model.final_layer_norm.weight") == "text_encoder"
+    assert component("cond_stage_model.transformer.text_model.embeddings.position_ids") == "text_encoder"
+    assert component("vae.decoder.conv_in.weight") == "vae"
+    assert component("model_ema.decay") == "other"
+
+
+def test_select_components_and_prefixes():
+    names = [name for name, _ in SDXL] + FLUX + ["vae.encoder.conv_in.weight"]
+    unet = select(names, "unet")
+    assert unet == [name for name in names if component(name) == "unet"]
+    assert len(unet) == 3 + len(FLUX)
+    assert select(names, "text_encoder,vae") == [name for name in names if component(name) in ("text_encoder", "vae")]
+    assert select(names, ["first_stage_model."]) == [SDXL[5][0], SDXL[6][0]]
+    assert select(names, "unet", exclude="double_blocks.,model.diffusion_model.") == FLUX[1:8]
+    assert select(names) == names
+
+
+def test_plan_spans_merge_and_split():
+    header = {name: {"data_offsets": offsets} for name, offsets in
+              {"a": [0, 100], "b": [100, 300], "c": [350, 400], "d": [1000, 1100]}.items()}
+    assert plan_spans(header, ["d", "a", "c", "b"], gap=64) == [
+        (0, 400, ["a", "b", "c"]), (1000, 1100, ["d"])]
+    assert plan_spans(header, ["a", "c"], gap=0) == [(0, 100, ["a"]), (350, 400, ["c"])]
+
+
+@pytest.mark.parametrize("include", ["unet", "text_encoder", "vae", None])
+def test_load_matches_safetensors_io(checkpoint, small_reads, include):
+    path, data = checkpoint
+    with LazyLoader(path, workers=4) as loader:
+        tensors = loader.load(include=include)
+        names = select(loader.header, include)
+        assert sorted(tensors) == sorted(names)
+        assert {name: bytes(view) for name, view in tensors.items()} == reference(path, names)
+        assert loader.stats["bytes_read"] >= loader.nbytes(names)
+    for name in names:
+        assert reference(path, [name])[name] == data[name]
+
+
+def test_split_spans_read_in_pieces(checkpoint, small_reads):
+    path, _ = checkpoint
+    # the two big unet tensors with a small one skipped between: one merged
+    # span of ~24KB, so six 4KB reads
+    names = [SDXL[0][0], SDXL[2][0]]
+    with LazyLoader(path, workers=4) as loader:
+        tensors = loader.load(names)
+        assert loader.stats["reads"] == -(-(6000 + 80 + 18000) // 4096)
+        # spread out tensors are separate spans, nothing read in between
+        far = [SDXL[1][0], SDXL[4][0], SDXL[6][0]]
+        loader.load(far)
+        assert loader.stats["bytes_read"] == loader.nbytes(SDXL[i][0] for i in range(3)) + loader.nbytes(far)
+    assert {name: bytes(view) for name, view in tensors.items()} == reference(path, names)
+
+
+def test_prefetch_fills_the_rest(checkpoint, small_reads):
+    path, _ = checkpoint
+    with LazyLoader(path, workers=2) as loader:
+        first = loader.load(include="unet")
+        loader.prefetch()
+        assert loader.wait(timeout=10)
+        assert loader.stats["prefetched"] == 4
+        before = loader.stats["reads"]
+        everything = loader.load(loader.keys())
+        assert loader.stats["reads"] == before
+        assert loader.stats["bytes_read"] == os.path.getsize(path) - loader.offset
+    assert {name: bytes(view) for name, view in everything.items()} == reference(path, [name for name, _ in SDXL])
+    assert all(bytes(first[name]) == bytes(everything[name]) for name in first)
+
+
+def test_array_and_warm(checkpoint):
+    pytest.importorskip("numpy")
+    path, data = checkpoint
+    with LazyLoader(path) as loader, sio.Reader(path) as reader:
+        name = SDXL[3][0]
+        # random bits include nans, compare the raw values
+        assert loader.array(name).tobytes() == reader.array(name).tobytes()
+        assert loader.array(name).shape == (5000,)
+    size, _ = lazy_loader.warm(path, include="vae")
+    assert size == sum(len(blob) for blob in data.values())
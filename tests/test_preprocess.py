@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from preprocess import preprocess_dataset, preprocess_params
+
+NAMES = {"photo.jpeg": "JPEG", "IMG.JPG": "JPEG", "a.PNG": "PNG", "b.png": "PNG"}
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    root = tmp_path / "mydata"
+    root.mkdir()
+    for name, fmt in NAMES.items():
+        Image.new("RGB", (256, 256), (200, 30, 30)).save(root / name, format=fmt)
+        (root / name).with_suffix(".txt").write_text("caption")
+    Image.new("RGB", (2048, 2048), (30, 200, 30)).save(root / "BIG.JPEG", format="JPEG")
+    (root / "BIG.txt").write_text("caption")
+    return root
+
+
+def listing(root):
+    return sorted(n for n in os.listdir(root) if not n.startswith("."))
+
+
+def test_keep_format_keeps_names_and_bytes(dataset):
+    before = {name: (dataset / name).read_bytes() for name in NAMES}
+    report = preprocess_dataset(str(dataset), preprocess_params(resolution=512), workers=1)
+    assert report["collisions"] == {}
+    # only the big one is resized, under its own name and format
+    assert report["rewritten"] == 1
+    assert listing(dataset) == sorted(list(NAMES) + ["BIG.JPEG"] + [
+        os.path.splitext(n)[0] + ".txt" for n in list(NAMES) + ["BIG.JPEG"]])
+    assert {name: (dataset / name).read_bytes() for name in NAMES} == before
+    with Image.open(dataset / "BIG.JPEG") as img:
+        assert img.format == "JPEG"
+        assert img.size == (512, 512)
+
+
+def test_target_format_only_touches_other_formats(dataset):
+    before = {name: (dataset / name).read_bytes() for name in ("photo.jpeg", "IMG.JPG")}
+    report = preprocess_dataset(str(dataset), preprocess_params(resolution=512, fmt="jpg"), workers=1)
+    assert report["collisions"] == {}
+    assert report["rewritten"] == 3  # a.PNG, b.png and the resized BIG.JPEG
+    assert {name: (dataset / name).read_bytes() for name in before} == before
+    assert (dataset / "a.jpg").exists() and not (dataset / "a.PNG").exists()
+    assert (dataset / "b.jpg").exists() and not (dataset / "b.png").exists()
+    assert (dataset / "BIG.JPEG").exists()
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import latent_cache as lc
+import shards
+
+
+def test_expand_round_trip_keeps_the_latent_cache(tmp_path):
+    data = tmp_path / "volume" / "mydata"
+    (data / "sub").mkdir(parents=True)
+    for i in range(4):
+        (data / f"img_{i}.png").write_bytes(os.urandom(1000 + i))
+        (data / f"img_{i}.txt").write_text(f"caption {i}")
+    (data / "sub" / "img_9.jpg").write_bytes(os.urandom(500))
+    cache_root = str(tmp_path / "cache")
+    lc.precompute(str(data), lc.CacheDir(cache_root, "mydata", lc.latent_params("fp", 64)), lc.DummyEncoder())
+
+    shard_dir = str(tmp_path / "volume" / ".shards" / "mydata")
+    index = shards.pack(str(data), shard_dir, shard_size=4096)
+    assert len(index["shards"]) > 1
+    dest = str(tmp_path / "local" / "mydata")
+    report = shards.expand(shard_dir, dest)
+    assert report["samples"] == 5
+
+    for rel in ("img_2.png", "img_2.txt", os.path.join("sub", "img_9.jpg")):
+        with open(os.path.join(dest, rel), "rb") as f:
+            assert f.read() == (data / rel).read_bytes()
+    installed = lc.install_latest(cache_root, "mydata", dest)
+    assert installed["latents"]["files"] == 5
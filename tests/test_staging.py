@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import latent_cache as lc
+import staging
+
+
+@pytest.fixture
+def volume(tmp_path):
+    root = tmp_path / "volume"
+    data = root / "mydata"
+    data.mkdir(parents=True)
+    for i in range(3):
+        (data / f"img_{i}.png").write_bytes(f"pixels {i}".encode())
+        (data / f"img_{i}.txt").write_text(f"caption {i}")
+    return str(root)
+
+
+@pytest.fixture
+def other_fs(tmp_path):
+    # /dev/shm is a different filesystem from tmp_path on linux, like volume -> local disk
+    if not os.path.isdir("/dev/shm") or os.stat("/dev/shm").st_dev == os.stat(tmp_path).st_dev:
+        pytest.skip("no second filesystem to stage onto")
+    path = tempfile.mkdtemp(dir="/dev/shm")
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def test_stage_across_filesystems_keeps_the_latent_cache(tmp_path, volume, other_fs):
+    cache_root = str(tmp_path / "cache")
+    for params in (lc.latent_params("fp", 64), lc.te_params("fp")):
+        cache = lc.CacheDir(cache_root, "mydata", params)
+        lc.precompute(os.path.join(volume, "mydata"), cache, lc.DummyEncoder())
+
+    report = staging.stage(volume, other_fs)
+    assert report["copied"] == 6
+    staged = os.path.join(other_fs, "mydata")
+    assert os.stat(os.path.join(staged, "img_0.png")).st_ino != os.stat(os.path.join(volume, "mydata", "img_0.png")).st_ino
+
+    installed = lc.install_latest(cache_root, "mydata", staged)
+    assert installed["latents"]["files"] == 3
+    assert installed["te"]["files"] == 3
+    assert os.path.exists(os.path.join(staged, "img_0.npz"))
+
+
+def test_restage_only_moves_changes(volume, other_fs):
+    staging.stage(volume, other_fs)
+    with open(os.path.join(volume, "mydata", "img_1.txt"), "w") as f:
+        f.write("new caption")
+    os.remove(os.path.join(volume, "mydata", "img_2.png"))
+
+    report = staging.stage(volume, other_fs)
+    assert report["copied"] == 1
+    assert report["removed"] == 1
+    assert report["unchanged"] == 4
+    with open(os.path.join(other_fs, "mydata", "img_1.txt")) as f:
+        assert f.read() == "new caption"
+    assert not os.path.exists(os.path.join(other_fs, "mydata", "img_2.png"))
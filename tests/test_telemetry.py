@@ -0,0 +1,127 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from telemetry import FakeBackend, LogParser, NullBackend, Sampler, serve
+
+# sd-scripts output as the tee sees it: tqdm redraws with \r, epochs on their own line
+TRAIN_OUTPUT = (
+    "running training / 学習開始\n"
+    "\nepoch 1/10\n"
+    "steps:   0%|          | 0/1000 [00:00<?, ?it/s]"
+    "\rsteps:   0%|          | 1/1000 [00:05<1:23:20,  5.01s/it, avr_loss=0.134]"
+    "\rsteps:  12%|█▏        | 120/1000 [01:23<10:12,  1.44it/s, avr_loss=0.0912]"
+)
+
+
+def test_parser_reads_tqdm_lines():
+    parser = LogParser()
+    cut = TRAIN_OUTPUT.index("epoch 1/1") + len("epoch 1/1")
+    parser.feed(TRAIN_OUTPUT[:cut])
+    assert parser.state["epoch"] is None  # "epoch 1/10" isn't a whole line yet
+    parser.feed(TRAIN_OUTPUT[cut:])
+    state = parser.snapshot()
+    # the last redraw has no \r after it yet, so the s/it line is the latest
+    assert (state["step"], state["total"]) == (1, 1000)
+    assert state["it_per_s"] == pytest.approx(1 / 5.01)
+    assert state["loss"] == 0.134
+    assert (state["epoch"], state["epochs"]) == (1, 10)
+    assert state["active"]
+
+    parser.feed("\r")
+    state = parser.snapshot()
+    assert (state["step"], state["it_per_s"], state["loss"]) == (120, 1.44, 0.0912)
+
+
+def test_parser_split_in_the_middle_of_a_number():
+    parser = LogParser()
+    line = "steps:  50%|#####     | 500/1000 [05:00<05:00,  1.67it/s, avr_loss=1.5e-02]\n"
+    for i in range(0, len(line), 7):
+        parser.feed(line[i:i + 7])
+    state = parser.state
+    assert (state["step"], state["it_per_s"], state["loss"]) == (500, 1.67, 0.015)
+    assert state["lines"] == 1
+
+
+def test_no_progress_is_not_active():
+    parser = LogParser()
+    parser.line("steps:   1%|          | 10/1000 [00:10<16:30,  1.00it/s]", now=1000.0)
+    assert parser.snapshot(now=1010.0)["active"]
+    assert not parser.snapshot(now=1100.0)["active"]
+
+
+def sampled(util, steps=5):
+    parser = LogParser()
+    sampler = Sampler(FakeBackend(gpus=2, util_fn=lambda t: util), parser)
+    for i in range(steps):
+        parser.line(f"steps: | {i + 1}/100 [00:0{i}<01:00,  2.00it/s, avr_loss=0.1]", now=1000.0 + i)
+        sampler.sample_once(now=1000.5 + i)
+    return sampler
+
+
+@pytest.mark.parametrize("util, bound", [(95, "gpu"), (30, "input"), (65, "mixed")])
+def test_summary_bound(util, bound):
+    summary = sampled(util).summary()
+    assert summary["bound"] == bound
+    assert summary["gpu_util_avg"] == util
+    assert summary["input_stall_ratio"] == round(1 - util / 100, 3)
+    assert summary["samples"] == 5
+    assert summary["backend"] == "fake"
+
+
+def test_summary_without_training():
+    sampler = Sampler(FakeBackend(util_fn=lambda t: 10))
+    sampler.sample_once(now=1000.0)
+    summary = sampler.summary()
+    assert summary["bound"] is None
+    assert summary["gpu_util_avg"] == 10
+    assert Sampler().summary() == {"samples": 0}
+
+
+def test_prometheus_format():
+    sampler = sampled(95, steps=1)
+    text = sampler.prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert '# TYPE kohya_gpu_utilization_percent gauge' in lines
+    assert 'kohya_gpu_utilization_percent{gpu="1",name="Fake GPU"} 95' in lines
+    assert f'kohya_gpu_memory_used_bytes{{gpu="0",name="Fake GPU"}} {12000 * 1024 ** 2}' in lines
+    assert "kohya_train_step 1" in lines
+    assert "kohya_train_active 1" in lines
+    assert "kohya_telemetry_samples_total 1" in lines
+    for line in lines:
+        assert line.startswith("#") or " None" not in line
+
+    # nothing sampled: headers only, no None values
+    empty = Sampler(NullBackend()).prometheus().splitlines()
+    assert "# HELP kohya_train_step current step" in empty
+    assert not any(line.startswith("kohya_train_step") for line in empty)
+    assert not any(line.startswith("kohya_gpu_") for line in empty)
+    assert "kohya_train_active 0" in empty
+
+
+def test_history_over_http():
+    sampler = Sampler(FakeBackend(util_fn=lambda t: 50))
+    for i in range(10):
+        sampler.sample_once(now=1000.0 + i)
+    server = serve(sampler, 0, routes={"/healthz": lambda q: (200, "text/plain", "ok\n")}, host="127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        def get(path):
+            with urllib.request.urlopen(url + path, timeout=5) as resp:
+                return resp.read().decode()
+
+        assert len(json.loads(get("/history"))) == 10
+        assert [s["time"] for s in json.loads(get("/history?since=1006"))] == [1007.0, 1008.0, 1009.0]
+        assert [s["time"] for s in json.loads(get("/history?limit=2"))] == [1008.0, 1009.0]
+        assert [s["time"] for s in json.loads(get("/history?since=1002&limit=1"))] == [1009.0]
+        assert get("/healthz") == "ok\n"
+        assert "kohya_telemetry_samples_total 10" in get("/metrics")
+        with pytest.raises(urllib.error.HTTPError) as err:
+            get("/nope")
+        assert err.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
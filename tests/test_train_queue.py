@@ -0,0 +1,156 @@
+import os
+import signal
+import sys
+
+import pytest
+
+import preempt
+from train_queue import JobQueue, run_queue, run_trainer
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# fake trainers: what the config name says is what the process does
+FAKE = {
+    "ok.toml": "print('fake training')",
+    "fail.toml": "import sys; print('out of memory'); sys.exit(3)",
+    "kill.toml": "import os, signal; os.kill(os.getpid(), signal.SIGTERM)",
+    "sleep.toml": "import time; time.sleep(30)",
+}
+
+
+def fake(job, tmp_path, **kwargs):
+    command = [sys.executable, "-c", FAKE[job["config"]]]
+    return run_trainer(command, str(tmp_path / "logs" / f"{job['id']}.log"), cwd=REPO, **kwargs)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue"))
+
+
+def test_claim_follows_priority_then_age(queue):
+    low = queue.submit("low.toml")
+    first = queue.submit("first.toml", priority=5)
+    second = queue.submit("second.toml", priority=5)
+    assert [j["id"] for j in queue.list()] == [first["id"], second["id"], low["id"]]
+    claimed = [queue.claim()["id"] for _ in range(3)]
+    assert claimed == [first["id"], second["id"], low["id"]]
+    assert queue.claim() is None
+    assert queue.counts()["running"] == 3
+
+
+def test_status_transitions(queue):
+    job = queue.submit("a.toml", max_retries=1)
+    assert job["status"] == "pending"
+    job = queue.claim()
+    assert (job["status"], job["attempts"]) == ("running", 1)
+    job = queue.finish(job["id"], {"returncode": 1})
+    assert job["status"] == "pending"  # one retry left
+    queue.claim()
+    job = queue.finish(job["id"], {"returncode": 0})
+    assert (job["status"], job["attempts"]) == ("done", 2)
+    assert [h["returncode"] for h in job["history"]] == [1, 0]
+
+
+def test_preempted_attempt_is_not_a_retry(queue):
+    job = queue.submit("a.toml", max_retries=0)
+    queue.claim()
+    job = queue.finish(job["id"], {"returncode": preempt.EXIT_PREEMPTED, "preempted": True})
+    assert (job["status"], job["attempts"], job["preemptions"]) == ("pending", 0, 1)
+    queue.claim()
+    assert queue.finish(job["id"], {"returncode": 1})["status"] == "failed"
+
+
+def test_cancel(queue):
+    pending = queue.submit("a.toml")
+    running = queue.submit("b.toml", priority=1)
+    assert queue.claim()["id"] == running["id"]
+    queue.cancel(pending["id"])
+    queue.cancel(running["id"])
+    # the running one finishes but stays cancelled, never retried
+    assert queue.finish(running["id"], {"returncode": 1})["status"] == "cancelled"
+    assert queue.claim() is None
+
+
+def test_requeue_stale(queue):
+    job = queue.submit("a.toml")
+    queue.claim()
+    assert queue.requeue_stale() == 1
+    assert queue.get(job["id"])["status"] == "pending"
+
+
+def test_run_queue_retries_up_to_the_limit(queue):
+    job = queue.submit("a.toml", max_retries=2)
+    calls, changes = [], []
+
+    def run(job):
+        calls.append(job["attempts"])
+        return {"returncode": 1}
+
+    summary = run_queue(queue, run, on_change=lambda j: changes.append(j["status"]))
+    assert calls == [1, 2, 3]
+    assert summary["failed"] == 1
+    assert summary["retried"] == 2
+    assert changes == ["running", "pending", "running", "pending", "running", "failed"]
+    assert queue.get(job["id"])["attempts"] == 3
+
+
+def test_run_queue_counts_exceptions_as_failures(queue):
+    queue.submit("a.toml", max_retries=0)
+
+    def run(job):
+        raise RuntimeError("no gpu")
+
+    summary = run_queue(queue, run)
+    assert summary["failed"] == 1
+    assert queue.list()[0]["history"][0]["error"] == "no gpu"
+
+
+def test_run_trainer_exit_codes(queue, tmp_path):
+    ok = fake({"id": "ok", "config": "ok.toml"}, tmp_path)
+    assert ok["returncode"] == 0
+    assert "tail" not in ok
+    with open(ok["log"]) as f:
+        assert "fake training" in f.read()
+
+    failed = fake({"id": "fail", "config": "fail.toml"}, tmp_path)
+    assert failed["returncode"] == 3
+    assert "out of memory\n" in failed["tail"]
+
+    killed = fake({"id": "kill", "config": "kill.toml"}, tmp_path)
+    assert killed["returncode"] == -signal.SIGTERM
+
+    slow = fake({"id": "sleep", "config": "sleep.toml"}, tmp_path, timeout=0.5)
+    assert slow["returncode"] == -signal.SIGKILL
+    assert any("timed out" in line for line in slow["tail"])
+
+
+def test_run_trainer_reports_preemption(tmp_path):
+    state_dir = str(tmp_path / "state")
+    saved = os.path.join(state_dir, "state-1")
+    os.makedirs(saved)
+    code = (f"import sys, preempt; preempt.write_marker({state_dir!r}, {saved!r}, 'sigterm'); "
+            f"sys.exit(preempt.EXIT_PREEMPTED)")
+    result = run_trainer([sys.executable, "-c", code], str(tmp_path / "logs" / "p.log"), cwd=REPO,
+                         state_dir=state_dir)
+    assert result["returncode"] == preempt.EXIT_PREEMPTED
+    assert result["preempted"] is True
+    assert result["state"] == saved
+
+    done = run_trainer([sys.executable, "-c", "pass"], str(tmp_path / "logs" / "p.log"), cwd=REPO,
+                       state_dir=state_dir)
+    assert "preempted" not in done
+    assert preempt.read_marker(state_dir) is None  # finished, next run starts fresh
+
+
+def test_run_queue_with_fake_trainers(queue, tmp_path):
+    for config in ("ok.toml", "fail.toml", "kill.toml"):
+        queue.submit(config, max_retries=1)
+    summary = run_queue(queue, lambda job: fake(job, tmp_path), workers=2)
+    assert summary["done"] == 1
+    assert summary["failed"] == 2
+    assert summary["retried"] == 2
+    jobs = {job["config"]: job for job in queue.list()}
+    assert jobs["ok.toml"]["status"] == "done"
+    assert [h["returncode"] for h in jobs["fail.toml"]["history"]] == [3, 3]
+    assert [h["returncode"] for h in jobs["kill.toml"]["history"]] == [-signal.SIGTERM] * 2
+    assert summary["counts"] == {"pending": 0, "running": 0, "done": 1, "failed": 2, "cancelled": 0}
@@ -0,0 +1,368 @@
+"""headless training queue
+
+jobs are small json files, one per job, under a queue dir (on the
+kohya-configs volume in the modal app):
+
+    <root>/jobs/<job_id>.json   {"id", "config", "priority", "status", "attempts", ...}
+
+status goes pending -> running -> done / failed (or cancelled). a failed
+attempt goes back to pending until max_retries is used up, a preempted
+one (state saved, see preempt.py) goes back without using a retry. only the
+scheduler (run_queue) changes status after submit, workers just run the
+trainer and return a result, so containers never race on the same file.
+
+run_queue() takes a `run(job)` callable: in modal it calls a gpu function
+(one container per job, up to max_containers), locally it runs a fake
+trainer command so the scheduling can be tried without a gpu:
+
+    python train_queue.py --root /tmp/q submit my_lora.toml --priority 5
+    python train_queue.py --root /tmp/q run --workers 2 --fake
+    python train_queue.py --root /tmp/q list
+"""
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import preempt
+
+STATUSES = ("pending", "running", "done", "failed", "cancelled")
+DEFAULT_SCRIPT = "train_network.py"
+# stands in for accelerate launch, {config} is replaced with the config path
+FAKE_TRAINER = (
+    f"{shlex.quote(sys.executable)} -c "
+    "\"import sys, time; time.sleep(1); print('fake training', sys.argv[1])\" {config}"
+)
+
+
+class JobQueue:
+    """file-backed job queue with priority, retries and per-job status."""
+
+    def __init__(self, root):
+        self.root = root
+        self.jobs_dir = os.path.join(root, "jobs")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _write(self, job):
+        path = self._path(job["id"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, config, priority=0, max_retries=1, script=DEFAULT_SCRIPT, args=None):
+        """config: kohya toml path, relative to the configs dir or absolute."""
+        job = {
+            "id": time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6],
+            "config": config,
+            "script": script,
+            "args": list(args or []),
+            "priority": int(priority),
+            "max_retries": int(max_retries),
+            "status": "pending",
+            "attempts": 0,
+            "created": time.time(),
+            "history": [],
+        }
+        with self._lock:
+            self._write(job)
+        return job
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self, status=None):
+        """jobs in scheduling order: highest priority first, then oldest."""
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith(".json"):
+                job = self.get(name[:-5])
+                if job and (status is None or job["status"] == status):
+                    jobs.append(job)
+        return sorted(jobs, key=lambda j: (-j["priority"], j["created"]))
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            job.update(fields)
+            job["updated"] = time.time()
+            self._write(job)
+            return job
+
+    def claim(self):
+        """next pending job, marked running. None when nothing is pending."""
+        with self._lock:
+            pending = self.list("pending")
+            if not pending:
+                return None
+            job = pending[0]
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["started"] = time.time()
+            self._write(job)
+            return job
+
+    def finish(self, job_id, result):
+        """record an attempt; failed attempts go back to pending while retries last."""
+        with self._lock:
+            job = self.get(job_id)
+            ok = result.get("returncode") == 0
+            job["history"].append({"attempt": job["attempts"], **result})
+            if job["status"] == "cancelled":
+                pass
+            elif result.get("preempted"):
+                # state was saved, the next attempt resumes and isn't a retry
+                job["status"] = "pending"
+                job["attempts"] -= 1
+                job["preemptions"] = job.get("preemptions", 0) + 1
+            elif ok:
+                job["status"] = "done"
+            elif job["attempts"] <= job["max_retries"]:
+                job["status"] = "pending"
+            else:
+                job["status"] = "failed"
+            job["updated"] = time.time()
+            self._write(job)
+            return job
+
+    def cancel(self, job_id):
+        """pending jobs never start, a running one keeps going but isn't retried."""
+        return self.update(job_id, status="cancelled")
+
+    def requeue_stale(self):
+        """running jobs left behind by a scheduler that died go back to pending."""
+        stale = self.list("running")
+        for job in stale:
+            self.update(job["id"], status="pending")
+        return len(stale)
+
+    def counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for job in self.list():
+            counts[job["status"]] += 1
+        return counts
+
+
+def train_command(job, kohya_base, configs_dir=None, state_dir=None, deadline=None):
+    """accelerate launch of the job's sd-scripts script with --config_file.
+
+    with state_dir the script runs under preempt.py (save state on
+    SIGTERM / at the deadline) and resumes from the last saved state.
+    """
+    config = job["config"]
+    if configs_dir and not os.path.isabs(config):
+        config = os.path.join(configs_dir, config)
+    command = ["accelerate", "launch", "--num_cpu_threads_per_process", "2"]
+    if state_dir:
+        command += [os.path.abspath(preempt.__file__), "--state-dir", state_dir]
+        if deadline:
+            command += ["--deadline", str(int(deadline))]
+        command.append("--")
+    command += [
+        os.path.join(kohya_base, "sd-scripts", job.get("script") or DEFAULT_SCRIPT),
+        "--config_file", config,
+        *job.get("args", []),
+    ]
+    if state_dir:
+        command += preempt.resume_args(state_dir)
+    return command
+
+
+def _forward(state_dir, proc):
+    # the real trainer sits under accelerate's launcher, signal it directly
+    def handler(signum, frame):
+        pid = preempt.trainer_pid(state_dir) if state_dir else None
+        try:
+            os.kill(pid or proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    previous = {}
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            previous[sig] = signal.signal(sig, handler)
+        except ValueError:
+            pass  # not the main thread
+    return previous
+
+
+def _wait_for_pid(pid, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return
+        time.sleep(1)
+
+
+def run_trainer(command, log_path, cwd=None, timeout=None, state_dir=None):
+    """run one trainer process, stdout+stderr to log_path.
+
+    state_dir (same as in train_command) forwards SIGTERM/SIGINT to the
+    trainer so it can save, and reports preempted=True when it did.
+    """
+    start = time.monotonic()
+    started_at = time.time()
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "a") as log:
+        log.write(f"$ {shlex.join(command)}\n")
+        log.flush()
+        try:
+            proc = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            log.write(f"could not start trainer: {e}\n")
+            proc = None
+        if proc is None:
+            returncode = -1
+        else:
+            previous = _forward(state_dir, proc)
+            try:
+                returncode = proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                log.write(f"timed out after {timeout}s\n")
+                proc.kill()
+                returncode = proc.wait()
+            finally:
+                for sig, handler in previous.items():
+                    signal.signal(sig, handler)
+            pid = preempt.trainer_pid(state_dir) if state_dir else None
+            if pid:
+                # launcher can exit before the trainer finished saving
+                _wait_for_pid(pid, 120)
+    result = {"returncode": returncode, "seconds": round(time.monotonic() - start, 1), "log": log_path}
+    if state_dir:
+        marker = preempt.read_marker(state_dir)
+        if returncode == 0:
+            preempt.clear_marker(state_dir)
+        elif marker and marker["time"] >= started_at:
+            result.update(preempted=True, state=marker["state"], reason=marker["reason"])
+    if returncode != 0:
+        with open(log_path, errors="replace") as log:
+            result["tail"] = log.readlines()[-20:]
+    return result
+
+
+def run_queue(queue, run, workers=1, on_change=None, refresh=None, poll=0, stop_when_empty=True):
+    """drain the queue with up to `workers` jobs in flight.
+
+    run(job) -> {"returncode": int, ...} does the actual training (and may
+    raise, which counts as a failed attempt). on_change(job) fires after
+    every status change, e.g. to commit a volume. refresh() runs before
+    each claim, e.g. to reload one. with poll > 0 and stop_when_empty
+    False it keeps waiting for new jobs.
+    """
+    summary = {"done": 0, "failed": 0, "retried": 0}
+    lock = threading.Lock()
+
+    def attempt(job):
+        try:
+            result = run(job)
+        except Exception as e:
+            result = {"returncode": -1, "error": str(e)}
+        # write + on_change together, a refresh() in between would lose the write
+        with lock:
+            job = queue.finish(job["id"], result)
+            if on_change is not None:
+                on_change(job)
+        return job
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        while True:
+            while len(in_flight) < workers:
+                with lock:
+                    if refresh is not None:
+                        refresh()
+                    job = queue.claim()
+                    if job is not None and on_change is not None:
+                        on_change(job)
+                if job is None:
+                    break
+                print(f"queue: starting {job['id']} ({job['config']}, attempt {job['attempts']})")
+                in_flight.add(pool.submit(attempt, job))
+
+            if not in_flight:
+                if stop_when_empty or poll <= 0:
+                    break
+                time.sleep(poll)
+                continue
+
+            done, in_flight = wait(in_flight, timeout=poll or None, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = future.result()
+                if job["status"] == "pending":
+                    summary["retried"] += 1
+                elif job["status"] in summary:
+                    summary[job["status"]] += 1
+                print(f"queue: {job['id']} -> {job['status']}")
+
+    summary["counts"] = queue.counts()
+    return summary
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="local training queue, same scheduler as the modal app")
+    parser.add_argument("--root", default="train_queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("submit")
+    p.add_argument("config")
+    p.add_argument("--priority", type=int, default=0)
+    p.add_argument("--retries", type=int, default=1)
+    p.add_argument("--script", default=DEFAULT_SCRIPT)
+
+    p = sub.add_parser("run")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--fake", action="store_true", help="use the fake trainer instead of accelerate")
+    p.add_argument("--trainer", help="command template, {config} gets the config path")
+    p.add_argument("--kohya-base", default="/kohya_ss")
+
+    sub.add_parser("list")
+    p = sub.add_parser("cancel")
+    p.add_argument("job_id")
+
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.root)
+
+    if args.command == "submit":
+        print(json.dumps(queue.submit(args.config, args.priority, args.retries, args.script), indent=2))
+    elif args.command == "list":
+        for job in queue.list():
+            print(f"{job['id']}  {job['status']:<9} p={job['priority']:<3} "
+                  f"attempts={job['attempts']}  {job['config']}")
+    elif args.command == "cancel":
+        queue.cancel(args.job_id)
+    elif args.command == "run":
+        template = args.trainer or (FAKE_TRAINER if args.fake else None)
+        queue.requeue_stale()
+
+        def run(job):
+            if template:
+                command = shlex.split(template.replace("{config}", shlex.quote(job["config"])))
+            else:
+                command = train_command(job, args.kohya_base)
+            return run_trainer(command, os.path.join(args.root, "logs", f"{job['id']}.log"))
+
+        print(json.dumps(run_queue(queue, run, args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""chunked, resumable model upload
+
+the client sends the checkpoint as a stream of chunks, each one with its
+sha256. the server side appends them to `<name>.partial`, records every
+good chunk in `<name>.partial.json` and renames the file into place once
+the whole thing is there. memory on both sides is one chunk, whatever the
+model size.
+
+on resume the client hashes its own prefix against the recorded chunks
+and cuts the partial back to the first chunk that differs (0 when it's a
+different file under the same name), so leftovers never end up in the
+result. a failed whole-file check throws the partial away.
+"""
+import hashlib
+import json
+import os
+
+CHUNK_SIZE = 32 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUpload:
+    """server side state of one upload."""
+
+    def __init__(self, root, name):
+        self.root = root
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.partial = self.path + ".partial"
+        self.state_path = self.partial + ".json"
+        self.chunks = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)["chunks"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _save(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"name": self.name, "chunks": self.chunks}, f)
+        os.replace(tmp, self.state_path)
+
+    @property
+    def offset(self):
+        """end of the last chunk that was written and verified."""
+        if not self.chunks:
+            return 0
+        last = self.chunks[-1]
+        return last["offset"] + last["size"]
+
+    def begin(self, keep=None):
+        """open or resume; drops any bytes past the last good chunk.
+
+        keep: only keep the first `keep` recorded chunks (0 = start over).
+        """
+        os.makedirs(os.path.dirname(self.partial) or ".", exist_ok=True)
+        if keep is not None:
+            self.chunks = self.chunks[:keep]
+        if not os.path.exists(self.partial):
+            self.chunks = []
+            open(self.partial, "wb").close()
+        with open(self.partial, "r+b") as f:
+            f.truncate(self.offset)
+        self._save()
+        return self.offset
+
+    def discard(self):
+        for path in (self.partial, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.chunks = []
+
+    def write(self, offset, data, sha256):
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise UploadError(f"checksum mismatch for chunk at {offset}")
+        current = self.offset
+        if offset < current:
+            # resent chunk, fine if it's the same bytes we already have
+            for chunk in self.chunks:
+                if chunk["offset"] == offset and chunk["sha256"] == sha256:
+                    return current
+            raise UploadError(f"chunk at {offset} conflicts with data already written")
+        if offset > current:
+            raise UploadError(f"gap: got chunk at {offset}, expected {current}")
+
+        with open(self.partial, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.chunks.append({"offset": offset, "size": len(data), "sha256": sha256})
+        self._save()
+        return self.offset
+
+    def finish(self, size=None, sha256=None):
+        """check size/hash and atomically move the file into place."""
+        actual = os.path.getsize(self.partial)
+        if size is not None and actual != size:
+            self.discard()
+            raise UploadError(f"size mismatch: got {actual}, expected {size}, partial discarded")
+        digest = None
+        if sha256 is not None:
+            h = hashlib.sha256()
+            with open(self.partial, "rb") as f:
+                while True:
+                    block = f.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+            digest = h.hexdigest()
+            if digest != sha256:
+                # the partial is unusable, don't leave it around for the next try
+                self.discard()
+                raise UploadError(f"file checksum mismatch: {digest}, partial discarded")
+        os.replace(self.partial, self.path)
+        os.remove(self.state_path)
+        return digest
+
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE, start=0):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def stream_upload(chunks, begin, send, finish, chunk_size=CHUNK_SIZE, fresh=False):
+    """client loop over any iterator of bytes.
+
+    begin(keep) -> (resume offset, recorded chunks), send(offset, data,
+    sha256) -> new offset, finish(size, sha256) -> result. chunks are
+    regrouped to chunk_size; below the resume offset they are hashed and
+    compared with what the server recorded instead of being sent, and the
+    server is cut back to the first one that doesn't match.
+    """
+    offset, recorded = begin(0 if fresh else None)
+    if offset:
+        print(f"resuming upload at {offset / (1024 ** 2):.1f}MB")
+    total = hashlib.sha256()
+    position = 0
+    buffer = bytearray()
+
+    def restart(start):
+        nonlocal offset, recorded
+        keep = sum(1 for c in recorded if c["offset"] < start)
+        print(f"server partial differs at {start / (1024 ** 2):.1f}MB, resending from there")
+        offset, recorded = begin(keep)
+
+    def flush(start, data):
+        nonlocal offset
+        if start < offset:
+            digest = hashlib.sha256(data).hexdigest()
+            if any(c["offset"] == start and c["size"] == len(data) and c["sha256"] == digest
+                   for c in recorded):
+                return  # server already has exactly these bytes
+            restart(start)
+        digest = hashlib.sha256(data).hexdigest()
+        offset = send(start, bytes(data), digest)
+
+    for piece in chunks:
+        total.update(piece)
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            data = buffer[:chunk_size]
+            del buffer[:chunk_size]
+            flush(position, data)
+            position += len(data)
+    if buffer:
+        flush(position, buffer)
+        position += len(buffer)
+    if offset > position:
+        # server holds more than this file, drop the tail
+        restart(position)
+    return finish(position, total.hexdigest())
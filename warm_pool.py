@@ -0,0 +1,56 @@
+"""schedule based warm pool
+
+[[warm_pool.windows]] entries keep `min_containers` warm for the listed
+functions on the given days between start and end (local time in
+warm_pool.timezone; a window may run past midnight). outside every
+window a function goes back to 0. desired() is pure, the cron function
+in app.py applies its result with update_autoscaler.
+"""
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def parse_days(spec):
+    """"mon-fri", "sat,sun", "mon-wed,fri" or "*" -> set of weekday numbers (mon = 0)."""
+    spec = spec.strip().lower()
+    if spec in ("*", "all", "daily"):
+        return set(range(7))
+    days = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = (DAYS.index(p.strip()[:3]) for p in part.split("-", 1))
+            span = range(first, last + 1) if first <= last else list(range(first, 7)) + list(range(0, last + 1))
+            days.update(span)
+        elif part[:3] in DAYS:
+            days.add(DAYS.index(part[:3]))
+        else:
+            raise ValueError(f"unknown day: {part!r}")
+    return days
+
+
+def _minutes(clock):
+    hours, minutes = clock.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def in_window(window, now):
+    """now: timezone aware datetime in the pool's timezone."""
+    start, end = _minutes(window["start"]), _minutes(window["end"])
+    minute = now.hour * 60 + now.minute
+    days = parse_days(window["days"])
+    if start <= end:
+        return now.weekday() in days and start <= minute < end
+    # past midnight: the late part belongs to the day the window started
+    if minute >= start:
+        return now.weekday() in days
+    return minute < end and (now.weekday() - 1) % 7 in days
+
+
+def desired(windows, now):
+    """{function: min_containers} for every function any window mentions."""
+    targets = {}
+    for window in windows:
+        active = in_window(window, now)
+        for name in window["functions"]:
+            targets[name] = max(targets.get(name, 0), window["min_containers"] if active else 0)
+    return targets
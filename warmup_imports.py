@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""build-time warmup for kohya_image
+
+runs inside the image build, after everything is installed:
+1. byte-compile site-packages and the kohya_ss / sd-scripts trees
+2. import the modules the gui and training scripts load, so any first
+   import side effects (compiled caches, generated files) land in the image
+3. profile those imports with `-X importtime` and keep the result as a
+   build artifact (<out>/importtime.log + <out>/import_profile.json)
+
+usage: python warmup_imports.py [--out /kohya_ss/.build]
+"""
+import argparse
+import compileall
+import json
+import os
+import py_compile
+import subprocess
+import sys
+import sysconfig
+import time
+
+KOHYA_BASE = "/kohya_ss"
+SD_SCRIPTS = "/kohya_ss/sd-scripts"
+
+# what kohya_gui.py and train_network.py / sdxl_train_network.py pull in
+WARM_MODULES = [
+    "torch",
+    "torchvision",
+    "xformers",
+    "bitsandbytes",
+    "safetensors",
+    "transformers",
+    "diffusers",
+    "accelerate",
+    "gradio",
+    "kohya_gui.common_gui",
+    "kohya_gui.lora_gui",
+    "kohya_gui.dreambooth_gui",
+    "kohya_gui.finetune_gui",
+    "kohya_gui.utilities",
+    "library.train_util",
+    "library.sdxl_train_util",
+    "library.model_util",
+    "networks.lora",
+]
+
+
+def compile_trees(paths):
+    # unchecked-hash pycs skip the mtime check on import, the image never changes
+    mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    results = {}
+    for path in paths:
+        if not os.path.isdir(path):
+            continue
+        start = time.monotonic()
+        ok = compileall.compile_dir(
+            path, quiet=1, workers=0, invalidation_mode=mode
+        )
+        results[path] = {"ok": bool(ok), "seconds": round(time.monotonic() - start, 2)}
+        print(f"compiled {path} in {results[path]['seconds']}s")
+    return results
+
+
+def parse_importtime(stderr):
+    """-X importtime lines -> {module: (self_us, cumulative_us)}"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, rest = line.split(":", 1)
+            self_us, cumulative, name = [p.strip() for p in rest.split("|")]
+            timings[name] = (int(self_us), int(cumulative))
+        except ValueError:
+            continue
+    return timings
+
+
+def profile_import(module, env):
+    """fresh interpreter per module so each one is timed cold."""
+    start = time.monotonic()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=KOHYA_BASE,
+        env=env,
+    )
+    wall = time.monotonic() - start
+    timings = parse_importtime(proc.stderr)
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "wall_s": round(wall, 3),
+        "cumulative_us": timings.get(module, (0, 0))[1],
+        "deps": len(timings),
+    }, proc.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=os.path.join(KOHYA_BASE, ".build"))
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    site = {sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"]}
+    compiled = compile_trees(sorted(site) + [KOHYA_BASE, SD_SCRIPTS])
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([KOHYA_BASE, SD_SCRIPTS, env.get("PYTHONPATH", "")])
+
+    modules = []
+    slowest = {}
+    with open(os.path.join(args.out, "importtime.log"), "w") as log:
+        for module in WARM_MODULES:
+            result, stderr = profile_import(module, env)
+            modules.append(result)
+            log.write(f"### {module}\n{stderr}\n")
+            for name, (self_us, _) in parse_importtime(stderr).items():
+                slowest[name] = max(slowest.get(name, 0), self_us)
+            status = "ok" if result["ok"] else "FAILED"
+            print(f"import {module}: {result['wall_s']}s {status}")
+
+    profile = {
+        "built_at": time.time(),
+        "python": sys.version.split()[0],
+        "kohya_version_date": os.environ.get("KOHYA_VERSION_DATE"),
+        "compiled": compiled,
+        "modules": modules,
+        "slowest_self_us": dict(sorted(slowest.items(), key=lambda kv: -kv[1])[:30]),
+    }
+    with open(os.path.join(args.out, "import_profile.json"), "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"import profile written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""resolve kohya_image's dependencies once into the kohya-wheelhouse volume
+
+    modal run wheelhouse.py [--kohya-ref main] [--sd-scripts-ref main]
+
+(or `python deploy.py lock`) pins both repos to a commit, resolves
+kohya's requirements.txt plus the torch/xformers/bitsandbytes pins in one
+pip run, builds wheels for anything that only ships an sdist, stores every
+wheel in the volume and writes image.lock with their sha256.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+import modal
+
+from image_lock import (
+    KOHYA_REPO_URL, LOCK_FILE, PINNED, SD_SCRIPTS_URL, TORCH_INDEX, WHEEL_PATH,
+    clone_commands, filter_requirements, remote_sha, requirement_lines, wheel_name, write_lock,
+)
+
+PYTHON_VERSION = "3.10"  # same as app.py's image
+wheel_vol = modal.Volume.from_name("kohya-wheelhouse", create_if_missing=True)
+
+image = (
+    modal.Image.debian_slim(python_version=PYTHON_VERSION)
+    .apt_install("git", "build-essential")
+    .pip_install("toml")
+    .add_local_python_source("image_lock")
+)
+
+app = modal.App(name="kohya-wheelhouse", image=image)
+
+
+@app.function(volumes={WHEEL_PATH: wheel_vol}, timeout=3600, cpu=4, memory=8192)
+def resolve(kohya_ref: str = "HEAD", sd_scripts_ref: str = "HEAD"):
+    """pin, resolve and store. returns what image.lock needs."""
+    repos = {
+        "kohya_ss": remote_sha(KOHYA_REPO_URL, kohya_ref),
+        "sd_scripts": remote_sha(SD_SCRIPTS_URL, sd_scripts_ref),
+    }
+    with tempfile.TemporaryDirectory() as work:
+        src = os.path.join(work, "kohya_ss")
+        for command in clone_commands(KOHYA_REPO_URL, repos["kohya_ss"], src):
+            subprocess.run(command, shell=True, check=True)
+        with open(os.path.join(src, "requirements.txt")) as f:
+            requirements = filter_requirements(f.read())
+
+        # the wheelhouse is a find-links source, only new files hit the network
+        resolved = os.path.join(work, "resolved")
+        subprocess.run(
+            ["pip", "download", "--timeout", "600", "-d", resolved,
+             "--find-links", WHEEL_PATH, "--extra-index-url", TORCH_INDEX,
+             *PINNED, *requirements],
+            check=True,
+        )
+        for name in os.listdir(resolved):
+            if not name.endswith(".whl"):
+                # sdist -> wheel once here, so the image build never compiles
+                subprocess.run(
+                    ["pip", "wheel", "--no-deps", "-w", resolved, os.path.join(resolved, name)],
+                    check=True,
+                )
+                os.remove(os.path.join(resolved, name))
+
+        files = sorted(os.listdir(resolved))
+        added = 0
+        for name in files:
+            dest = os.path.join(WHEEL_PATH, name)
+            if not os.path.exists(dest):
+                shutil.copy2(os.path.join(resolved, name), dest)
+                added += 1
+        wheel_vol.commit()
+        lines = requirement_lines(resolved, files)
+
+    return {
+        "repos": repos,
+        "requirements": lines,
+        "python": PYTHON_VERSION,
+        "added": added,
+        "total": len(files),
+        "wheels": [wheel_name(name) for name in files],
+    }
+
+
+@app.local_entrypoint()
+def main(kohya_ref: str = "HEAD", sd_scripts_ref: str = "HEAD"):
+    result = resolve.remote(kohya_ref, sd_scripts_ref)
+    write_lock(LOCK_FILE, result["repos"], result["requirements"], result["python"])
+    print(f"kohya_ss   {result['repos']['kohya_ss']}")
+    print(f"sd-scripts {result['repos']['sd_scripts']}")
+    print(f"{result['total']} wheels locked, {result['added']} new in kohya-wheelhouse")
+    print(f"wrote {LOCK_FILE}")